@@ -0,0 +1,236 @@
+# Local stand-in for the cloud endpoints the bridges talk to, used by the load test.
+#
+# One HTTP server answers the requests of every bridge, routed by method, path and headers:
+#   POST /identity/token                      IBM Cloud IAM
+#   GET  /api/v2/secrets/<secret_id>          IBM Cloud Secrets Manager
+#   POST /<tenant_id>/oauth2/v2.0/token       Azure AD
+#   GET  /secrets/<secret_name>               Azure Key Vault
+#   POST / with X-Amz-Target                  AWS Secrets Manager GetSecretValue and BatchGetSecretValue
+#   POST / with Action=AssumeRole             AWS STS
+#
+# Every response is delayed by --latency-ms plus a random jitter, and --error-rate of the vault and IAM requests
+# fail with a 503, so the retry policy and circuit breaker of the bridge are exercised as well. Secret ids starting
+# with "missing" are not found. Point the bridge at the server with:
+#   IBM_CLOUD_IAM_URL=http://127.0.0.1:<port>/identity/token
+#   AZURE_IAM_URL=http://127.0.0.1:<port>
+#   AWS_ENDPOINT_URL_STS=http://127.0.0.1:<port>
+# and vault_url=http://127.0.0.1:<port> in the Vault-Auth header of IBM and Azure requests. The Secrets Manager
+# requests of the AWS bridges are sent to the server by gunicorn -c benchmarks/gunicorn_config.py with
+# BENCHMARK_SECRETS_MANAGER_URL=http://127.0.0.1:<port>, as benchmarks.load_test does.
+#
+# usage: python -m benchmarks.fake_servers [--port N] [--latency-ms N] [--jitter-ms N] [--error-rate F]
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+TOKEN_LIFETIME = 3600
+
+STS_RESPONSE = """<AssumeRoleResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <AssumeRoleResult>
+    <Credentials>
+      <AccessKeyId>ASIABENCHMARK</AccessKeyId>
+      <SecretAccessKey>benchmark-secret-access-key</SecretAccessKey>
+      <SessionToken>benchmark-session-token</SessionToken>
+      <Expiration>{expiration}</Expiration>
+    </Credentials>
+    <AssumedRoleUser>
+      <AssumedRoleId>AROABENCHMARK:{session_name}</AssumedRoleId>
+      <Arn>{role_arn}/{session_name}</Arn>
+    </AssumedRoleUser>
+  </AssumeRoleResult>
+  <ResponseMetadata>
+    <RequestId>benchmark</RequestId>
+  </ResponseMetadata>
+</AssumeRoleResponse>"""
+
+
+# settings of the running server and number of requests it answered per endpoint
+class FakeServerState(object):
+    def __init__(self, latency_ms, jitter_ms, error_rate):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    # @param {string} endpoint — name of the endpoint
+    def count(self, endpoint):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+
+# @param {string} secret_id — secret id or name
+#
+# @returns {dict} credentials of the secret
+def buildCredentials(secret_id):
+    return {"username": "user-" + secret_id, "password": "password-" + secret_id}
+
+
+class FakeServerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without this every response waits for the delayed ACK of the client
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # @param {int} code — http status code
+    # @param {string} body — response body
+    # @param {string} content_type — response content type
+    def sendBody(self, code, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # @param {string} endpoint — name of the endpoint
+    #
+    # @returns {bool} true if the request was answered with a simulated failure
+    def simulate(self, endpoint):
+        self.state.count(endpoint)
+        delay = self.state.latency_ms + random.uniform(0, self.state.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if random.random() < self.state.error_rate:
+            self.sendBody(503, json.dumps({"error": "simulated failure"}))
+            return True
+        return False
+
+    # @returns {string} request body
+    def readBody(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length).decode("utf-8") if length > 0 else ""
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/api/v2/secrets/"):
+            if self.simulate("ibm_secret"):
+                return
+            secret_id = path[len("/api/v2/secrets/"):]
+            if secret_id.startswith("missing"):
+                return self.sendBody(404, json.dumps({"errors": [{"message": "secret not found"}]}))
+            secret = dict(buildCredentials(secret_id), secret_type="username_password", id=secret_id)
+            return self.sendBody(200, json.dumps(secret))
+
+        if path.startswith("/secrets/"):
+            if self.simulate("azure_secret"):
+                return
+            secret_name = path[len("/secrets/"):]
+            if secret_name.startswith("missing"):
+                return self.sendBody(404, json.dumps({"error": {"code": "SecretNotFound"}}))
+            return self.sendBody(200, json.dumps({"value": json.dumps(buildCredentials(secret_name)), "id": secret_name}))
+
+        self.sendBody(404, json.dumps({"error": "not found"}))
+
+    def do_POST(self):
+        body = self.readBody()
+        path = self.path.split("?", 1)[0]
+
+        if path == "/identity/token":
+            if self.simulate("ibm_iam"):
+                return
+            return self.sendBody(200, json.dumps({"access_token": "ibm-benchmark-token", "expiration": int(time.time()) + TOKEN_LIFETIME}))
+
+        if path.endswith("/oauth2/v2.0/token"):
+            if self.simulate("azure_ad"):
+                return
+            return self.sendBody(200, json.dumps({"access_token": "azure-benchmark-token", "expires_in": TOKEN_LIFETIME}))
+
+        target = self.headers.get("X-Amz-Target", "")
+        if target == "secretsmanager.GetSecretValue":
+            if self.simulate("aws_get_secret_value"):
+                return
+            return self.sendAwsSecret(json.loads(body)["SecretId"])
+
+        if target == "secretsmanager.BatchGetSecretValue":
+            if self.simulate("aws_batch_get_secret_value"):
+                return
+            return self.sendAwsSecrets(json.loads(body)["SecretIdList"])
+
+        form = parse_qs(body)
+        if form.get("Action") == ["AssumeRole"]:
+            if self.simulate("aws_sts"):
+                return
+            expiration = (datetime.now(timezone.utc) + timedelta(seconds=TOKEN_LIFETIME)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            response = STS_RESPONSE.format(expiration=expiration, role_arn=form["RoleArn"][0], session_name=form["RoleSessionName"][0])
+            return self.sendBody(200, response, "text/xml")
+
+        self.sendBody(404, json.dumps({"error": "not found"}))
+
+    # @param {string} secret_id — secret id of the GetSecretValue request
+    def sendAwsSecret(self, secret_id):
+        if secret_id.startswith("missing"):
+            return self.sendBody(400, json.dumps({"__type": "ResourceNotFoundException", "Message": "Secrets Manager can't find the specified secret."}))
+        self.sendBody(200, json.dumps(buildAwsSecretValue(secret_id)))
+
+    # @param {array} secret_ids — secret ids of the BatchGetSecretValue request
+    def sendAwsSecrets(self, secret_ids):
+        values, errors = [], []
+        for secret_id in secret_ids:
+            if secret_id.startswith("missing"):
+                errors.append({"SecretId": secret_id, "ErrorCode": "ResourceNotFoundException", "Message": "Secrets Manager can't find the specified secret."})
+            else:
+                values.append(buildAwsSecretValue(secret_id))
+        self.sendBody(200, json.dumps({"SecretValues": values, "Errors": errors}))
+
+
+# @param {string} secret_id — secret id
+#
+# @returns {dict} secret value entry in the GetSecretValue response format
+def buildAwsSecretValue(secret_id):
+    return {
+        "ARN": f"arn:aws:secretsmanager:us-east-1:000000000000:secret:{secret_id}-AbCdEf",
+        "Name": secret_id,
+        "SecretString": json.dumps(buildCredentials(secret_id)),
+        "VersionId": "benchmark",
+        "CreatedDate": time.time()
+    }
+
+
+# the bridges open many connections at once under load, the default listen backlog of 5 drops most of them
+# and the clients only connect again after a second
+class FakeHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 1024
+
+
+# @param {int} port — port to listen on, 0 for any free port
+# @param {float} latency_ms — milliseconds every response is delayed by
+# @param {float} jitter_ms — maximum random milliseconds added to the delay
+# @param {float} error_rate — fraction of requests answered with a 503
+#
+# @returns {FakeHTTPServer} server running on a daemon thread
+def startFakeServer(port=0, latency_ms=0, jitter_ms=0, error_rate=0):
+    handler = type("BoundFakeServerHandler", (FakeServerHandler,), {"state": FakeServerState(latency_ms, jitter_ms, error_rate)})
+    server = FakeHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-server", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the IBM, Azure and AWS endpoints of the bridges")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    server = startFakeServer(args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"fake servers listening on http://127.0.0.1:{server.server_address[1]}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+# gunicorn configuration of the load test, the AWS bridges sign their requests for the vault url of the Vault-Auth
+# header, an AWS endpoint, and this hook sends them to the stand-in servers at BENCHMARK_SECRETS_MANAGER_URL instead.
+#
+# usage: BENCHMARK_SECRETS_MANAGER_URL=http://127.0.0.1:<port> gunicorn --config benchmarks/gunicorn_config.py vault_sdk.wsgi:app
+#        or the same with -k uvicorn.workers.UvicornWorker vault_sdk.asgi:app
+import os
+
+BENCHMARK_SECRETS_MANAGER_URL = os.environ.get('BENCHMARK_SECRETS_MANAGER_URL', '')
+
+
+# runs in every worker once the app is loaded
+def post_worker_init(worker):
+    if BENCHMARK_SECRETS_MANAGER_URL == '':
+        return
+
+    from vault_sdk.bridges_common import aws_batch
+    from vault_sdk.bridges.aws_secrets_manager import aws_secrets_manager_bridge
+    from vault_sdk.bridges.aws_secrets_manager_sts import aws_secrets_manager_sts_bridge
+
+    # the bridges import the function by name, so it is replaced in every module
+    for module in (aws_batch, aws_secrets_manager_bridge, aws_secrets_manager_sts_bridge):
+        module.getSecretsManagerEndpoint = lambda vault_url: BENCHMARK_SECRETS_MANAGER_URL
+    worker.log.info("Secrets Manager requests are sent to %s", BENCHMARK_SECRETS_MANAGER_URL)
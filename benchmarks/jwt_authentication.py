@@ -0,0 +1,77 @@
+# Benchmark of the JWT authentication cost on the single-secret endpoint.
+#
+# Sends GET /v2/vault-bridges/<vault_type>/secrets/<secret_urn> through the Flask test client with an unsupported
+# vault type, so every request runs validateParams() and authenticate() and then stops before any vault call.
+# The same bearer token is reused for every request, as the Platform Core API does, and the run is repeated with
+# the verified JWT cache disabled and enabled.
+#
+# usage: python -m benchmarks.jwt_authentication [--requests N]
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from vault_sdk.framework import utils, caches
+from vault_sdk.routes import app
+
+
+def buildHeadersAndQuery():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    utils.JWT_PUBLIC_KEY_VALUE = private_key.public_key()
+
+    claims = {"sub": "benchmark", "aud": "ZEN-VAULT-BRIDGE", "iss": "ZEN-SECRETS", "exp": int(time.time()) + 3600}
+    token = jwt.encode(claims, private_key, algorithm="RS256")
+
+    headers = {
+        "Authorization": "Bearer " + token,
+        "Vault-Auth": base64.b64encode(b"vault_url=https://vault.example.com;api_key=benchmark").decode('utf-8'),
+        "IBM-CPD-Transaction-ID": "benchmark"
+    }
+    query = {
+        "secret_type": "credentials",
+        "secret_reference_metadata": base64.b64encode(json.dumps({"secret_id": "benchmark"}).encode('utf-8')).decode('utf-8')
+    }
+    return headers, query
+
+
+def run(client, headers, query, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        response = client.get("/v2/vault-bridges/unsupported-vault/secrets/benchmark", headers=headers, query_string=query)
+        if response.status_code != 400:
+            raise RuntimeError(f"unexpected status code {response.status_code}")
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JWT authentication benchmark on the single-secret endpoint")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    # requests in this benchmark are rejected on purpose, keep the error log quiet
+    app.logger.setLevel("CRITICAL")
+    client = app.test_client()
+    headers, query = buildHeadersAndQuery()
+
+    results = {}
+    for name, ttl in (("uncached", 0), ("cached", 300)):
+        utils.JWT_CACHE_MAX_TTL = ttl
+        caches.CACHED_JWT.clear()
+        run(client, headers, query, 50)
+        results[name] = run(client, headers, query, args.requests)
+        print(f"{name:>10}: {results[name]:8.1f} us per request")
+
+    print(f"{'speedup':>10}: {results['uncached'] / results['cached']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
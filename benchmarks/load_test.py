@@ -0,0 +1,380 @@
+# End-to-end load test of the vault bridge served by gunicorn against the local stand-in servers.
+#
+# Starts benchmarks.fake_servers and gunicorn with vault_sdk.wsgi:app in subprocesses, then drives each scenario
+# with --concurrency client threads for --duration seconds after a --warmup, and reports per scenario the
+# throughput, p50/p95/p99 latency, the error count and the peak thread count and RSS of the gunicorn processes.
+# A scenario is <vault>-<endpoint>, vault in ibm | azure | aws | aws-sts and endpoint in single | bulk, for example
+# ibm-single reads one secret per request and aws-bulk reads --bulk-size secrets per request.
+#
+# The client threads share one Python process, so keep an eye on the client CPU when comparing high throughputs.
+# Environment variables of the caller are passed to gunicorn, so caches and pools can be tuned per run, for example
+# SECRET_CACHE_TTL=30 python -m benchmarks.load_test --scenarios ibm-single
+#
+# The async server is measured with its app and worker class, for example
+# python -m benchmarks.load_test --app vault_sdk.asgi:app --worker-class uvicorn.workers.UvicornWorker
+#
+# usage: python -m benchmarks.load_test [--scenarios S,S] [--duration N] [--concurrency N] [--workers N] [--threads N]
+#                                       [--worker-class C] [--app A] [--latency-ms N] [--error-rate F] [--bulk-size N] [--output FILE]
+import argparse
+import base64
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import jwt
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+VAULT_TYPES = {
+    "ibm": "ibm-cloud-secrets-manager",
+    "azure": "azure-key-vault",
+    "aws": "aws-secrets-manager",
+    "aws-sts": "aws-secrets-manager-sts",
+}
+ENDPOINTS = ("single", "bulk")
+SCENARIOS = [f"{vault}-{endpoint}" for vault in VAULT_TYPES for endpoint in ENDPOINTS]
+
+AWS_VAULT_URL = "https://secretsmanager.us-east-1.amazonaws.com"
+# sends the Secrets Manager requests of the AWS bridges to the stand-in servers
+GUNICORN_CONFIG_PATH = os.path.join(current, "gunicorn_config.py")
+STARTUP_TIMEOUT = 30
+SAMPLE_INTERVAL = 0.5
+
+
+# @returns {int} free local port
+def findFreePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# @param {string} directory — directory the public key is written to
+#
+# @returns {string} bearer token accepted by the bridge
+# @returns {string} path of the public key the bridge verifies the token with
+def buildJWT(directory):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_key_path = os.path.join(directory, "jwt_public.pem")
+    with open(public_key_path, "wb") as f:
+        f.write(private_key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+
+    claims = {"sub": "benchmark", "aud": "ZEN-VAULT-BRIDGE", "iss": "ZEN-SECRETS", "exp": int(time.time()) + 24 * 3600}
+    return jwt.encode(claims, private_key, algorithm="RS256"), public_key_path
+
+
+# @param {string} vault — ibm | azure | aws | aws-sts
+# @param {string} fake_url — url of the stand-in servers
+#
+# @returns {string} Vault-Auth header of the vault
+def buildVaultAuth(vault, fake_url):
+    if vault == "ibm":
+        auth = f"vault_url={fake_url};api_key=benchmark-api-key"
+    elif vault == "azure":
+        auth = f"vault_url={fake_url};tenant_id=benchmark-tenant;client_id=benchmark-client;client_secret=benchmark-secret"
+    elif vault == "aws":
+        auth = f"vault_url={AWS_VAULT_URL};access_key_id=AKIABENCHMARK;secret_access_key=benchmark-secret-access-key"
+    else:
+        auth = f"vault_url={AWS_VAULT_URL};role_arn=arn:aws:iam::000000000000:role/benchmark;session_name=benchmark"
+    return base64.b64encode(auth.encode("utf-8")).decode("utf-8")
+
+
+# @param {string} vault — ibm | azure | aws | aws-sts
+# @param {string} secret_id — secret id or name
+#
+# @returns {dict} secret reference of the secret
+def buildSecretReference(vault, secret_id):
+    if vault == "azure":
+        return {"secret_name": secret_id}
+    return {"secret_id": secret_id}
+
+
+# @param {dict} reference — secret reference
+#
+# @returns {string} base64 encoded json of the reference
+def encodeReference(reference):
+    return base64.b64encode(json.dumps(reference).encode("utf-8")).decode("utf-8")
+
+
+# @param {string} scenario — scenario name
+# @param {string} base_url — url of the bridge
+# @param {dict} args — command line arguments
+#
+# @returns {function} function returning the url and query of the next request of a client
+def buildRequestFactory(scenario, base_url, args):
+    vault, endpoint = scenario.rsplit("-", 1)
+    vault_type = VAULT_TYPES[vault]
+    secret_ids = [f"benchmark-secret-{i}" for i in range(args.distinct_secrets)]
+
+    if endpoint == "single":
+        def nextRequest(counter):
+            secret_id = secret_ids[counter % len(secret_ids)]
+            query = {"secret_type": "credentials", "secret_reference_metadata": encodeReference(buildSecretReference(vault, secret_id))}
+            return f"{base_url}/v2/vault-bridges/{vault_type}/secrets/{secret_id}", query
+        return nextRequest
+
+    def nextRequest(counter):
+        references = []
+        for i in range(args.bulk_size):
+            secret_id = secret_ids[(counter * args.bulk_size + i) % len(secret_ids)]
+            references.append(dict(buildSecretReference(vault, secret_id), secret_urn=f"urn-{i}", secret_type="credentials"))
+        return f"{base_url}/v2/vault-bridges/{vault_type}/secrets/bulk", {"secret_reference_metadata": encodeReference(references)}
+    return nextRequest
+
+
+# @param {int} pid — process id
+#
+# @returns {dict} rss in bytes and thread count of the process, empty if it has exited
+def readProcessStatus(pid):
+    status = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    status["rss"] = int(line.split()[1]) * 1024
+                elif line.startswith("Threads:"):
+                    status["threads"] = int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return status
+
+
+# @param {int} pid — process id of the gunicorn master
+#
+# @returns {array} process ids of the master and its workers
+def listProcessTree(pid):
+    pids = [pid]
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the command name can contain spaces, the parent pid is the second field after it
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (FileNotFoundError, ProcessLookupError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            pids.append(int(entry))
+    return pids
+
+
+# samples the rss and thread count of the gunicorn processes while a scenario runs
+class ResourceSampler(object):
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="resource-sampler", daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            statuses = [readProcessStatus(pid) for pid in listProcessTree(self.pid)]
+            self.peak_rss = max(self.peak_rss, sum(status.get("rss", 0) for status in statuses))
+            self.peak_threads = max(self.peak_threads, sum(status.get("threads", 0) for status in statuses))
+            self.stopped.wait(SAMPLE_INTERVAL)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+# @param {array} values — sorted values
+# @param {float} percentile — percentile between 0 and 100
+#
+# @returns {float} nearest-rank percentile of the values
+def getPercentile(values, percentile):
+    if len(values) == 0:
+        return 0.0
+    return values[max(int(math.ceil(percentile / 100 * len(values))) - 1, 0)]
+
+
+# @param {function} next_request — function returning the url and query of the next request
+# @param {dict} headers — request headers
+# @param {dict} args — command line arguments
+# @param {int} pid — process id of the gunicorn master
+#
+# @returns {dict} results of the scenario
+def runScenario(next_request, headers, args, pid):
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    measure_from = time.monotonic() + args.warmup
+    stop_at = measure_from + args.duration
+
+    def client(index):
+        session = requests.Session()
+        counter = index
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                return
+            url, query = next_request(counter)
+            counter += args.concurrency
+            start = time.perf_counter()
+            try:
+                status_code = session.get(url, params=query, headers=headers, timeout=60).status_code
+            except requests.RequestException as err:
+                status_code = type(err).__name__
+            latency = time.perf_counter() - start
+            if now < measure_from:
+                continue
+            with lock:
+                latencies.append(latency)
+                if status_code != 200:
+                    errors[str(status_code)] = errors.get(str(status_code), 0) + 1
+
+    sampler = ResourceSampler(pid)
+    sampler.start()
+    clients = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    sampler.stop()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / args.duration,
+        "p50_ms": getPercentile(latencies, 50) * 1000,
+        "p95_ms": getPercentile(latencies, 95) * 1000,
+        "p99_ms": getPercentile(latencies, 99) * 1000,
+        "errors": errors,
+        "peak_threads": sampler.peak_threads,
+        "peak_rss_mb": sampler.peak_rss / (1024 * 1024),
+    }
+
+
+# @param {array} command — command line
+# @param {dict} env — environment variables
+# @param {string} log_path — file the output is written to
+#
+# @returns {subprocess.Popen} started process
+def startProcess(command, env, log_path):
+    log = open(log_path, "wb")
+    return subprocess.Popen(command, cwd=parent, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+# @param {string} url — url answering 200 once the server is ready
+# @param {subprocess.Popen} process — server process
+# @param {string} log_path — file the output of the process is written to
+def waitForServer(url, process, log_path):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    with open(log_path, errors="replace") as f:
+        output = f.read()[-2000:]
+    raise RuntimeError(f"server at {url} did not start:\n{output}")
+
+
+# @param {subprocess.Popen} process — process to stop
+def stopProcess(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the vault bridge against local stand-in servers")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated scenarios, from " + ", ".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=20, help="seconds measured per scenario")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds run before the measurement of each scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="client threads")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker")
+    parser.add_argument("--worker-class", default="sync", help="gunicorn worker class")
+    parser.add_argument("--app", default="vault_sdk.wsgi:app", help="app served by gunicorn, vault_sdk.asgi:app with an ASGI worker class")
+    parser.add_argument("--latency-ms", type=float, default=20, help="latency of the stand-in servers")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="random latency added by the stand-in servers")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of stand-in requests failing with a 503")
+    parser.add_argument("--bulk-size", type=int, default=20, help="secrets per bulk request")
+    parser.add_argument("--distinct-secrets", type=int, default=100, help="distinct secret ids requested")
+    parser.add_argument("--output", help="file the results are written to as json")
+    args = parser.parse_args()
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario {scenario}")
+
+    work_dir = tempfile.mkdtemp(prefix="vault-bridge-load-test-")
+    token, public_key_path = buildJWT(work_dir)
+    fake_port, bridge_port = findFreePort(), findFreePort()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    bridge_url = f"http://127.0.0.1:{bridge_port}"
+
+    env = dict(os.environ)
+    env.update({
+        "JWT_PUBLIC_KEY_PATH": public_key_path,
+        "IBM_CLOUD_IAM_URL": f"{fake_url}/identity/token",
+        "AZURE_IAM_URL": fake_url,
+        "BENCHMARK_SECRETS_MANAGER_URL": fake_url,
+        "AWS_ENDPOINT_URL_STS": fake_url,
+        "AWS_ACCESS_KEY_ID": env.get("AWS_ACCESS_KEY_ID", "AKIABENCHMARK"),
+        "AWS_SECRET_ACCESS_KEY": env.get("AWS_SECRET_ACCESS_KEY", "benchmark-secret-access-key"),
+    })
+
+    fake_log, bridge_log = os.path.join(work_dir, "fake_servers.log"), os.path.join(work_dir, "gunicorn.log")
+    fake_server = startProcess([sys.executable, "-m", "benchmarks.fake_servers", "--port", str(fake_port), "--latency-ms", str(args.latency_ms),
+                                "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate)], env, fake_log)
+    bridge = None
+    try:
+        waitForServer(f"{fake_url}/", fake_server, fake_log)
+        bridge = startProcess([sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{bridge_port}", "--workers", str(args.workers),
+                               "--threads", str(args.threads), "--worker-class", args.worker_class, "--timeout", "120", "--config", GUNICORN_CONFIG_PATH, args.app], env, bridge_log)
+        waitForServer(f"{bridge_url}/v2/health", bridge, bridge_log)
+
+        print(f"gunicorn: {args.app}, {args.workers} {args.worker_class} workers x {args.threads} threads, {args.concurrency} clients, "
+              f"stand-in latency {args.latency_ms}+{args.jitter_ms} ms, error rate {args.error_rate}, logs in {work_dir}")
+        print(f"{'scenario':<16}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'threads':>9}{'rss MB':>9}")
+
+        results = {}
+        for scenario in scenarios:
+            vault = scenario.rsplit("-", 1)[0]
+            headers = {
+                "Authorization": "Bearer " + token,
+                "Vault-Auth": buildVaultAuth(vault, fake_url),
+                "IBM-CPD-Transaction-ID": "load-test-" + scenario,
+            }
+            result = runScenario(buildRequestFactory(scenario, bridge_url, args), headers, args, bridge.pid)
+            results[scenario] = result
+            print(f"{scenario:<16}{result['throughput']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+                  f"{sum(result['errors'].values()):>8}{result['peak_threads']:>9}{result['peak_rss_mb']:>9.1f}", flush=True)
+            if result["errors"]:
+                print(f"{'':<16}errors by status: {json.dumps(result['errors'])}")
+    finally:
+        if bridge is not None:
+            stopProcess(bridge)
+        stopProcess(fake_server)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": {key: value for key, value in vars(args).items() if key != "output"}, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Microbenchmark of the per-request SigV4 signing cost of the AWS bridges.
+#
+# Compares generateHeaders() when the derived signing key has to be recomputed for every request
+# (the behaviour before the signing key cache) with generateHeaders() served from the cache.
+#
+# usage: python -m benchmarks.sigv4_signing [--iterations N]
+import argparse
+import base64
+import os
+import sys
+import timeit
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from vault_sdk.bridges_common import aws_signing
+from vault_sdk.bridges.aws_secrets_manager.aws_secrets_manager_bridge import AWSSecretsManager
+
+VAULT_AUTH = "vault_url=https://secretsmanager.us-east-1.amazonaws.com;access_key_id=AKIAEXAMPLE;secret_access_key=wJalrXUtnFEMI/K7MDENG/bPxRfiCYEXAMPLEKEY"
+PAYLOAD = '{"SecretId": "my-app-secret"}'
+
+
+def buildVault():
+    auth_string = base64.b64encode(VAULT_AUTH.encode('utf-8')).decode('utf-8')
+    vault = AWSSecretsManager("", "credentials", "", auth_string, "benchmark")
+    error, _ = vault.extractFromVaultAuthHeader()
+    if error is not None:
+        raise RuntimeError(error)
+    return vault
+
+
+def signUncached(vault):
+    aws_signing.CACHED_SIGNING_KEY.clear()
+    vault.generateHeaders(PAYLOAD)
+
+
+def signCached(vault):
+    vault.generateHeaders(PAYLOAD)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SigV4 signing microbenchmark")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    vault = buildVault()
+    results = {}
+    for name, func in (("uncached", signUncached), ("cached", signCached)):
+        func(vault)
+        seconds = min(timeit.repeat(lambda: func(vault), number=args.iterations, repeat=5))
+        results[name] = seconds / args.iterations * 1e6
+        print(f"{name:>10}: {results[name]:8.2f} us per request")
+
+    print(f"{'speedup':>10}: {results['uncached'] / results['cached']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
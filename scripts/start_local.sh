@@ -1,9 +1,61 @@
 #!/bin/sh
 
 # export LOGGING_LEVEL='INFO' # {DEBUG | INFO(default) | ERROR | CRITICAL}
+# export LOG_FORMAT='text' # {text(default) | json} json writes one object per line with transaction_id, secret_urn, function and file fields
+# export LOG_ASYNC='true' # lines are written by a background thread, 'false' writes them from the request thread
+# export LOG_REPEAT_WINDOW=10 # seconds during which identical warnings and errors beyond LOG_REPEAT_BURST are counted into one summary line, 0 disables
+# export LOG_REPEAT_BURST=5
 # export SKIP_TLS_VERIFY='false'
-# export VAULT_REQUEST_TIMEOUT=20
+# export VAULT_REQUEST_TIMEOUT=20 # read timeout; every VAULT_REQUEST_* setting can be overridden per vault type e.g. VAULT_REQUEST_TIMEOUT_AZURE_KEY_VAULT=10
+# export VAULT_REQUEST_CONNECT_TIMEOUT=5
+# export VAULT_REQUEST_TOTAL_TIMEOUT=30 # seconds all attempts and retry delays of a request may take, 0 disables the budget
 # export VAULT_REQUEST_RETRY_COUNT=5
+# export VAULT_REQUEST_RETRY_BACKOFF_FACTOR=0.5
+# export VAULT_REQUEST_RETRY_MAX_DELAY=8
+# export CIRCUIT_BREAKER_ENABLED='true'
+# export CIRCUIT_BREAKER_WINDOW=30 # seconds
+# export CIRCUIT_BREAKER_MIN_REQUESTS=20
+# export CIRCUIT_BREAKER_FAILURE_RATE=0.5
+# export CIRCUIT_BREAKER_COOLDOWN=30 # seconds
+# export CIRCUIT_BREAKER_HALF_OPEN_REQUESTS=1
+# export CIRCUIT_BREAKER_MAX_HOSTS=256 # least recently used breakers are dropped beyond it
+# export VAULT_CONNECTION_POOL_SIZE=32
+# export VAULT_CONNECTION_POOL_MAXSIZE=10
+# export VAULT_CONNECTION_POOL_IDLE_TIMEOUT=300
+# export BULK_MAX_WORKERS=32
+# export BULK_MAX_CONCURRENCY_PER_REQUEST=8
+# export BULK_MAX_BODY_BYTES=16777216 # decompressed body of a bulk POST request
+# export BULK_MAX_REFERENCES=10000
+# export SECRET_CACHE_TTL=0 # seconds, 0 disables the secret cache; per vault type e.g. SECRET_CACHE_TTL_AZURE_KEY_VAULT=30
+# export SECRET_CACHE_MAX_BYTES=4194304
+# export TOKEN_FETCH_WAIT_TIMEOUT=30
+# export TOKEN_REFRESH_AHEAD='false'
+# export TOKEN_REFRESH_AHEAD_FRACTION=0.75
+# export TOKEN_REFRESH_IDLE_TIMEOUT=300
+# export TOKEN_REFRESH_INTERVAL=10
+# export SHARED_TOKEN_CACHE_DIR="/dev/shm/vault-bridge-tokens" # shared by all gunicorn workers of the pod, unset to cache tokens per worker
+# export CACHE_BACKEND=redis # memory | redis | memcached, shared by all replicas, unset to keep the caches per worker
+# export CACHE_BACKEND_URL="redis://:password@redis:6379/0" # rediss:// for TLS, or memcached://memcached:11211
+# export CACHE_ENCRYPTION_KEY="<Fernet key>" # required with CACHE_BACKEND, every cached value is encrypted with it
+# export CACHE_BACKEND_TIMEOUT=0.2 # seconds
+# export CACHE_BACKEND_POOL_SIZE=8
+# export CACHE_BACKEND_KEY_PREFIX="vault-bridge"
+# export JWT_CACHE_MAX_TTL=300 # seconds, 0 disables the verified JWT cache
+# export JWT_CACHE_SIZE=1024
+# export ASGI_MAX_WORKERS=64 # only used when serving vault_sdk.asgi:app, threads parsing and validating requests, the vault calls hold no thread
+# export VAULT_ASYNC_MAX_CONNECTIONS=1000 # only used when serving vault_sdk.asgi:app, connections open at once to the vaults per worker
+# export METRICS_DIR="/tmp/vault-bridge-metrics" # shared by all gunicorn workers, unset to report per worker
+# export METRICS_FLUSH_INTERVAL=5
+# export METRICS_MAX_HOSTS=20 # outbound hosts with their own host label per worker, further hosts are labelled other
+# export SERVER_TIMING_ENABLED='true' # Server-Timing response header with the milliseconds spent in each stage of the request
+# export SLOW_REQUEST_THRESHOLD_MS=1000 # requests at least this slow are logged with their stage timings, 0 disables
+# export TRACING_ENABLED='false' # OpenTelemetry spans, requires the opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http packages
+# export TRACING_SAMPLE_RATIO=1.0 # fraction of the traces started by the bridge that are sampled, the sampling decision of a caller's traceparent is followed
+# export OTEL_EXPORTER_OTLP_ENDPOINT='http://localhost:4318' # OTLP/HTTP collector the spans are exported to
+# export OTEL_SERVICE_NAME='vault-bridge'
+# export AWS_BATCH_GET_SECRET_VALUE='true' # false if the AWS credentials are not allowed secretsmanager:BatchGetSecretValue
+# export AWS_MICRO_BATCH_WINDOW_MS=0 # e.g. 5, 0 disables micro-batching of single AWS secret requests
+# export AWS_MICRO_BATCH_MAX_SIZE=20
 # export IBM_CLOUD_IAM_URL='https://iam.cloud.ibm.com/identity/token'
 # export AZURE_IAM_URL='https://login.microsoftonline.com'
 export GIT_REPO_URL='https://github.ibm.com/PrivateCloud-analytics/zen-vault-bridge-sdk'
@@ -12,5 +12,15 @@ if [ ! -z "$TLS_CERTIFICATE_FILE_PATH" ] && [ ! -z "$TLS_KEY_FILE_PATH" ]; then
     key_path="--keyfile $TLS_KEY_FILE_PATH"
 fi
 
+# SERVER_MODE=async serves the ASGI app with uvicorn workers, the vault calls are sent by an async client and hold no
+# thread, ASGI_MAX_WORKERS threads per worker parse and validate the requests and run the STS AssumeRole calls
+# export SERVER_MODE='sync' # {sync(default) | async}
+# export ASGI_MAX_WORKERS=64
+# export VAULT_ASYNC_MAX_CONNECTIONS=1000 # connections open at once to the vaults per async worker
+
 cd ./vault_sdk 
-gunicorn $key_path $cert_path --bind 0.0.0.0:8443 wsgi:app
\ No newline at end of file
+if [ "$SERVER_MODE" = "async" ]; then
+    gunicorn $key_path $cert_path --bind 0.0.0.0:8443 -k uvicorn.workers.UvicornWorker asgi:app
+else
+    gunicorn $key_path $cert_path --bind 0.0.0.0:8443 wsgi:app
+fi
\ No newline at end of file
@@ -0,0 +1,13 @@
+import os
+import tempfile
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+# the ASGI app loads the JWT public key when it is imported, so the key is created before the tests are collected
+JWT_PRIVATE_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+JWT_PUBLIC_KEY_FILE = os.path.join(tempfile.mkdtemp(prefix="vault-bridge-tests-"), "public.pem")
+with open(JWT_PUBLIC_KEY_FILE, "wb") as f:
+    f.write(JWT_PRIVATE_KEY.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+os.environ.setdefault("JWT_PUBLIC_KEY_PATH", JWT_PUBLIC_KEY_FILE)
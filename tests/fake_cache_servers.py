@@ -0,0 +1,171 @@
+# Minimal stand-ins for the cache servers of the distributed cache backends, used by the tests.
+#
+# startFakeRedisServer() starts a server that speaks the redis serialization protocol (RESP) and answers AUTH, SELECT, GET, SET with PX and DEL.
+# startFakeMemcachedServer() starts a server that speaks the memcached text protocol and answers get, set and delete.
+# Both keep the values in memory, expire them after the ttl sent by the client and record every command they receive.
+import socket
+import socketserver
+import threading
+import time
+
+# memcached reads an expiration time longer than 30 days as a unix timestamp
+MEMCACHED_MAX_RELATIVE_EXPIRATION = 30 * 24 * 3600
+
+
+# values and received commands of a running server
+class FakeCacheState(object):
+    def __init__(self, password=None):
+        self.password = password
+        # key to (value, monotonic expiration)
+        self.entries = {}
+        self.commands = []
+        self.lock = threading.Lock()
+
+    # @param {bytes} key — cache key
+    #
+    # @returns {bytes} value of the key, None if not found or expired
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                self.entries.pop(key, None)
+                return None
+            return entry[0]
+
+    # @param {bytes} key — cache key
+    # @param {bytes} value — value
+    # @param {float} ttl — seconds the value is kept
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+
+    # @param {bytes} key — cache key
+    #
+    # @returns {bool} true if the key was found
+    def delete(self, key):
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+
+# handler whose connection is closed when the server stops, as a stopped cache server would
+class FakeCacheHandler(socketserver.StreamRequestHandler):
+    state = None
+
+    def setup(self):
+        super().setup()
+        self.server.connections.add(self.connection)
+
+    def finish(self):
+        self.server.connections.discard(self.connection)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+
+class FakeRedisHandler(FakeCacheHandler):
+
+    # @returns {array} arguments of the next command, None once the client closed the connection
+    def readCommand(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            size = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        authenticated = self.state.password is None
+        while True:
+            args = self.readCommand()
+            if args is None:
+                return
+            name = args[0].upper()
+            self.state.commands.append([name] + args[1:])
+
+            if name == b"AUTH":
+                authenticated = args[-1].decode("utf-8") == self.state.password
+                self.wfile.write(b"+OK\r\n" if authenticated else b"-WRONGPASS invalid password\r\n")
+            elif not authenticated:
+                self.wfile.write(b"-NOAUTH Authentication required.\r\n")
+            elif name == b"SELECT":
+                self.wfile.write(b"+OK\r\n")
+            elif name == b"GET":
+                value = self.state.get(args[1])
+                self.wfile.write(b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value))
+            elif name == b"SET":
+                ttl = int(args[4]) / 1000 if len(args) > 4 and args[3].upper() == b"PX" else 3600
+                self.state.set(args[1], args[2], ttl)
+                self.wfile.write(b"+OK\r\n")
+            elif name == b"DEL":
+                self.wfile.write(b":%d\r\n" % sum(1 for key in args[1:] if self.state.delete(key)))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+class FakeMemcachedHandler(FakeCacheHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line[:-2].split()
+            self.state.commands.append(parts)
+
+            if parts[0] == b"get":
+                for key in parts[1:]:
+                    value = self.state.get(key)
+                    if value is not None:
+                        self.wfile.write(b"VALUE %s 0 %d\r\n%s\r\n" % (key, len(value), value))
+                self.wfile.write(b"END\r\n")
+            elif parts[0] == b"set":
+                value = self.rfile.read(int(parts[4]) + 2)[:-2]
+                expiration = int(parts[3])
+                if expiration > MEMCACHED_MAX_RELATIVE_EXPIRATION:
+                    expiration = expiration - time.time()
+                self.state.set(parts[1], value, expiration if expiration > 0 else 3600)
+                self.wfile.write(b"STORED\r\n")
+            elif parts[0] == b"delete":
+                self.wfile.write(b"DELETED\r\n" if self.state.delete(parts[1]) else b"NOT_FOUND\r\n")
+            else:
+                self.wfile.write(b"ERROR\r\n")
+
+
+# server running on a daemon thread until stop() is called
+class FakeCacheServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler, state):
+        super().__init__(("127.0.0.1", 0), type(handler.__name__, (handler,), {"state": state}))
+        self.state = state
+        self.connections = set()
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, name="fake-cache-server", daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+# @param {string} password — password the clients must send with AUTH, None to accept every client
+#
+# @returns {FakeCacheServer} running redis stand-in
+def startFakeRedisServer(password=None):
+    return FakeCacheServer(FakeRedisHandler, FakeCacheState(password))
+
+
+# @returns {FakeCacheServer} running memcached stand-in
+def startFakeMemcachedServer():
+    return FakeCacheServer(FakeMemcachedHandler, FakeCacheState())
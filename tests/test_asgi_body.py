@@ -0,0 +1,50 @@
+import asyncio
+
+from vault_sdk.asgi import AsgiBodyStream, pumpRequestBody, ASGI_BODY_QUEUE_SIZE
+
+CHUNK = b"x" * 65536
+
+
+# @param {int} count — number of body chunks
+#
+# @returns {callable} ASGI receive callable of a body of count chunks
+# @returns {list} one entry per receive call
+def buildReceive(count):
+    received = []
+
+    async def receive():
+        received.append(1)
+        return {"type": "http.request", "body": CHUNK, "more_body": len(received) < count}
+    return receive, received
+
+
+def test_body_is_not_received_faster_than_it_is_read():
+    async def run():
+        loop = asyncio.get_running_loop()
+        receive, received = buildReceive(1000)
+        stream = AsgiBodyStream(loop)
+        pump = asyncio.ensure_future(pumpRequestBody(receive, stream))
+        await asyncio.sleep(0.1)
+        # the queued chunks and the one waiting for space
+        assert len(received) == ASGI_BODY_QUEUE_SIZE + 1
+
+        def readAll():
+            return sum(len(chunk) for chunk in iter(lambda: stream.read(len(CHUNK)), b""))
+        assert await loop.run_in_executor(None, readAll) == 1000 * len(CHUNK)
+        await pump
+    asyncio.run(run())
+
+
+def test_cancelled_pump_ends_the_body():
+    async def run():
+        loop = asyncio.get_running_loop()
+        receive, received = buildReceive(1000)
+        stream = AsgiBodyStream(loop)
+        pump = asyncio.ensure_future(pumpRequestBody(receive, stream))
+        await asyncio.sleep(0.05)
+        pump.cancel()
+        await asyncio.sleep(0)
+        # the reader gets the chunks received so far and then the end of the body instead of waiting forever
+        assert await loop.run_in_executor(None, stream.read) == CHUNK * ASGI_BODY_QUEUE_SIZE
+        assert stream.read(1) == b""
+    asyncio.run(run())
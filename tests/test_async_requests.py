@@ -0,0 +1,146 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlencode
+
+import jwt
+import pytest
+
+from benchmarks.fake_servers import startFakeServer
+from vault_sdk import asgi
+from vault_sdk.framework import async_utils, caches
+from vault_sdk.framework.retry_policy import RetryPolicy
+
+from .conftest import JWT_PRIVATE_KEY
+
+
+# answers the first request with a 503 asking for a retry after a second, and the next ones with a 200
+class FlakyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.requests.append(time.monotonic())
+        code, body = (503, b"unavailable") if len(self.requests) == 1 else (200, b'{"ok": true}')
+        self.send_response(code)
+        if code == 503:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def flaky_server():
+    FlakyHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", FlakyHandler.requests
+    server.shutdown()
+
+
+# @param {callable} app — ASGI application
+# @param {string} path — request path
+# @param {dict} query — query parameters
+# @param {dict} headers — request headers
+#
+# @returns {int} status code of the response
+# @returns {bytes} response body
+async def callApp(app, path, query, headers):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": urlencode(query).encode("latin-1"),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+    await app(scope, receive, send)
+    return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:])
+
+
+# @param {callable} app — ASGI application
+async def shutdownApp(app):
+    messages = iter([{"type": "lifespan.shutdown"}])
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        pass
+    await app({"type": "lifespan"}, receive, send)
+
+
+def test_a_retried_request_waits_on_the_event_loop(flaky_server):
+    url, requests = flaky_server
+
+    async def run():
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+        ticker = asyncio.ensure_future(tick())
+        try:
+            response = await async_utils.sendGetRequestAsync(url + "/secret", {}, None, RetryPolicy(3, 0.1, 1, 5, 5, 30))
+        finally:
+            ticker.cancel()
+        await shutdownApp(asgi.app)
+        return response, ticks
+
+    response, ticks = asyncio.run(run())
+    assert (response.status_code, response.json()) == (200, {"ok": True})
+    assert len(requests) == 2 and requests[1] - requests[0] >= 1
+    # the event loop kept running other tasks while the retry waited
+    assert len([t for t in ticks if requests[0] < t < requests[1]]) > 20
+
+
+def test_vault_calls_do_not_hold_the_executor_threads(monkeypatch):
+    server = startFakeServer(latency_ms=300)
+    fake_url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setenv("IBM_CLOUD_IAM_URL", fake_url + "/identity/token")
+    monkeypatch.setattr(async_utils, "ASGI_MAX_WORKERS", 2)
+    monkeypatch.setattr(async_utils, "ASGI_EXECUTOR", None)
+    monkeypatch.setattr(caches, "CACHED_TOKEN", {})
+    monkeypatch.setattr(caches, "CACHED_SECRET", caches.OrderedDict())
+
+    claims = {"sub": "tests", "aud": "ZEN-VAULT-BRIDGE", "iss": "ZEN-SECRETS", "exp": int(time.time()) + 3600}
+    headers = {
+        "Authorization": "Bearer " + jwt.encode(claims, JWT_PRIVATE_KEY, algorithm="RS256"),
+        "Vault-Auth": base64.b64encode(f"vault_url={fake_url};api_key=tests".encode("utf-8")).decode("utf-8"),
+        "IBM-CPD-Transaction-ID": "tests",
+    }
+
+    async def getSecret(index):
+        secret_id = f"secret-{index}"
+        query = {"secret_type": "credentials", "secret_reference_metadata": base64.b64encode(json.dumps({"secret_id": secret_id}).encode("utf-8")).decode("utf-8")}
+        return await callApp(asgi.app, f"/v2/vault-bridges/ibm-cloud-secrets-manager/secrets/{secret_id}", query, headers)
+
+    async def run():
+        start = time.monotonic()
+        responses = await asyncio.gather(*[getSecret(index) for index in range(20)])
+        elapsed = time.monotonic() - start
+        await shutdownApp(asgi.app)
+        return responses, elapsed
+
+    try:
+        responses, elapsed = asyncio.run(run())
+    finally:
+        server.shutdown()
+    assert [status for status, _ in responses] == [200] * 20
+    assert json.loads(responses[3][1])["secret"]["credentials"]["username"] == "user-secret-3"
+    # one token and twenty secret requests of 300 ms, two threads holding them would need more than three seconds
+    assert elapsed < 1.5
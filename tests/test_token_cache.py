@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import pytest
+
+from vault_sdk.framework import async_utils, caches, metrics, utils
+
+
+@pytest.fixture
+def token_cache(monkeypatch):
+    monkeypatch.setattr(caches, "CACHED_TOKEN", {})
+    monkeypatch.setattr(caches, "TOKEN_FLIGHTS", {})
+    monkeypatch.setattr(caches, "ASYNC_TOKEN_FLIGHTS", {})
+    monkeypatch.setattr(metrics, "METRICS", {})
+    # count the distributed cache reads without a cache server
+    reads = []
+    monkeypatch.setattr(utils, "getDistributedCacheValue", lambda kind, key, transaction_id: reads.append(key))
+    yield reads
+
+
+# @param {string} result — value of the result label
+#
+# @returns {number} token cache requests recorded with the result
+def getTokenCacheRequests(result):
+    return metrics.METRICS.get(("vault_bridge_token_cache_requests_total", metrics.labelsKey({"vault_type": "ibm-cloud-secrets-manager", "result": result})), 0)
+
+
+def fetchToken():
+    return {"token": "iam-token", "expiration": time.time() + 3600}, None, None
+
+
+def test_a_fetched_token_is_one_miss(token_cache):
+    token, error, code = utils.getOrFetchToken("ibm-cloud-secrets-manager", "api-key", fetchToken, "tx")
+    assert (token, error, code) == ("iam-token", None, None)
+    assert getTokenCacheRequests("miss") == 1
+    # the cache is checked again before the fetch without another distributed cache request
+    assert len(token_cache) == 1
+
+    assert utils.getOrFetchToken("ibm-cloud-secrets-manager", "api-key", fetchToken, "tx")[0] == "iam-token"
+    assert getTokenCacheRequests("miss") == 1
+    assert getTokenCacheRequests("hit") == 1
+
+
+def test_concurrent_async_requests_fetch_the_token_once(token_cache):
+    fetches = []
+
+    async def fetchTokenAsync():
+        fetches.append(1)
+        await asyncio.sleep(0.05)
+        return fetchToken()
+
+    async def run():
+        return await asyncio.gather(*[async_utils.getOrFetchTokenAsync("ibm-cloud-secrets-manager", "api-key", fetchTokenAsync, fetchToken, "tx") for _ in range(10)])
+
+    assert asyncio.run(run()) == [("iam-token", None, None)] * 10
+    assert len(fetches) == 1
+    assert getTokenCacheRequests("miss") == 10
@@ -0,0 +1,320 @@
+import asyncio
+import json
+import queue
+import re
+import time
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import Headers, MultiDict
+
+from .routes import prepareGetSecret, acceptsNdjson, prepareBulkRequest, prepareBulkPostRequest
+from .framework.async_utils import runInExecutor, shutdownAsgiExecutor, processRequestGetSecretWithCacheAsync, prepareBulkAuthContextAsync, runBulkRequestAsync, streamBulkResultsAsync
+from .framework.connection_pool import closeAsyncClients
+from .framework.metrics import renderMetrics
+from .framework.request_timing import RequestTimer, activateRequestTimer, buildServerTimingHeader, finishRequestTimer
+from .framework.tracing import startRequestSpan
+from .framework.utils import load_jwt_public_keys, recordRequestMetrics, buildFrameworkExceptionPayload, logFrameworkException, logFrameworkDebug, getCurrentFilename
+from .bridges_common.constants import *
+
+FILE_NAME = getCurrentFilename(__file__)
+
+# maximum number of received body chunks of a POST bulk request waiting to be parsed, the body is not received
+# further until the parser reads them, so a client cannot push a body into memory faster than it is parsed
+ASGI_BODY_QUEUE_SIZE = 4
+
+HEALTH_PATH = "/v2/health"
+METRICS_PATH = "/v2/metrics"
+BULK_PATH = re.compile(r"^/v2/vault-bridges/(?P<vault_type>[^/]+)/secrets/bulk$")
+SECRET_PATH = re.compile(r"^/v2/vault-bridges/(?P<vault_type>[^/]+)/secrets/(?P<secret_urn>[^/]+)$")
+
+# request object with the args and headers used by the framework validation functions,
+# so the async server shares the request handling of the Flask routes
+class AsgiRequest(object):
+    def __init__(self, scope):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = MultiDict(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True))
+        self.headers = Headers([(name.decode("latin-1"), value.decode("latin-1")) for name, value in scope.get("headers", [])])
+        self.stream = None
+
+
+# blocking request body stream read by the body parser on the executor, the event loop feeds it
+# with the body chunks of the ASGI receive callable
+class AsgiBodyStream(object):
+    def __init__(self, loop):
+        self.loop = loop
+        self.chunks = queue.Queue()
+        # taken by the event loop for every chunk fed and released by the reader for every chunk read
+        self.space = asyncio.Semaphore(ASGI_BODY_QUEUE_SIZE)
+        self.buffer = b""
+        self.ended = False
+
+
+    # @param {bytes} chunk — body chunk
+    #
+    # waits on the event loop while ASGI_BODY_QUEUE_SIZE chunks are waiting to be read
+    async def feed(self, chunk):
+        await self.space.acquire()
+        self.chunks.put(chunk)
+
+
+    # mark the end of the body, never waits so it can be called when the pump is cancelled
+    def end(self):
+        self.chunks.put(None)
+
+
+    # @param {int} size — maximum number of bytes to read
+    #
+    # @returns {bytes} next bytes of the body, empty at the end of the body
+    def read(self, size=-1):
+        while not self.ended and (size < 0 or len(self.buffer) < size):
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.ended = True
+            else:
+                self.loop.call_soon_threadsafe(self.space.release)
+                self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+# @param {callable} receive — ASGI receive callable
+# @param {AsgiBodyStream} stream — stream the body chunks are fed to
+async def pumpRequestBody(receive, stream):
+    try:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            if message.get("body"):
+                await stream.feed(message["body"])
+            if not message.get("more_body", False):
+                break
+    finally:
+        stream.end()
+
+
+# @param {callable} send — ASGI send callable
+# @param {int} status — http status code
+# @param {string} body — response body
+# @param {string} content_type — response content type
+async def sendResponse(send, status, body, content_type="application/json"):
+    body = body.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode("latin-1")), (b"content-length", str(len(body)).encode("latin-1"))],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+# @param {callable} send — ASGI send callable
+# @param {int} status — http status code
+# @param {async generator} chunks — async generator of the response body chunks
+# @param {string} content_type — response content type
+#
+# every chunk is sent as soon as the generator produces it
+async def sendStreamingResponse(send, status, chunks, content_type):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode("latin-1"))],
+    })
+    try:
+        async for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+    finally:
+        await chunks.aclose()
+    await send({"type": "http.response.body", "body": b""})
+
+
+# @param {callable} send — ASGI send callable
+# @param {dict} error — error payload
+# @param {int} code — http status code
+async def sendExceptionResponse(send, error, code):
+    dumped_message = json.dumps(error)
+    logFrameworkException(None, "sendExceptionResponse()", FILE_NAME, dumped_message)
+    await sendResponse(send, code, dumped_message)
+
+
+# @param {dict} scope — ASGI connection scope
+# @param {callable} receive — ASGI receive callable
+# @param {callable} send — ASGI send callable
+async def handleHttp(scope, receive, send):
+    req = AsgiRequest(scope)
+    start = time.perf_counter()
+    status = {}
+    transaction_id = req.headers.get(TRANSACTION_ID_HEADER)
+    rule = getVaultRouteRule(req.path)
+    span = startRequestSpan(rule, req.method, req.headers, transaction_id) if rule is not None else None
+    timer = RequestTimer(transaction_id, span)
+
+    # record the status code of the response for the request metrics, and add the stages timed so far
+    async def sendAndRecord(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+            server_timing = buildServerTimingHeader(timer)
+            if server_timing is not None:
+                message = dict(message, headers=list(message.get("headers", [])) + [(SERVER_TIMING_HEADER.lower().encode("latin-1"), server_timing.encode("latin-1"))])
+        await send(message)
+
+    # the stages of the request are recorded by its task, and by the executor threads and tasks it starts
+    with activateRequestTimer(timer):
+        route, vault_type = await routeRequest(req, receive, sendAndRecord)
+    if route is not None:
+        recordRequestMetrics(route, vault_type, status.get("code", HTTP_INTERNAL_SERVER_ERROR_CODE), time.perf_counter() - start)
+        finishRequestTimer(timer, req.method, route, vault_type, status.get("code", HTTP_INTERNAL_SERVER_ERROR_CODE))
+    elif span is not None:
+        # a vault bridge path with an unsupported method
+        finishRequestTimer(timer, req.method, rule, "", status.get("code", HTTP_INTERNAL_SERVER_ERROR_CODE))
+
+
+# @param {string} path — request path
+#
+# @returns {string} route rule of a secret path, None for the other paths, which are not traced
+def getVaultRouteRule(path):
+    if BULK_PATH.match(path) is not None:
+        return "/v2/vault-bridges/<vault_type>/secrets/bulk"
+    if SECRET_PATH.match(path) is not None:
+        return "/v2/vault-bridges/<vault_type>/secrets/<secret_urn>"
+    return None
+
+
+# @param {AsgiRequest} req — incoming request
+# @param {callable} receive — ASGI receive callable
+# @param {callable} send — ASGI send callable
+#
+# @returns {string} route rule of the request, None if no route matched
+# @returns {string} vault type in the request path
+async def routeRequest(req, receive, send):
+    if req.path == HEALTH_PATH:
+        if req.method != "GET":
+            await sendResponse(send, 405, json.dumps({"error": "method not allowed"}))
+            return None, ""
+        await sendResponse(send, 200, json.dumps({"status": "OK"}), "text/html; charset=utf-8")
+        return "/v2/health", ""
+
+    if req.path == METRICS_PATH:
+        if req.method != "GET":
+            await sendResponse(send, 405, json.dumps({"error": "method not allowed"}))
+            return None, ""
+        await sendResponse(send, 200, await runInExecutor(renderMetrics), "text/plain; version=0.0.4; charset=utf-8")
+        return "/v2/metrics", ""
+
+    # the static bulk path takes precedence over a secret urn named bulk, as in the Flask routes
+    match = BULK_PATH.match(req.path)
+    if match is not None:
+        if req.method not in ("GET", "POST"):
+            await sendResponse(send, 405, json.dumps({"error": "method not allowed"}))
+            return None, ""
+        if req.method == "GET":
+            await respondBulkSecret(req, match.group("vault_type"), prepareBulkRequest, send)
+            return "/v2/vault-bridges/<vault_type>/secrets/bulk", match.group("vault_type")
+
+        # the body is parsed on the executor while the event loop keeps receiving it
+        req.stream = AsgiBodyStream(asyncio.get_running_loop())
+        pump = asyncio.ensure_future(pumpRequestBody(receive, req.stream))
+        try:
+            await respondBulkSecret(req, match.group("vault_type"), prepareBulkPostRequest, send)
+        finally:
+            pump.cancel()
+        return "/v2/vault-bridges/<vault_type>/secrets/bulk", match.group("vault_type")
+
+    match = SECRET_PATH.match(req.path)
+    if match is not None:
+        if req.method != "GET":
+            await sendResponse(send, 405, json.dumps({"error": "method not allowed"}))
+            return None, ""
+        await respondSecret(req, match.group("vault_type"), match.group("secret_urn"), send)
+        return "/v2/vault-bridges/<vault_type>/secrets/<secret_urn>", match.group("vault_type")
+
+    await sendResponse(send, 404, json.dumps({"error": "not found"}))
+    return None, ""
+
+
+# @param {AsgiRequest} req — incoming request
+# @param {string} vault_type — vault type
+# @param {string} secret_urn — secret urn
+# @param {callable} send — ASGI send callable
+#
+# the request is validated on the executor, the vault calls are awaited on the event loop
+async def respondSecret(req, vault_type, secret_urn, send):
+    vault, error, code = await runInExecutor(prepareGetSecret, req, vault_type, secret_urn)
+    if error is None:
+        extracted_secret, error, code = await processRequestGetSecretWithCacheAsync(vault)
+    if error is not None:
+        await sendExceptionResponse(send, error, code)
+        return
+
+    logFrameworkDebug(vault.transaction_id, "respondSecret()", FILE_NAME, "Sending response for transaction %s and secret %s with vault type %s", vault.transaction_id, secret_urn, vault_type)
+    await sendResponse(send, 200, json.dumps(extracted_secret), "text/html; charset=utf-8")
+
+
+# @param {AsgiRequest} req — incoming request
+# @param {string} vault_type — vault type
+# @param {function} prepare — function returning the vault objects of the bulk request
+# @param {callable} send — ASGI send callable
+#
+# the request is validated and its body parsed on the executor, the vault calls are awaited on the event loop
+async def respondBulkSecret(req, vault_type, prepare, send):
+    vaults, transaction_id, error, code = await runInExecutor(prepare, req, vault_type, False)
+    if error is None:
+        error, code = await prepareBulkAuthContextAsync(vaults)
+    if error is not None:
+        await sendExceptionResponse(send, error, code)
+        return
+
+    if acceptsNdjson(req):
+        logFrameworkDebug(transaction_id, "respondBulkSecret()", FILE_NAME, "Streaming response for the bulk request with secret %s with vault type %s", transaction_id, vault_type)
+        await sendStreamingResponse(send, 200, streamBulkResultsAsync(vaults, transaction_id), NDJSON_MIMETYPE)
+        return
+
+    response_data = await runBulkRequestAsync(vaults)
+    logFrameworkDebug(transaction_id, "respondBulkSecret()", FILE_NAME, "Sending response for the bulk request with secret %s with vault type %s", transaction_id, vault_type)
+    await sendResponse(send, 200, json.dumps(response_data), "text/html; charset=utf-8")
+
+
+# @param {callable} receive — ASGI receive callable
+# @param {callable} send — ASGI send callable
+async def handleLifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            shutdownAsgiExecutor()
+            await closeAsyncClients(asyncio.get_running_loop())
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+# ASGI application serving the same routes as the Flask app, for example:
+#
+# gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8443 vault_sdk.asgi:app
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await handleLifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    response = {"started": False}
+
+    # record whether the status line was sent, a failure after it can no longer be reported with an error response
+    async def sendAndTrack(message):
+        if message["type"] == "http.response.start":
+            response["started"] = True
+        await send(message)
+
+    try:
+        await handleHttp(scope, receive, sendAndTrack)
+    except Exception as err:
+        logFrameworkException(None, "app()", FILE_NAME, str(err))
+        if response["started"]:
+            # the body is left incomplete, so the server closes the connection and the client sees a truncated response
+            return
+        await sendExceptionResponse(send, buildFrameworkExceptionPayload("vaultbridgesdk_e_10900", None), HTTP_INTERNAL_SERVER_ERROR_CODE)
+
+
+load_jwt_public_keys()
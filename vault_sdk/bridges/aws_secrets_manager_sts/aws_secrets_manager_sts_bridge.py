@@ -1,3 +1,4 @@
+import asyncio
 import json
 import base64
 import datetime
@@ -5,19 +6,37 @@ import hashlib
 import hmac
 import re
 import os
+import threading
 import boto3
 from botocore.exceptions import NoCredentialsError
 
 from vault_sdk.bridges_common.constants import *
+from vault_sdk.bridges_common.aws_signing import getSigningKeyCacheKey, getCachedSigningKey, saveSigningKeyInCache
+from vault_sdk.bridges_common.aws_batch import AWS_GET_SECRET_VALUE_TARGET, AWS_BATCH_GET_SECRET_VALUE_TARGET, AWS_SECRET_BATCH_SIZE, \
+                                              buildBatchGetSecretValuePayload, mapBatchSecretValues, fetchSecretWithMicroBatch, fetchSecretWithMicroBatchAsync, \
+                                              getSecretsManagerEndpoint
 from vault_sdk.bridges.aws_secrets_manager_sts.constants import *
 from vault_sdk.bridges.aws_secrets_manager_sts.error_codes import COMPONENT_EXCEPTIONS
-from vault_sdk.framework.utils import buildExceptionPayload, sendPostRequest, logException, logDebug, getCurrentFilename
+from vault_sdk.framework.retry_policy import getRetryPolicy
+from vault_sdk.framework.circuit_breaker import CircuitOpenError
+from vault_sdk.framework.request_timing import timeStage
+from vault_sdk.framework.utils import getOrFetchToken, buildExceptionPayload, buildFrameworkExceptionPayload, sendPostRequest, logException, logDebug, getCurrentFilename
+from vault_sdk.framework.async_utils import sendPostRequestAsync
 
 FILE_NAME = getCurrentFilename(__file__)
 
+# boto3 clients are thread safe, so one STS client is shared per region
+STS_CLIENTS = {}
+STS_CLIENTS_LOCK = threading.Lock()
+
 class AWSSecretsManagerSTS(object):
+    # attributes set by extractFromVaultAuthHeader() and prepareAuthContext() that items of a bulk request share
+    AUTH_CONTEXT_ATTRIBUTES = ("auth", "host", "service", "region")
+    # number of distinct secrets of a bulk request read by one fetchSecretBatch() call
+    SECRET_BATCH_SIZE = AWS_SECRET_BATCH_SIZE
+
     def __init__(self, secret_reference_metadata, secret_type, secret_urn, auth_string, transaction_id):
-        self.vault_type = AWS_SECRETS_MANAGER
+        self.vault_type = AWS_SECRETS_MANAGER_STS
         self.secret_type = secret_type
         self.secret_reference_metadata = secret_reference_metadata
         self.auth_string = auth_string
@@ -150,24 +169,14 @@ class AWSSecretsManagerSTS(object):
             if error is not None:
                 return error, code
 
-            # Use role ARN to assume the role via AWS STS
-            sts_client = boto3.client("sts", region_name=self.region)  # Replace with your default region if necessary
-            assumed_role_object = sts_client.assume_role(
-                RoleArn=role_arn,
-                RoleSessionName=session_name
-            )
+            # Step 3: Get temporary credentials of the role, reusing cached credentials until shortly before they expire
+            credentials, error, code = self.getRoleCredentials(role_arn, session_name)
+            if error is not None:
+                return error, code
 
-            # Step 3: Extract temporary credentials
-            credentials = assumed_role_object["Credentials"]
             self.auth["AWS_ACCESS_KEY_ID"] = credentials["AccessKeyId"]
             self.auth["AWS_SECRET_ACCESS_KEY"] = credentials["SecretAccessKey"]
             self.auth["AWS_SESSION_TOKEN"] = credentials["SessionToken"]
-            expiration_iso = credentials["Expiration"].isoformat()
-            print("\nAWS Temporary Credentials:")
-            print(f"AWS_ACCESS_KEY_ID: {self.auth['AWS_ACCESS_KEY_ID']}\n"
-                f"AWS_SECRET_ACCESS_KEY: {self.auth['AWS_SECRET_ACCESS_KEY']}\n"
-                f"AWS_SESSION_TOKEN: {self.auth['AWS_SESSION_TOKEN']}\n"
-                f"Expiration Time: {expiration_iso}\n")
             return None, None  # Success
 
         except NoCredentialsError:
@@ -179,6 +188,55 @@ class AWSSecretsManagerSTS(object):
             logException(self, "extractFromVaultAuthHeader()", FILE_NAME, str(err))
             return buildExceptionPayload("vaultbridgesdk_e_20900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
+    # @returns {boto3.client} shared STS client of the vault region
+    def getSTSClient(self):
+        with STS_CLIENTS_LOCK:
+            if self.region not in STS_CLIENTS:
+                STS_CLIENTS[self.region] = boto3.client("sts", region_name=self.region)
+            return STS_CLIENTS[self.region]
+
+    # @param {string} role_arn — ARN of the role to assume
+    # @param {string} session_name — role session name
+    #
+    # @returns {dict} temporary credentials with AccessKeyId, SecretAccessKey and SessionToken
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # concurrent requests for the same role share one AssumeRole call
+    def getRoleCredentials(self, role_arn, session_name):
+        cache_key = role_arn + "~" + session_name + "~" + self.region
+        return getOrFetchToken(AWS_SECRETS_MANAGER_STS, cache_key, lambda: self.assumeRole(role_arn, session_name), self.transaction_id)
+
+    # @param {string} role_arn — ARN of the role to assume
+    # @param {string} session_name — role session name
+    #
+    # @returns {dict} token - {"token": {temporary credentials}, "expiration": "xxxxxx"}
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def assumeRole(self, role_arn, session_name):
+        try:
+            assumed_role_object = self.getSTSClient().assume_role(
+                RoleArn=role_arn,
+                RoleSessionName=session_name
+            )
+
+            assumed_credentials = assumed_role_object["Credentials"]
+            credentials = {
+                "AccessKeyId": assumed_credentials["AccessKeyId"],
+                "SecretAccessKey": assumed_credentials["SecretAccessKey"],
+                "SessionToken": assumed_credentials["SessionToken"]
+            }
+            logDebug(self, "assumeRole()", FILE_NAME, "Assumed role %s, credentials expire at %s", role_arn, assumed_credentials['Expiration'])
+
+            return {"token": credentials, "expiration": assumed_credentials["Expiration"].timestamp()}, None, None
+
+        except NoCredentialsError:
+            return None, buildExceptionPayload("vaultbridgesdk_e_20003", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+        except Exception as err:
+            logException(self, "assumeRole()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_20900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
     # Generates a HMAC signature for msg using the provided key
     def sign(self, key, msg):
         try:
@@ -188,8 +246,14 @@ class AWSSecretsManagerSTS(object):
             return None, buildExceptionPayload("vaultbridgesdk_e_20900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
     # Generates an AWS V4 Signature using a set of HMAC signing steps provided by AWS
+    # The derived key only changes once per day per credential, so it is cached and shared by the AWS bridges
     def generateSignature(self, key, dateStamp, regionName, serviceName):
         try:
+            cache_key = getSigningKeyCacheKey(key, dateStamp, regionName, serviceName)
+            kSigning = getCachedSigningKey(cache_key)
+            if kSigning is not None:
+                return kSigning, None, None
+
             kDate, error, code = self.sign(('AWS4' + key).encode('utf-8'), dateStamp)
             if error is not None:
                 return None, error, code            
@@ -203,12 +267,147 @@ class AWSSecretsManagerSTS(object):
             if error is not None:
                 return None, error, code
 
+            saveSigningKeyInCache(cache_key, kSigning)
             return kSigning, None, None
         except Exception as err: 
             logException(self, "generateSignature()", FILE_NAME, str(err))
             return None, buildExceptionPayload("vaultbridgesdk_e_20900", self), HTTP_INTERNAL_SERVER_ERROR_CODE     
 
 
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # the request is signed with the credentials extracted from the vault auth header, so there is nothing else to prepare
+    def prepareAuthContext(self):
+        return None, None
+
+
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # prepareAuthContext() for the async server
+    async def prepareAuthContextAsync(self):
+        return None, None
+
+
+    # @returns {string} secret - raw secret returned by the vault, to be extracted by extractSecret()
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def fetchSecret(self):
+        return self.getSecret()
+
+
+    # @returns {string} secret - raw secret returned by the vault, to be extracted by extractSecret()
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # fetchSecret() for the async server
+    async def fetchSecretAsync(self):
+        return await self.getSecretAsync()
+
+
+    # @param {array} secret_ids — secret ids, names or ARNs
+    #
+    # @returns {string} BatchGetSecretValue request body
+    # @returns {dict} signed headers of the request
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def buildBatchSecretRequest(self, secret_ids):
+        data = buildBatchGetSecretValuePayload(secret_ids)
+        error, code = self.generateHeaders(data, AWS_BATCH_GET_SECRET_VALUE_TARGET)
+        if error is not None:
+            return None, None, error, code
+
+        headers = {
+            'x-amz-date': self.amzdate,
+            'x-amz-content-sha256': self.payload_hash,
+            'Authorization': self.authorization_header,
+            'X-Amz-Target': AWS_BATCH_GET_SECRET_VALUE_TARGET,
+            'Content-Type': 'application/x-amz-json-1.1',
+            'X-Amz-Security-Token': self.session_token
+        }
+        return data, headers, None, None
+
+
+    # @param {array} vaults — vault objects of the batch
+    # @param {array} secret_ids — secret ids sent in the BatchGetSecretValue request
+    # @param {response} response — response of the BatchGetSecretValue request, sent by the sync or the async client
+    #
+    # @returns {array} (secret, error, code) of each vault object, None for the secrets left to a GetSecretValue request
+    def readBatchSecretResponse(self, vaults, secret_ids, response):
+        # a 400 is returned when the credentials are not allowed to batch, so fall back to one request per secret
+        if response.status_code == HTTP_BAD_REQUEST_CODE:
+            logException(self, "readBatchSecretResponse()", FILE_NAME, f"{response.text} and status code {response.status_code} returned from {self.auth[VAULT_URL]}, reading the secrets one at a time")
+            return [None] * len(vaults)
+        if response.status_code != HTTP_SUCCESS_CODE:
+            logException(self, "readBatchSecretResponse()", FILE_NAME, f"{response.text} and status code {response.status_code} returned from {self.auth[VAULT_URL]}")
+            return [(None, buildExceptionPayload("vaultbridgesdk_e_20500", vault), HTTP_INTERNAL_SERVER_ERROR_CODE) for vault in vaults]
+
+        secrets, errors = mapBatchSecretValues(secret_ids, response.text)
+        results = []
+        for vault in vaults:
+            if vault.secret_id in secrets:
+                results.append((secrets[vault.secret_id], None, None))
+            elif vault.secret_id in errors:
+                logException(vault, "readBatchSecretResponse()", FILE_NAME, f"{json.dumps(errors[vault.secret_id])} returned from {self.auth[VAULT_URL]}")
+                results.append((None, buildExceptionPayload("vaultbridgesdk_e_20500", vault), HTTP_INTERNAL_SERVER_ERROR_CODE))
+            else:
+                results.append(None)
+        return results
+
+
+    # @param {array} vaults — vault objects of the bulk request sharing the auth context of this vault object
+    #
+    # @returns {array} (secret, error, code) of each vault object, in the same order
+    #
+    # the secrets are read with one BatchGetSecretValue request, secrets missing from its response are read one at a time
+    def fetchSecretBatch(self, vaults):
+        try:
+            secret_ids = [vault.secret_id for vault in vaults]
+            data, headers, error, code = self.buildBatchSecretRequest(secret_ids)
+            if error is not None:
+                return [(None, error, code)] * len(vaults)
+
+            logDebug(self, "fetchSecretBatch()", FILE_NAME, "Sending request to get %d secrets", len(secret_ids))
+            response = sendPostRequest(getSecretsManagerEndpoint(self.auth[VAULT_URL]), headers, data, getRetryPolicy(self.vault_type))
+            results = self.readBatchSecretResponse(vaults, secret_ids, response)
+            return [result if result is not None else vault.getSecret() for vault, result in zip(vaults, results)]
+        except CircuitOpenError as err:
+            logException(self, "fetchSecretBatch()", FILE_NAME, str(err))
+            return [(None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", vault.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE) for vault in vaults]
+        except Exception as err:
+            logException(self, "fetchSecretBatch()", FILE_NAME, str(err))
+            return [(None, buildExceptionPayload("vaultbridgesdk_e_20900", vault), HTTP_INTERNAL_SERVER_ERROR_CODE) for vault in vaults]
+
+
+    # @param {array} vaults — vault objects of the bulk request sharing the auth context of this vault object
+    #
+    # @returns {array} (secret, error, code) of each vault object, in the same order
+    #
+    # fetchSecretBatch() for the async server, the secrets missing from the response are read concurrently
+    async def fetchSecretBatchAsync(self, vaults):
+        try:
+            secret_ids = [vault.secret_id for vault in vaults]
+            data, headers, error, code = self.buildBatchSecretRequest(secret_ids)
+            if error is not None:
+                return [(None, error, code)] * len(vaults)
+
+            logDebug(self, "fetchSecretBatchAsync()", FILE_NAME, "Sending request to get %d secrets", len(secret_ids))
+            response = await sendPostRequestAsync(getSecretsManagerEndpoint(self.auth[VAULT_URL]), headers, data, getRetryPolicy(self.vault_type))
+            results = self.readBatchSecretResponse(vaults, secret_ids, response)
+            missing = [index for index, result in enumerate(results) if result is None]
+            missing_results = await asyncio.gather(*[vaults[index].getSecretAsync() for index in missing])
+            for index, result in zip(missing, missing_results):
+                results[index] = result
+            return results
+        except CircuitOpenError as err:
+            logException(self, "fetchSecretBatchAsync()", FILE_NAME, str(err))
+            return [(None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", vault.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE) for vault in vaults]
+        except Exception as err:
+            logException(self, "fetchSecretBatchAsync()", FILE_NAME, str(err))
+            return [(None, buildExceptionPayload("vaultbridgesdk_e_20900", vault), HTTP_INTERNAL_SERVER_ERROR_CODE) for vault in vaults]
+
+
     # @param {bool} is_bulk — true if this is a bulk request
     #
     # @returns {dict} extracted_secret - secret in python dict format
@@ -216,13 +415,15 @@ class AWSSecretsManagerSTS(object):
     # @returns {number} status code
     def processRequestGetSecret(self, is_bulk=False):
         try:
-            
-            secret, error, code = self.getSecret()
+            # concurrent single secret requests with the same credentials can be read with one BatchGetSecretValue request
+            with timeStage("fetch_secret"):
+                secret, error, code = fetchSecretWithMicroBatch(self)
             if error is not None:
                 return None, error, code
             # return secret, None, None
             
-            extracted_secret, error, code = self.extractSecret(secret, is_bulk)
+            with timeStage("extract_secret"):
+                extracted_secret, error, code = self.extractSecret(secret, is_bulk)
             if error is not None:
                 return None, error, code
             
@@ -231,8 +432,33 @@ class AWSSecretsManagerSTS(object):
             logException(self, "processRequestGetSecret()", FILE_NAME, str(err))
             return None, buildExceptionPayload("vaultbridgesdk_e_20900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
-    # Generates hashed payload, timestamp and authorization_header 
-    def generateHeaders(self, payload):
+
+    # @param {bool} is_bulk — true if this is a bulk request
+    #
+    # @returns {dict} extracted_secret - secret in python dict format
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # processRequestGetSecret() for the async server
+    async def processRequestGetSecretAsync(self, is_bulk=False):
+        try:
+            with timeStage("fetch_secret"):
+                secret, error, code = await fetchSecretWithMicroBatchAsync(self)
+            if error is not None:
+                return None, error, code
+
+            with timeStage("extract_secret"):
+                extracted_secret, error, code = self.extractSecret(secret, is_bulk)
+            if error is not None:
+                return None, error, code
+
+            return extracted_secret, None, None
+        except Exception as err:
+            logException(self, "processRequestGetSecretAsync()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_20900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+    # Generates hashed payload, timestamp and authorization_header for the X-Amz-Target operation
+    def generateHeaders(self, payload, target=AWS_GET_SECRET_VALUE_TARGET):
         try:
             t = datetime.datetime.utcnow()
             amzdate = t.strftime('%Y%m%dT%H%M%SZ')
@@ -245,7 +471,7 @@ class AWSSecretsManagerSTS(object):
             payload_hash = hashlib.sha256(payload.encode('utf-8')).hexdigest()
             self.payload_hash = payload_hash
 
-            canonical_headers = 'host:' + self.host + '\n' + 'x-amz-content-sha256:' + payload_hash + '\n' + 'x-amz-date:' + amzdate + '\n' + 'x-amz-target:secretsmanager.GetSecretValue' + '\n'
+            canonical_headers = 'host:' + self.host + '\n' + 'x-amz-content-sha256:' + payload_hash + '\n' + 'x-amz-date:' + amzdate + '\n' + 'x-amz-target:' + target + '\n'
             signed_headers = 'host;x-amz-content-sha256;x-amz-date;x-amz-target'
             canonical_request = method + '\n' + canonical_uri + '\n' + canonical_querystring + '\n' + canonical_headers + '\n' + signed_headers + '\n' + payload_hash
 
@@ -267,41 +493,83 @@ class AWSSecretsManagerSTS(object):
             logException(self, "generateHeaders()", FILE_NAME, str(err))
             return buildExceptionPayload("vaultbridgesdk_e_20900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
+    # @returns {string} GetSecretValue request body
+    # @returns {dict} signed headers of the request
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def buildSecretRequest(self):
+        data = f'{{"SecretId": "{self.secret_id}"}}'
+        error, code = self.generateHeaders(data)
+        if error is not None:
+            return None, None, error, code
+
+        # generate headers based on secret_id
+        headers = {
+            'x-amz-date': self.amzdate,
+            'x-amz-content-sha256': self.payload_hash,
+            'Authorization': self.authorization_header,
+            'X-Amz-Target': AWS_GET_SECRET_VALUE_TARGET,
+            'Content-Type': 'application/x-amz-json-1.1',
+            'X-Amz-Security-Token': self.session_token
+        }
+        return data, headers, None, None
+
+
+    # @param {response} response — response of the GetSecretValue request, sent by the sync or the async client
+    #
+    # @returns {string} response body
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def readSecretResponse(self, response):
+        # return error if the request failed
+        if response.status_code != HTTP_SUCCESS_CODE:
+            logException(self, "readSecretResponse()", FILE_NAME, f"{response.text} and status code {response.status_code} returned from {self.auth[VAULT_URL]}")
+            return None, buildExceptionPayload("vaultbridgesdk_e_20500", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+        return response.text, None, None
+
+
     # @returns {dict} extracted_secret - secret in python dict format
     # @returns {string} error message if any
     # @returns {number} status code 
     def getSecret(self):
         try:
-            # Prepare the request data
-            data = f'{{"SecretId": "{self.secret_id}"}}'
-            error, code = self.generateHeaders(data)
-
+            data, headers, error, code = self.buildSecretRequest()
             if error is not None:
                 return None, error, code
 
-            # Prepare the headers
-            headers = {
-                'x-amz-date': self.amzdate,
-                'x-amz-content-sha256': self.payload_hash,
-                'Authorization': self.authorization_header,
-                'X-Amz-Target': 'secretsmanager.GetSecretValue',
-                'Content-Type': 'application/x-amz-json-1.1',
-                'X-Amz-Security-Token': self.session_token
-            }
-
-            # Send the request to AWS Secrets Manager
             logDebug(self, "getSecret()", FILE_NAME, "Sending request to get the secret")
-            response = sendPostRequest(self.auth[VAULT_URL], headers, data)
-
-            if response.status_code != HTTP_SUCCESS_CODE:
-                logException(self, "getSecret()", FILE_NAME, f"{response.text} and status code {response.status_code} returned from {self.auth[VAULT_URL]}")
-                return None, buildExceptionPayload("vaultbridgesdk_e_20500", self), HTTP_INTERNAL_SERVER_ERROR_CODE
-            
-            return response.text, None, None
+            response = sendPostRequest(getSecretsManagerEndpoint(self.auth[VAULT_URL]), headers, data, getRetryPolicy(self.vault_type))
+            return self.readSecretResponse(response)
+        except CircuitOpenError as err:
+            logException(self, "getSecret()", FILE_NAME, str(err))
+            return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", self.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE
         except Exception as err:
             logException(self, "getSecret()", FILE_NAME, str(err))
             return None, buildExceptionPayload("vaultbridgesdk_e_20900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
+
+    # @returns {string} response body
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # getSecret() for the async server
+    async def getSecretAsync(self):
+        try:
+            data, headers, error, code = self.buildSecretRequest()
+            if error is not None:
+                return None, error, code
+
+            logDebug(self, "getSecretAsync()", FILE_NAME, "Sending request to get the secret")
+            response = await sendPostRequestAsync(getSecretsManagerEndpoint(self.auth[VAULT_URL]), headers, data, getRetryPolicy(self.vault_type))
+            return self.readSecretResponse(response)
+        except CircuitOpenError as err:
+            logException(self, "getSecretAsync()", FILE_NAME, str(err))
+            return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", self.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE
+        except Exception as err:
+            logException(self, "getSecretAsync()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_20900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
     # Format certificate and Secret to replace " " with "\n" for each new line
     def formatCertKeyValue(self, cert, key):
         try:
@@ -339,8 +607,6 @@ class AWSSecretsManagerSTS(object):
             if secret_data.get("contentType", "") != "":
                 content_type = secret_data.get("contentType")
             secret_type = self.secret_type.lower()
-            print("secret_string: ",secret_string)
-            print("secret_type: ",secret_type)
             response_secret_data = {}
             
             if secret_type == "credentials":
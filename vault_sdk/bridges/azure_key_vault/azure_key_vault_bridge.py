@@ -14,11 +14,18 @@ sys.path.append(parent)
 from vault_sdk.bridges_common.constants import *
 from vault_sdk.bridges.azure_key_vault.constants import *
 from vault_sdk.bridges.azure_key_vault.error_codes import COMPONENT_EXCEPTIONS
-from vault_sdk.framework.utils import getCachedToken, saveTokenInCache, buildExceptionPayload, sendGetRequest, sendPostRequest, logException, logDebug, getCurrentFilename
+from vault_sdk.framework.retry_policy import getRetryPolicy
+from vault_sdk.framework.circuit_breaker import CircuitOpenError
+from vault_sdk.framework.request_timing import timeStage
+from vault_sdk.framework.utils import getOrFetchToken, buildExceptionPayload, buildFrameworkExceptionPayload, sendGetRequest, sendPostRequest, logException, logDebug, getCurrentFilename
+from vault_sdk.framework.async_utils import getOrFetchTokenAsync, sendGetRequestAsync, sendPostRequestAsync
 
 FILE_NAME = getCurrentFilename(__file__)
 
 class AzureKeyVault(object):
+    # attributes set by extractFromVaultAuthHeader() and prepareAuthContext() that items of a bulk request share
+    AUTH_CONTEXT_ATTRIBUTES = ("auth", "cache_key", "access_token")
+
     def __init__(self, secret_reference_metadata, secret_type, secret_urn, auth_string, transaction_id):
         self.vault_type = AZURE_KEY_VAULT
         self.secret_type = secret_type
@@ -27,6 +34,7 @@ class AzureKeyVault(object):
         self.transaction_id = transaction_id
         self.secret_urn = secret_urn
         self.error_codes = COMPONENT_EXCEPTIONS
+        self.access_token = None
 
 
     # @returns {string} error message if any
@@ -105,6 +113,67 @@ class AzureKeyVault(object):
             return buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
 
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # obtain the access token once, so it can be shared by all items of a bulk request
+    def prepareAuthContext(self):
+        token, error, code = self.getAccessToken()
+        if error is not None:
+            return error, code
+        self.access_token = token
+        return None, None
+
+
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # prepareAuthContext() for the async server
+    async def prepareAuthContextAsync(self):
+        token, error, code = await self.getAccessTokenAsync()
+        if error is not None:
+            return error, code
+        self.access_token = token
+        return None, None
+
+
+    # @returns {string} secret - raw secret returned by the vault, to be extracted by extractSecret()
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def fetchSecret(self):
+        try:
+            # items of a bulk request share the token obtained once by prepareAuthContext()
+            token = self.access_token
+            if token is None:
+                token, error, code = self.getAccessToken()
+                if error is not None:
+                    return None, error, code
+
+            return self.getSecret(token)
+        except Exception as err: 
+            logException(self, "fetchSecret()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
+    # @returns {string} secret - raw secret returned by the vault, to be extracted by extractSecret()
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # fetchSecret() for the async server
+    async def fetchSecretAsync(self):
+        try:
+            token = self.access_token
+            if token is None:
+                token, error, code = await self.getAccessTokenAsync()
+                if error is not None:
+                    return None, error, code
+
+            return await self.getSecretAsync(token)
+        except Exception as err:
+            logException(self, "fetchSecretAsync()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
     # @param {bool} is_bulk — true if this is a bulk request
     #
     # @returns {dict} extracted_secret - secret in python dict format
@@ -112,15 +181,13 @@ class AzureKeyVault(object):
     # @returns {number} status code
     def processRequestGetSecret(self, is_bulk=False):
         try:
-            token, error, code = self.getAccessToken()
-            if error is not None:
-                return None, error, code
-            
-            secret, error, code = self.getSecret(token)
+            with timeStage("fetch_secret"):
+                secret, error, code = self.fetchSecret()
             if error is not None:
                 return None, error, code
             
-            extracted_secret, error, code = self.extractSecret(secret, is_bulk)
+            with timeStage("extract_secret"):
+                extracted_secret, error, code = self.extractSecret(secret, is_bulk)
             if error is not None:
                 return None, error, code
             
@@ -130,71 +197,182 @@ class AzureKeyVault(object):
             return buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
 
+    # @param {bool} is_bulk — true if this is a bulk request
+    #
+    # @returns {dict} extracted_secret - secret in python dict format
     # @returns {string} error message if any
     # @returns {number} status code
-    def getAccessToken(self):
+    #
+    # processRequestGetSecret() for the async server
+    async def processRequestGetSecretAsync(self, is_bulk=False):
         try:
-            cached_token = getCachedToken(AZURE_KEY_VAULT, self.cache_key, self.transaction_id)
-            if cached_token != "":
-                return cached_token, None, None
-
-            # if token is expired, then send request to get a new token
-            headers = {
-                "Content-Type": "application/x-www-form-urlencoded",
-                "Accept": "application/json"
-            }
-            data = {
-                "client_id": self.auth[CLIENT_ID],
-                "client_secret": self.auth[CLIENT_SECRET],
-                "scope": "https://vault.azure.net/.default",
-                "grant_type": "client_credentials"
-            }
-
-            iam_url = f"{self.auth[AZURE_IAM_URL]}/{self.auth[TENANT_ID]}/oauth2/v2.0/token"
-            
-            response = sendPostRequest(iam_url, headers, data)
-            # return error if the request failed
-            if response.status_code != HTTP_SUCCESS_CODE:
-                logException(self, "getAccessToken()", FILE_NAME, f"Error {response.text} and status code {response.status_code} returned from {iam_url}")
-                return None, buildExceptionPayload("vaultbridgesdk_e_21500", self), HTTP_INTERNAL_SERVER_ERROR_CODE
-            data = json.loads(response.text)
-
-            if "access_token" not in data or "expires_in" not in data:
-                logException(self, "getAccessToken()", FILE_NAME, ERROR_TOKEN_NOT_RETURNED)
-                return None, buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
-            
-            # store token to cache
-            expires_dur = data.get("expires_in", 0) 
-            expiration = (datetime.now() + timedelta(seconds=expires_dur)).timestamp()
-            token = {"token": data["access_token"], "expiration": expiration}
-            saveTokenInCache(AZURE_KEY_VAULT, self.cache_key, token, self.transaction_id)
+            with timeStage("fetch_secret"):
+                secret, error, code = await self.fetchSecretAsync()
+            if error is not None:
+                return None, error, code
 
-            return data["access_token"], None, None
+            with timeStage("extract_secret"):
+                extracted_secret, error, code = self.extractSecret(secret, is_bulk)
+            if error is not None:
+                return None, error, code
+
+            return extracted_secret, None, None
+        except Exception as err:
+            logException(self, "processRequestGetSecretAsync()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # concurrent requests for the same client share one token request to Azure AAD
+    def getAccessToken(self):
+        return getOrFetchToken(AZURE_KEY_VAULT, self.cache_key, self.fetchAccessToken, self.transaction_id)
+
+
+    # @returns {string} token
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # getAccessToken() for the async server
+    async def getAccessTokenAsync(self):
+        return await getOrFetchTokenAsync(AZURE_KEY_VAULT, self.cache_key, self.fetchAccessTokenAsync, self.fetchAccessToken, self.transaction_id)
+
+
+    # @returns {string} url of the token endpoint of the tenant
+    # @returns {dict} headers of the token request
+    # @returns {dict} data of the token request
+    def buildAccessTokenRequest(self):
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json"
+        }
+        data = {
+            "client_id": self.auth[CLIENT_ID],
+            "client_secret": self.auth[CLIENT_SECRET],
+            "scope": "https://vault.azure.net/.default",
+            "grant_type": "client_credentials"
+        }
+
+        iam_url = f"{self.auth[AZURE_IAM_URL]}/{self.auth[TENANT_ID]}/oauth2/v2.0/token"
+        return iam_url, headers, data
+
+
+    # @param {response} response — response of the token request, sent by the sync or the async client
+    #
+    # @returns {dict} token - {"token": "xxxxx", "expiration": "xxxxxx"}
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def readAccessTokenResponse(self, response):
+        # return error if the request failed
+        if response.status_code != HTTP_SUCCESS_CODE:
+            logException(self, "readAccessTokenResponse()", FILE_NAME, f"Error {response.text} and status code {response.status_code} returned from {response.url}")
+            return None, buildExceptionPayload("vaultbridgesdk_e_21500", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+        data = json.loads(response.text)
+
+        if "access_token" not in data or "expires_in" not in data:
+            logException(self, "readAccessTokenResponse()", FILE_NAME, ERROR_TOKEN_NOT_RETURNED)
+            return None, buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+        
+        expires_dur = data.get("expires_in", 0) 
+        expiration = (datetime.now() + timedelta(seconds=expires_dur)).timestamp()
+        token = {"token": data["access_token"], "expiration": expiration}
+        return token, None, None
+
+
+    # @returns {dict} token - {"token": "xxxxx", "expiration": "xxxxxx"}
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def fetchAccessToken(self):
+        try:
+            iam_url, headers, data = self.buildAccessTokenRequest()
+            response = sendPostRequest(iam_url, headers, data, getRetryPolicy(self.vault_type))
+            return self.readAccessTokenResponse(response)
+        except CircuitOpenError as err:
+            logException(self, "fetchAccessToken()", FILE_NAME, str(err))
+            return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", self.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE
         except Exception as err: 
-            logException(self, "getAccessToken()", FILE_NAME, str(err))
+            logException(self, "fetchAccessToken()", FILE_NAME, str(err))
             return None, buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
 
+    # @returns {dict} token - {"token": "xxxxx", "expiration": "xxxxxx"}
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # fetchAccessToken() for the async server
+    async def fetchAccessTokenAsync(self):
+        try:
+            iam_url, headers, data = self.buildAccessTokenRequest()
+            response = await sendPostRequestAsync(iam_url, headers, data, getRetryPolicy(self.vault_type))
+            return self.readAccessTokenResponse(response)
+        except CircuitOpenError as err:
+            logException(self, "fetchAccessTokenAsync()", FILE_NAME, str(err))
+            return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", self.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE
+        except Exception as err:
+            logException(self, "fetchAccessTokenAsync()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
+    # @param {string} token — access token
+    #
+    # @returns {string} url of the secret
+    # @returns {dict} headers of the secret request
+    def buildSecretRequest(self, token):
+        headers = {
+            "Authorization": "Bearer " + token,
+            "Accept": "application/json"
+        }
+        return self.auth[VAULT_URL]+"/secrets/"+self.secret_name+"?api-version=7.3", headers
+
+
+    # @param {response} response — response of the secret request, sent by the sync or the async client
+    #
+    # @returns {string} response body
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def readSecretResponse(self, response):
+        if response.status_code != HTTP_SUCCESS_CODE:
+            logException(self, "readSecretResponse()", FILE_NAME, f"{response.text} and status code {response.status_code} returned from {self.auth[VAULT_URL]}")
+            return None, buildExceptionPayload("vaultbridgesdk_e_21501", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+        return response.text, None, None
+
+
     # @returns {dict} extracted_secret - secret in python dict format
     # @returns {string} error message if any
     # @returns {number} status code 
     def getSecret(self, token):
         try:
             logDebug(self, "getSecret()", FILE_NAME, "Sending request to get the secret")
-            headers = {
-                "Authorization": "Bearer " + token,
-                "Accept": "application/json"
-            }
-
-            response = sendGetRequest(self.auth[VAULT_URL]+"/secrets/"+self.secret_name+"?api-version=7.3", headers, None)
-            if response.status_code != HTTP_SUCCESS_CODE:
-                logException(self, "getSecret()", FILE_NAME, f"{response.text} and status code {response.status_code} returned from {self.auth[VAULT_URL]}")
-                return None, buildExceptionPayload("vaultbridgesdk_e_21501", self), HTTP_INTERNAL_SERVER_ERROR_CODE
-            return response.text, None, None
+            url, headers = self.buildSecretRequest(token)
+            response = sendGetRequest(url, headers, None, getRetryPolicy(self.vault_type))
+            return self.readSecretResponse(response)
+        except CircuitOpenError as err:
+            logException(self, "getSecret()", FILE_NAME, str(err))
+            return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", self.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE
         except Exception as err: 
             logException(self, "getSecret()", FILE_NAME, str(err))
             return None, buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
+
+    # @returns {string} response body
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # getSecret() for the async server
+    async def getSecretAsync(self, token):
+        try:
+            logDebug(self, "getSecretAsync()", FILE_NAME, "Sending request to get the secret")
+            url, headers = self.buildSecretRequest(token)
+            response = await sendGetRequestAsync(url, headers, None, getRetryPolicy(self.vault_type))
+            return self.readSecretResponse(response)
+        except CircuitOpenError as err:
+            logException(self, "getSecretAsync()", FILE_NAME, str(err))
+            return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", self.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE
+        except Exception as err:
+            logException(self, "getSecretAsync()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_21900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
     # Return certificate and Secret value from the input_string
     def extractCertKeyValue(self, input_string):
 
@@ -13,11 +13,18 @@ sys.path.append(parent)
 from vault_sdk.bridges.ibm_secrets_manager.constants import *
 from vault_sdk.bridges_common.constants import *
 from vault_sdk.bridges.ibm_secrets_manager.error_codes import COMPONENT_EXCEPTIONS
-from vault_sdk.framework.utils import getCachedToken, saveTokenInCache, sendGetRequest, sendPostRequest, buildExceptionPayload, logException, logDebug, getCurrentFilename
+from vault_sdk.framework.retry_policy import getRetryPolicy
+from vault_sdk.framework.circuit_breaker import CircuitOpenError
+from vault_sdk.framework.request_timing import timeStage
+from vault_sdk.framework.utils import getOrFetchToken, sendGetRequest, sendPostRequest, buildExceptionPayload, buildFrameworkExceptionPayload, logException, logDebug, getCurrentFilename
+from vault_sdk.framework.async_utils import getOrFetchTokenAsync, sendGetRequestAsync, sendPostRequestAsync
 
 FILE_NAME = getCurrentFilename(__file__)
 
 class IBMSecretManager(object):
+    # attributes set by extractFromVaultAuthHeader() and prepareAuthContext() that items of a bulk request share
+    AUTH_CONTEXT_ATTRIBUTES = ("auth", "cache_key", "access_token")
+
     def __init__(self, secret_reference_metadata, secret_type, secret_urn, auth_string, transaction_id):
         self.vault_type = IBM_SECRETS_MANAGER
         self.secret_reference_metadata = secret_reference_metadata
@@ -27,6 +34,7 @@ class IBMSecretManager(object):
         self.transaction_id = transaction_id
         self.secret_id = ""
         self.error_codes = COMPONENT_EXCEPTIONS
+        self.access_token = None
 
 
     # @returns {string} error message if any
@@ -107,6 +115,67 @@ class IBMSecretManager(object):
             return buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
 
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # obtain the access token once, so it can be shared by all items of a bulk request
+    def prepareAuthContext(self):
+        token, error, code = self.getAccessToken()
+        if error is not None:
+            return error, code
+        self.access_token = token
+        return None, None
+
+
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # prepareAuthContext() for the async server
+    async def prepareAuthContextAsync(self):
+        token, error, code = await self.getAccessTokenAsync()
+        if error is not None:
+            return error, code
+        self.access_token = token
+        return None, None
+
+
+    # @returns {string} secret - raw secret returned by the vault, to be extracted by extractSecret()
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def fetchSecret(self):
+        try:
+            # items of a bulk request share the token obtained once by prepareAuthContext()
+            token = self.access_token
+            if token is None:
+                token, error, code = self.getAccessToken()
+                if error is not None:
+                    return None, error, code
+
+            return self.getSecret(token)
+        except Exception as err: 
+            logException(self, "fetchSecret()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
+    # @returns {string} secret - raw secret returned by the vault, to be extracted by extractSecret()
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # fetchSecret() for the async server
+    async def fetchSecretAsync(self):
+        try:
+            token = self.access_token
+            if token is None:
+                token, error, code = await self.getAccessTokenAsync()
+                if error is not None:
+                    return None, error, code
+
+            return await self.getSecretAsync(token)
+        except Exception as err:
+            logException(self, "fetchSecretAsync()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
     # @param {bool} is_bulk — true if this is a bulk request
     #
     # @returns {dict} extracted_secret - secret in python dict format
@@ -114,15 +183,13 @@ class IBMSecretManager(object):
     # @returns {number} status code
     def processRequestGetSecret(self, is_bulk=False):
         try:
-            token, error, code = self.getAccessToken()
-            if error is not None:
-                return None, error, code
-            
-            secret, error, code = self.getSecret(token)
+            with timeStage("fetch_secret"):
+                secret, error, code = self.fetchSecret()
             if error is not None:
                 return None, error, code
             
-            extracted_secret, error, code = self.extractSecret(secret, is_bulk)
+            with timeStage("extract_secret"):
+                extracted_secret, error, code = self.extractSecret(secret, is_bulk)
             if error is not None:
                 return None, error, code
             
@@ -132,68 +199,178 @@ class IBMSecretManager(object):
             return buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
 
+    # @param {bool} is_bulk — true if this is a bulk request
+    #
+    # @returns {dict} extracted_secret - secret in python dict format
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # processRequestGetSecret() for the async server
+    async def processRequestGetSecretAsync(self, is_bulk=False):
+        try:
+            with timeStage("fetch_secret"):
+                secret, error, code = await self.fetchSecretAsync()
+            if error is not None:
+                return None, error, code
+
+            with timeStage("extract_secret"):
+                extracted_secret, error, code = self.extractSecret(secret, is_bulk)
+            if error is not None:
+                return None, error, code
+
+            return extracted_secret, None, None
+        except Exception as err:
+            logException(self, "processRequestGetSecretAsync()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
     # @returns {string} token
     # @returns {string} error message if any
     # @returns {number} status code
+    #
+    # concurrent requests for the same api key share one token request to IBM IAM
     def getAccessToken(self):
-        try:
-            cached_token = getCachedToken(IBM_SECRETS_MANAGER, self.cache_key, self.transaction_id)
-            if cached_token != "":
-                return cached_token, None, None
-
-            # if no cached token is found, then send request to get a new token
-            headers = {
-                "Content-Type": "application/x-www-form-urlencoded",
-                "Accept": "application/json"
-            }
-            data = {
-                "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-                "apikey": self.auth[API_KEY]
-            }
-
-            response = sendPostRequest(self.auth[IBM_CLOUD_IAM_URL], headers, data)
-            # return error if the request failed
-            if response.status_code != HTTP_SUCCESS_CODE:
-                logException(self, "getAccessToken()", FILE_NAME, f"{response.text} and status code {response.status_code} returned from {self.auth[IBM_CLOUD_IAM_URL]}")
-                return None, buildExceptionPayload("vaultbridgesdk_e_22501", self), HTTP_INTERNAL_SERVER_ERROR_CODE
-            
-            
-            data = json.loads(response.text)
+        return getOrFetchToken(IBM_SECRETS_MANAGER, self.cache_key, self.fetchAccessToken, self.transaction_id)
 
-            if "access_token" not in data or "expiration" not in data:
-                logException(ERROR_TOKEN_NOT_RETURNED)
-                return None, buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
-            # store token to cache
-            token = {"token": data["access_token"], "expiration": data["expiration"]}
-            saveTokenInCache(IBM_SECRETS_MANAGER, self.cache_key, token, self.transaction_id)
+    # @returns {string} token
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # getAccessToken() for the async server
+    async def getAccessTokenAsync(self):
+        return await getOrFetchTokenAsync(IBM_SECRETS_MANAGER, self.cache_key, self.fetchAccessTokenAsync, self.fetchAccessToken, self.transaction_id)
+
+
+    # @returns {string} url of IBM IAM
+    # @returns {dict} headers of the token request
+    # @returns {dict} data of the token request
+    def buildAccessTokenRequest(self):
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json"
+        }
+        data = {
+            "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
+            "apikey": self.auth[API_KEY]
+        }
+        return self.auth[IBM_CLOUD_IAM_URL], headers, data
+
+
+    # @param {response} response — response of the token request, sent by the sync or the async client
+    #
+    # @returns {dict} token - {"token": "xxxxx", "expiration": "xxxxxx"}
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def readAccessTokenResponse(self, response):
+        # return error if the request failed
+        if response.status_code != HTTP_SUCCESS_CODE:
+            logException(self, "readAccessTokenResponse()", FILE_NAME, f"{response.text} and status code {response.status_code} returned from {self.auth[IBM_CLOUD_IAM_URL]}")
+            return None, buildExceptionPayload("vaultbridgesdk_e_22501", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+        data = json.loads(response.text)
 
-            return token["token"], None, None
+        if "access_token" not in data or "expiration" not in data:
+            logException(self, "readAccessTokenResponse()", FILE_NAME, ERROR_TOKEN_NOT_RETURNED)
+            return None, buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+        token = {"token": data["access_token"], "expiration": data["expiration"]}
+        return token, None, None
+
+
+    # @returns {dict} token - {"token": "xxxxx", "expiration": "xxxxxx"}
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def fetchAccessToken(self):
+        try:
+            url, headers, data = self.buildAccessTokenRequest()
+            response = sendPostRequest(url, headers, data, getRetryPolicy(self.vault_type))
+            return self.readAccessTokenResponse(response)
+        except CircuitOpenError as err:
+            logException(self, "fetchAccessToken()", FILE_NAME, str(err))
+            return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", self.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE
         except Exception as err: 
-            logException(self, "getAccessToken()", FILE_NAME, str(err))
+            logException(self, "fetchAccessToken()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
+    # @returns {dict} token - {"token": "xxxxx", "expiration": "xxxxxx"}
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # fetchAccessToken() for the async server
+    async def fetchAccessTokenAsync(self):
+        try:
+            url, headers, data = self.buildAccessTokenRequest()
+            response = await sendPostRequestAsync(url, headers, data, getRetryPolicy(self.vault_type))
+            return self.readAccessTokenResponse(response)
+        except CircuitOpenError as err:
+            logException(self, "fetchAccessTokenAsync()", FILE_NAME, str(err))
+            return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", self.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE
+        except Exception as err:
+            logException(self, "fetchAccessTokenAsync()", FILE_NAME, str(err))
             return None, buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
 
 
+    # @param {string} token — access token
+    #
+    # @returns {string} url of the secret
+    # @returns {dict} headers of the secret request
+    def buildSecretRequest(self, token):
+        headers = {
+            "Authorization": "Bearer " + token,
+            "Accept": "application/json"
+        }
+        return self.auth[VAULT_URL]+"/api/v2/secrets/"+self.secret_id, headers
+
+
+    # @param {response} response — response of the secret request, sent by the sync or the async client
+    #
+    # @returns {string} response body
+    # @returns {string} error message if any
+    # @returns {number} status code
+    def readSecretResponse(self, response):
+        if response.status_code != HTTP_SUCCESS_CODE:
+            logException(self, "readSecretResponse()", FILE_NAME, f"{response.text} and status code {response.status_code} returned from {self.auth[VAULT_URL]}")
+            return None, buildExceptionPayload("vaultbridgesdk_e_22501", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+        return response.text, None, None
+
+
     # @returns {string} response body
     # @returns {string} error message if any
     # @returns {number} status code    
     def getSecret(self, token):
         try:
             logDebug(self, "getSecret()", FILE_NAME, "Sending request to get the secret")
-            headers = {
-                "Authorization": "Bearer " + token,
-                "Accept": "application/json"
-            }
-
-            response = sendGetRequest(self.auth[VAULT_URL]+"/api/v2/secrets/"+self.secret_id, headers, None)
-            if response.status_code != HTTP_SUCCESS_CODE:
-                logException(self, "getSecret()", FILE_NAME, f"{response.text} and status code {response.status_code} returned from {self.auth[VAULT_URL]}")
-                return None, buildExceptionPayload("vaultbridgesdk_e_22501", self), HTTP_INTERNAL_SERVER_ERROR_CODE
-
-            return response.text, None, None
+            url, headers = self.buildSecretRequest(token)
+            response = sendGetRequest(url, headers, None, getRetryPolicy(self.vault_type))
+            return self.readSecretResponse(response)
+        except CircuitOpenError as err:
+            logException(self, "getSecret()", FILE_NAME, str(err))
+            return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", self.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE
         except Exception as err: 
             logException(self, "getSecret()", FILE_NAME, str(err))
             return None, buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
+    # @returns {string} response body
+    # @returns {string} error message if any
+    # @returns {number} status code
+    #
+    # getSecret() for the async server
+    async def getSecretAsync(self, token):
+        try:
+            logDebug(self, "getSecretAsync()", FILE_NAME, "Sending request to get the secret")
+            url, headers = self.buildSecretRequest(token)
+            response = await sendGetRequestAsync(url, headers, None, getRetryPolicy(self.vault_type))
+            return self.readSecretResponse(response)
+        except CircuitOpenError as err:
+            logException(self, "getSecretAsync()", FILE_NAME, str(err))
+            return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10902", self.transaction_id), HTTP_SERVICE_UNAVAILABLE_CODE
+        except Exception as err:
+            logException(self, "getSecretAsync()", FILE_NAME, str(err))
+            return None, buildExceptionPayload("vaultbridgesdk_e_22900", self), HTTP_INTERNAL_SERVER_ERROR_CODE
         
 
     # @param {string} secret — secret content in string
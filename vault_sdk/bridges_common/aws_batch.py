@@ -0,0 +1,250 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+
+# set to false to read the secrets of AWS bulk requests with one GetSecretValue request each, for example
+# when the IAM policy of the vault credentials does not allow secretsmanager:BatchGetSecretValue
+AWS_BATCH_GET_SECRET_VALUE = os.environ.get('AWS_BATCH_GET_SECRET_VALUE', 'true')
+
+AWS_GET_SECRET_VALUE_TARGET = "secretsmanager.GetSecretValue"
+AWS_BATCH_GET_SECRET_VALUE_TARGET = "secretsmanager.BatchGetSecretValue"
+
+# maximum number of secret ids AWS accepts in one BatchGetSecretValue request
+AWS_BATCH_GET_SECRET_VALUE_MAX_IDS = 20
+
+# number of distinct secrets of a bulk request read with one request to AWS
+AWS_SECRET_BATCH_SIZE = AWS_BATCH_GET_SECRET_VALUE_MAX_IDS if AWS_BATCH_GET_SECRET_VALUE == 'true' else 1
+
+# milliseconds a single secret request waits for concurrent requests with the same credentials to be read with it
+# in one BatchGetSecretValue request, 0 disables micro-batching
+AWS_MICRO_BATCH_WINDOW_MS = int(os.environ.get('AWS_MICRO_BATCH_WINDOW_MS', 0))
+# maximum number of requests in one micro-batch, the batch is sent as soon as it is full
+AWS_MICRO_BATCH_MAX_SIZE = min(int(os.environ.get('AWS_MICRO_BATCH_MAX_SIZE', AWS_BATCH_GET_SECRET_VALUE_MAX_IDS)), AWS_BATCH_GET_SECRET_VALUE_MAX_IDS)
+
+
+# a dict that stores the micro-batches collecting requests, for example:
+#
+# MICRO_BATCHES = {
+#     ("aws-secrets-manager", "secretsmanager.us-east-1.amazonaws.com", "<auth-string-fingerprint>"): {
+#         "vaults": [<vault object>, ...],
+#         "full": <threading.Event>,
+#         "done": <threading.Event>,
+#         "results": {"<secret-id>": (secret, error, code)}
+#     },
+#     .....
+# }
+MICRO_BATCHES = {}
+MICRO_BATCHES_LOCK = threading.Lock()
+
+# the micro-batches of the async server, only used by its event loop thread, with an asyncio.Event for "full" and "done"
+ASYNC_MICRO_BATCHES = {}
+
+
+# @param {string} vault_url — vault url of the Vault-Auth header
+#
+# @returns {string} url the Secrets Manager requests are sent to, the vault url the requests are signed for
+#
+# benchmarks/gunicorn_config.py replaces it in the gunicorn workers of the load test to reach its stand-in server
+def getSecretsManagerEndpoint(vault_url):
+    return vault_url
+
+
+# @param {array} secret_ids — secret ids, names or ARNs
+#
+# @returns {string} BatchGetSecretValue request body
+def buildBatchGetSecretValuePayload(secret_ids):
+    return json.dumps({"SecretIdList": secret_ids})
+
+
+# @param {array} secret_ids — secret ids, names or ARNs sent in the BatchGetSecretValue request
+# @param {string} response_text — BatchGetSecretValue response body
+#
+# @returns {dict} secrets — secret id to secret value entry in the GetSecretValue response format
+# @returns {dict} errors — secret id to error entry
+#
+# a secret value entry is matched by its name or full ARN, ids matching neither (for example partial ARNs)
+# are missing from both dicts and are left to a GetSecretValue request
+def mapBatchSecretValues(secret_ids, response_text):
+    requested = set(secret_ids)
+    data = json.loads(response_text)
+
+    secrets = {}
+    for entry in data.get("SecretValues", []):
+        for identifier in (entry.get("Name"), entry.get("ARN")):
+            if identifier in requested:
+                secrets[identifier] = json.dumps(entry)
+
+    errors = {}
+    for entry in data.get("Errors", []):
+        if entry.get("SecretId") in requested:
+            errors[entry["SecretId"]] = entry
+
+    return secrets, errors
+
+
+# @param {vault object} vault — the vault object
+#
+# @returns {tuple} key of the micro-batches the request of the vault object can join, the credentials are only kept as a fingerprint
+def getMicroBatchKey(vault):
+    auth_fingerprint = hashlib.sha256(vault.auth_string.encode('utf-8')).hexdigest()
+    return (vault.vault_type, vault.host, auth_fingerprint)
+
+
+# @param {vault object} vault — the vault object of a single secret request
+#
+# @returns {string} secret - raw secret returned by the vault
+# @returns {string} error message if any
+# @returns {number} status code
+#
+# the first request of a batch waits AWS_MICRO_BATCH_WINDOW_MS, or until the batch is full, and reads the secrets of
+# every request that joined it with one fetchSecretBatch() call, the other requests wait for its results
+def fetchSecretWithMicroBatch(vault):
+    if AWS_MICRO_BATCH_WINDOW_MS <= 0 or AWS_BATCH_GET_SECRET_VALUE != 'true':
+        return vault.fetchSecret()
+
+    key = getMicroBatchKey(vault)
+    with MICRO_BATCHES_LOCK:
+        batch = MICRO_BATCHES.get(key)
+        is_leader = batch is None
+        if is_leader:
+            batch = {"vaults": [], "full": threading.Event(), "done": threading.Event(), "results": None}
+            MICRO_BATCHES[key] = batch
+        batch["vaults"].append(vault)
+        if len(batch["vaults"]) >= AWS_MICRO_BATCH_MAX_SIZE:
+            MICRO_BATCHES.pop(key, None)
+            batch["full"].set()
+
+    if is_leader:
+        runMicroBatch(key, batch)
+    else:
+        batch["done"].wait()
+
+    result = getMicroBatchResult(batch, vault)
+    if result is None:
+        # the batch failed before the secret was read, so read it on its own
+        return vault.fetchSecret()
+    return result
+
+
+# @param {vault object} vault — the vault object of a single secret request
+#
+# @returns {string} secret - raw secret returned by the vault
+# @returns {string} error message if any
+# @returns {number} status code
+#
+# fetchSecretWithMicroBatch() for the async server, the requests wait for the batch on the event loop
+async def fetchSecretWithMicroBatchAsync(vault):
+    if AWS_MICRO_BATCH_WINDOW_MS <= 0 or AWS_BATCH_GET_SECRET_VALUE != 'true':
+        return await vault.fetchSecretAsync()
+
+    key = getMicroBatchKey(vault)
+    batch = ASYNC_MICRO_BATCHES.get(key)
+    is_leader = batch is None
+    if is_leader:
+        batch = {"vaults": [], "full": asyncio.Event(), "done": asyncio.Event(), "results": None}
+        ASYNC_MICRO_BATCHES[key] = batch
+    batch["vaults"].append(vault)
+    if len(batch["vaults"]) >= AWS_MICRO_BATCH_MAX_SIZE:
+        ASYNC_MICRO_BATCHES.pop(key, None)
+        batch["full"].set()
+
+    if is_leader:
+        await runMicroBatchAsync(key, batch)
+    else:
+        await batch["done"].wait()
+
+    result = getMicroBatchResult(batch, vault)
+    if result is None:
+        # the batch failed before the secret was read, so read it on its own
+        return await vault.fetchSecretAsync()
+    return result
+
+
+# @param {dict} batch — the finished micro-batch
+# @param {vault object} vault — the vault object of a request of the batch
+#
+# @returns {tuple} (secret, error, code) read for the request, None if the batch failed before the secret was read
+def getMicroBatchResult(batch, vault):
+    result = batch["results"].get(vault.secret_id)
+    if result is None:
+        return None
+
+    secret, error, code = result
+    if error is not None and error.get("trace") != vault.transaction_id:
+        # the error was built for another request of the batch, report it with the trace of this request
+        error = copy.deepcopy(error)
+        error["trace"] = vault.transaction_id
+    return secret, error, code
+
+
+# @param {dict} batch — the micro-batch
+#
+# @returns {array} one vault object per secret id, requests for the same secret share one secret id in the batch
+def getDistinctMicroBatchVaults(batch):
+    distinct_vaults = {}
+    for vault in batch["vaults"]:
+        distinct_vaults.setdefault(vault.secret_id, vault)
+    return list(distinct_vaults.values())
+
+
+# @param {tuple} key — key of the micro-batch
+# @param {dict} batch — the micro-batch led by the current request
+def runMicroBatch(key, batch):
+    try:
+        batch["full"].wait(AWS_MICRO_BATCH_WINDOW_MS / 1000)
+        with MICRO_BATCHES_LOCK:
+            if MICRO_BATCHES.get(key) is batch:
+                MICRO_BATCHES.pop(key)
+
+        vaults = getDistinctMicroBatchVaults(batch)
+
+        if len(vaults) == 1:
+            fetched_secrets = [vaults[0].fetchSecret()]
+        else:
+            fetched_secrets = vaults[0].fetchSecretBatch(vaults)
+        batch["results"] = {vault.secret_id: result for vault, result in zip(vaults, fetched_secrets)}
+    finally:
+        if batch["results"] is None:
+            batch["results"] = {}
+        batch["done"].set()
+
+
+# @param {tuple} key — key of the micro-batch
+# @param {dict} batch — the micro-batch led by the current request
+#
+# runMicroBatch() for the async server, a cancelled leader still ends the batch, so the other requests read their own secrets
+async def runMicroBatchAsync(key, batch):
+    try:
+        try:
+            await asyncio.wait_for(batch["full"].wait(), AWS_MICRO_BATCH_WINDOW_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+        if ASYNC_MICRO_BATCHES.get(key) is batch:
+            ASYNC_MICRO_BATCHES.pop(key)
+
+        vaults = getDistinctMicroBatchVaults(batch)
+        if len(vaults) == 1:
+            fetched_secrets = [await vaults[0].fetchSecretAsync()]
+        else:
+            fetched_secrets = await vaults[0].fetchSecretBatchAsync(vaults)
+        batch["results"] = {vault.secret_id: result for vault, result in zip(vaults, fetched_secrets)}
+    finally:
+        if ASYNC_MICRO_BATCHES.get(key) is batch:
+            ASYNC_MICRO_BATCHES.pop(key)
+        if batch["results"] is None:
+            batch["results"] = {}
+        batch["done"].set()
+
+
+# micro-batches must not be shared between a gunicorn master and its workers
+def resetMicroBatchesAfterFork():
+    global MICRO_BATCHES_LOCK
+    MICRO_BATCHES_LOCK = threading.Lock()
+    MICRO_BATCHES.clear()
+    ASYNC_MICRO_BATCHES.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetMicroBatchesAfterFork)
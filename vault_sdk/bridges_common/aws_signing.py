@@ -0,0 +1,49 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# maximum number of derived SigV4 signing keys kept per process
+AWS_SIGNING_KEY_CACHE_SIZE = int(os.environ.get('AWS_SIGNING_KEY_CACHE_SIZE', 128))
+
+
+# an ordered dict that stores derived signing keys shared by the AWS bridges, for example:
+#
+# CACHED_SIGNING_KEY = OrderedDict({
+#     ("<secret-access-key-fingerprint>", "<datestamp>", "<region>", "<service>"): b"<signing-key>",
+#     .....
+# })
+CACHED_SIGNING_KEY = OrderedDict()
+CACHED_SIGNING_KEY_LOCK = threading.Lock()
+
+
+# @param {string} secret_access_key — AWS secret access key
+# @param {string} datestamp — date in format of YYYYMMDD
+# @param {string} region — AWS region
+# @param {string} service — AWS service
+#
+# @returns {tuple} cache key of the signing key, the secret access key is only kept as a fingerprint
+def getSigningKeyCacheKey(secret_access_key, datestamp, region, service):
+    fingerprint = hashlib.sha256(secret_access_key.encode('utf-8')).hexdigest()
+    return (fingerprint, datestamp, region, service)
+
+
+# @param {tuple} key — cache key of the signing key
+#
+# @returns {bytes} cached signing key, None if not found
+def getCachedSigningKey(key):
+    with CACHED_SIGNING_KEY_LOCK:
+        signing_key = CACHED_SIGNING_KEY.get(key)
+        if signing_key is not None:
+            CACHED_SIGNING_KEY.move_to_end(key)
+        return signing_key
+
+
+# @param {tuple} key — cache key of the signing key
+# @param {bytes} signing_key — derived signing key
+def saveSigningKeyInCache(key, signing_key):
+    with CACHED_SIGNING_KEY_LOCK:
+        CACHED_SIGNING_KEY[key] = signing_key
+        CACHED_SIGNING_KEY.move_to_end(key)
+        while len(CACHED_SIGNING_KEY) > AWS_SIGNING_KEY_CACHE_SIZE:
+            CACHED_SIGNING_KEY.popitem(last=False)
@@ -25,6 +25,10 @@ SECRET_URN = "secret_urn"
 SECRET_TYPE = "secret_type"
 VAULT_AUTH_HEADER = "Vault-Auth"
 TRANSACTION_ID_HEADER = "IBM-CPD-Transaction-ID"
+ACCEPT_HEADER = "Accept"
+CONTENT_ENCODING_HEADER = "Content-Encoding"
+SERVER_TIMING_HEADER = "Server-Timing"
+NDJSON_MIMETYPE = "application/x-ndjson"
 
 # error message
 ERROR_MISSING_VAULT_HEADER = "Missing vault connection information in VAULT-AUTH header"
@@ -38,9 +42,12 @@ HTTP_BAD_REQUEST_CODE = 400
 HTTP_UNAUTHORIZED = 401
 HTTP_FORBIDDEN_CODE = 403
 HTTP_NOT_FOUND_CODE = 404
+HTTP_REQUEST_ENTITY_TOO_LARGE_CODE = 413
+HTTP_TOO_MANY_REQUESTS_CODE = 429
 HTTP_INTERNAL_SERVER_ERROR_CODE = 500
+HTTP_SERVICE_UNAVAILABLE_CODE = 503
 
-RETRY_ERROR_CODE_LIST = [500, 502, 503, 504]
+RETRY_ERROR_CODE_LIST = [429, 500, 502, 503, 504]
 
 INTERNAL_SERVER_ERROR = "Internal server error"
 
@@ -0,0 +1,451 @@
+import asyncio
+import copy
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from vault_sdk.bridges_common.constants import *
+from vault_sdk.framework import caches
+from vault_sdk.framework import metrics
+from vault_sdk.framework.connection_pool import getAsyncClient
+from vault_sdk.framework.retry_policy import getRetryPolicy
+from vault_sdk.framework.circuit_breaker import getCircuitBreaker
+from vault_sdk.framework.shared_token_cache import sharedTokenLockAsync
+from vault_sdk.framework.cache_backends import getDistributedCache
+from vault_sdk.framework.request_timing import timeStage, recordStageRetry, bindRequestTimer, getRequestTimer, activateRequestTimer
+from vault_sdk.framework.tracing import startSpan, setSpanAttributes
+from vault_sdk.framework import utils
+from vault_sdk.framework.utils import getUrlHost, getCachedToken, isTokenUsable, getStoredToken, saveTokenInCache, startTokenRefreshThread, \
+                                      getSecretCacheTTL, getCachedVaultSecret, saveVaultSecretInCache, batchBulkVaults, shareAuthContext, \
+                                      readCachedBulkItems, extractBulkItems, collectBulkBatchResults, buildFrameworkExceptionPayload, \
+                                      logException, logDebug, logFrameworkDebug, logFrameworkException, getCurrentFilename
+
+FILE_NAME = getCurrentFilename(__file__)
+
+# maximum number of threads of the async server running blocking work, that is the parsing and validation of requests,
+# the AssumeRole calls of the STS bridge, metric rendering and the distributed cache client. The vault requests are sent
+# by the async client on the event loop and hold no thread, so this does not limit the number of vault calls in flight,
+# see VAULT_ASYNC_MAX_CONNECTIONS
+ASGI_MAX_WORKERS = int(os.environ.get('ASGI_MAX_WORKERS', 64))
+
+ASGI_EXECUTOR = None
+ASGI_EXECUTOR_LOCK = threading.Lock()
+
+# @returns {ThreadPoolExecutor} executor running the blocking work of the async server
+def getAsgiExecutor():
+    global ASGI_EXECUTOR
+    if ASGI_EXECUTOR is None:
+        with ASGI_EXECUTOR_LOCK:
+            if ASGI_EXECUTOR is None:
+                ASGI_EXECUTOR = ThreadPoolExecutor(max_workers=ASGI_MAX_WORKERS, thread_name_prefix="asgi")
+    return ASGI_EXECUTOR
+
+
+# stop the executor threads, called when the async server shuts down
+def shutdownAsgiExecutor():
+    global ASGI_EXECUTOR
+    if ASGI_EXECUTOR is not None:
+        ASGI_EXECUTOR.shutdown(wait=False)
+        ASGI_EXECUTOR = None
+
+
+# worker threads do not survive a fork, so a forked gunicorn worker creates its own executor
+def resetAsgiExecutorAfterFork():
+    global ASGI_EXECUTOR, ASGI_EXECUTOR_LOCK
+    ASGI_EXECUTOR = None
+    ASGI_EXECUTOR_LOCK = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetAsgiExecutorAfterFork)
+
+
+# @param {function} func — blocking function
+# @param {any} args — arguments of the function
+#
+# @returns {any} return value of the function, run on the executor so the event loop is never blocked,
+#                the function records its stages in the timer of the current request
+async def runInExecutor(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(getAsgiExecutor(), bindRequestTimer(func), *args)
+
+
+# @param {function} func — function reading or writing the token or secret caches
+# @param {any} args — arguments of the function
+#
+# @returns {any} return value of the function, run on the executor when it may wait for the distributed cache,
+#                in line when the caches are in the memory of the worker
+async def runCacheCall(func, *args):
+    if getDistributedCache() is None:
+        return func(*args)
+    return await runInExecutor(func, *args)
+
+
+# @param {string} url - request url
+# @param {dict} headers — request header
+# @param {dict} data — request data
+# @param {RetryPolicy} retry_policy — retry policy of the request, the default policy if not set
+#
+# @returns {requests.Response} response
+async def sendGetRequestAsync(url, headers, data, retry_policy=None):
+    return await sendRequestAsync("GET", url, headers, data, retry_policy)
+
+
+# @param {string} url - request url
+# @param {dict} headers — request header
+# @param {dict} data — request data
+# @param {RetryPolicy} retry_policy — retry policy of the request, the default policy if not set
+#
+# @returns {requests.Response} response
+async def sendPostRequestAsync(url, headers, data, retry_policy=None):
+    return await sendRequestAsync("POST", url, headers, data, retry_policy)
+
+
+# @param {string} method - http method
+# @param {string} url - request url
+# @param {dict} headers — request header
+# @param {dict} data — request data, a dict is sent form encoded and a string as it is
+# @param {RetryPolicy} retry_policy — retry policy of the request, the default policy if not set
+#
+# @returns {requests.Response} response, read completely, so the bridges handle it as the response of sendRequest()
+#
+# sendRequest() for the async server, the request is sent by the async client of the event loop and the retries
+# wait with asyncio.sleep(), so a slow vault holds no thread. The retry policy and circuit breaker are the same,
+# connection errors and timeouts of the last attempt are raised as aiohttp.ClientError and asyncio.TimeoutError
+#
+# CircuitOpenError is raised without sending the request while the circuit breaker of the host is open
+async def sendRequestAsync(method, url, headers, data, retry_policy=None):
+    if retry_policy is None:
+        retry_policy = getRetryPolicy()
+    host = getUrlHost(url)
+    breaker = getCircuitBreaker(host)
+    client = getAsyncClient(utils.SKIP_TLS_VERIFY == 'false', asyncio.get_running_loop())
+    deadline = retry_policy.getDeadline()
+    attempt = 1
+
+    while True:
+        if breaker is not None:
+            breaker.beforeRequest()
+
+        connect_timeout, read_timeout = retry_policy.getTimeout(deadline)
+        start = time.perf_counter()
+        response = None
+        request_error = None
+        failed = True
+        # one span per attempt, the query string is left out of the url
+        span_attributes = {"http.request.method": method, "server.address": host, "url.full": url.split("?", 1)[0], "vault_bridge.attempt": attempt}
+        with startSpan(method, span_attributes, client=True) as span:
+            try:
+                timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+                async with client.request(method, url, headers=headers, data=data, timeout=timeout) as client_response:
+                    response = await readClientResponse(client_response)
+                logFrameworkDebug(None, "sendRequestAsync()", FILE_NAME, "send %s request to %s, and get response: %s", method, url, response)
+                failed = response.status_code >= HTTP_INTERNAL_SERVER_ERROR_CODE
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                request_error = err
+            except asyncio.CancelledError:
+                # the request was abandoned by its client, which tells nothing about the host
+                if breaker is not None:
+                    breaker.abandonRequest()
+                breaker = None
+                raise
+            finally:
+                if breaker is not None:
+                    breaker.recordResult(failed)
+            if response is not None:
+                setSpanAttributes(span, {"http.response.status_code": response.status_code})
+            if failed:
+                setSpanAttributes(span, {"error.type": str(response.status_code) if response is not None else type(request_error).__name__})
+        metrics.observeHistogram("vault_bridge_outbound_request_duration_seconds", {"host": metrics.getHostLabel(host), "method": method}, time.perf_counter() - start)
+
+        retry_delay = retry_policy.getRetryDelay(attempt, response, deadline)
+        if retry_delay is None:
+            if request_error is not None:
+                raise request_error
+            return response
+
+        reason = response.status_code if response is not None else type(request_error).__name__
+        logFrameworkDebug(None, "sendRequestAsync()", FILE_NAME, "receive %s, and tried %d times, and retry delay is %s", reason, attempt, retry_delay)
+        metrics.incrementCounter("vault_bridge_outbound_retries_total", {"host": metrics.getHostLabel(host), "method": method})
+        recordStageRetry()
+        attempt = attempt + 1
+        await asyncio.sleep(retry_delay)
+
+
+# @param {aiohttp.ClientResponse} client_response — response of the async client
+#
+# @returns {requests.Response} response with the status, headers, body and encoding of the async client response
+async def readClientResponse(client_response):
+    response = requests.Response()
+    response.status_code = client_response.status
+    response.reason = client_response.reason
+    response.headers = CaseInsensitiveDict(client_response.headers)
+    response.url = str(client_response.url)
+    response._content = await client_response.read()
+    response.encoding = get_encoding_from_headers(response.headers)
+    return response
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {string} access token, empty if there is none
+async def getCachedTokenAsync(vault_type, key, transaction_id):
+    cached_token = caches.CACHED_TOKEN.get(vault_type, {}).get(key)
+    if cached_token is not None and isTokenUsable(cached_token):
+        # a usable token of the worker is returned without reading the shared caches
+        return getCachedToken(vault_type, key, transaction_id)
+    return await runCacheCall(getCachedToken, vault_type, key, transaction_id)
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {function} fetch_token_async — coroutine function that requests a new token from the vault IAM,
+#                                       returns {"token": "xxxxx", "expiration": "xxxxxx"}, error message if any, status code
+# @param {function} fetch_token — blocking function doing the same, used by the thread renewing tokens ahead of expiration
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {any} access token
+# @returns {string} error message if any
+# @returns {number} status code
+#
+# getOrFetchToken() for the async server, only one task fetches a missing or expired token for a given vault type and key,
+# concurrent tasks wait up to TOKEN_FETCH_WAIT_TIMEOUT seconds and receive the same token or error
+async def getOrFetchTokenAsync(vault_type, key, fetch_token_async, fetch_token, transaction_id):
+    with timeStage("token"):
+        cached_token = await getCachedTokenAsync(vault_type, key, transaction_id)
+        if cached_token != "":
+            return cached_token, None, None
+
+        if utils.TOKEN_REFRESH_AHEAD == 'true':
+            startTokenRefreshThread()
+
+        return await joinTokenFlightAsync(vault_type, key, fetch_token_async, fetch_token, transaction_id)
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {function} fetch_token_async — coroutine function that requests a new token from the vault IAM
+# @param {function} fetch_token — blocking function doing the same
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {any} access token
+# @returns {string} error message if any
+# @returns {number} status code
+#
+# the token is fetched by a task of its own, so a request cancelled by its client does not cancel the fetch the others wait for
+async def joinTokenFlightAsync(vault_type, key, fetch_token_async, fetch_token, transaction_id):
+    flight_key = (vault_type, key)
+    flight = caches.ASYNC_TOKEN_FLIGHTS.get(flight_key)
+    is_leader = flight is None
+    if is_leader:
+        flight = asyncio.ensure_future(runTokenFlightAsync(vault_type, key, fetch_token_async, fetch_token, transaction_id))
+        caches.ASYNC_TOKEN_FLIGHTS[flight_key] = flight
+        flight.add_done_callback(lambda done: caches.ASYNC_TOKEN_FLIGHTS.pop(flight_key, None) if caches.ASYNC_TOKEN_FLIGHTS.get(flight_key) is done else None)
+        return await asyncio.shield(flight)
+
+    logFrameworkDebug(transaction_id, "joinTokenFlightAsync()", FILE_NAME, "Waiting for token fetched by a concurrent request")
+    try:
+        token, error, code = await asyncio.wait_for(asyncio.shield(flight), utils.TOKEN_FETCH_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        logFrameworkException(transaction_id, "joinTokenFlightAsync()", FILE_NAME, f"Timed out after {utils.TOKEN_FETCH_WAIT_TIMEOUT} seconds waiting for token fetched by a concurrent request")
+        return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10901", transaction_id), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+    if error is not None:
+        # the error was built for the request that fetched the token, report it with the trace of this request
+        error = copy.deepcopy(error)
+        error["trace"] = transaction_id
+    return token, error, code
+
+
+# @returns {any} access token
+# @returns {string} error message if any
+# @returns {number} status code
+async def runTokenFlightAsync(vault_type, key, fetch_token_async, fetch_token, transaction_id):
+    try:
+        return await fetchTokenForFlightAsync(vault_type, key, fetch_token_async, fetch_token, transaction_id)
+    except Exception as err:
+        logFrameworkException(transaction_id, "runTokenFlightAsync()", FILE_NAME, str(err))
+        return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10900", transaction_id), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
+# @returns {any} access token
+# @returns {string} error message if any
+# @returns {number} status code
+async def fetchTokenForFlightAsync(vault_type, key, fetch_token_async, fetch_token, transaction_id):
+    # only one worker of the node fetches the token, the others wait for the lock and find its token in the shared cache
+    async with sharedTokenLockAsync(vault_type, key, utils.TOKEN_FETCH_WAIT_TIMEOUT):
+        # a previous flight may have stored the token after this caller checked the cache
+        stored_token = getStoredToken(vault_type, key, transaction_id)
+        if stored_token is not None:
+            return stored_token["token"], None, None
+
+        token, error, code = await fetch_token_async()
+        if error is not None:
+            return None, error, code
+
+        await runCacheCall(saveTokenInCache, vault_type, key, token, transaction_id)
+    if utils.TOKEN_REFRESH_AHEAD == 'true':
+        caches.TOKEN_REFRESHERS[(vault_type, key)] = fetch_token
+    return token["token"], None, None
+
+
+# @param {vault object} vault — the vault object
+# @param {bool} is_bulk — true if this is a bulk request
+#
+# @returns {dict} cached extracted secret of the vault object, None if the cache is disabled or has no entry
+async def getCachedVaultSecretAsync(vault, is_bulk=False):
+    if getSecretCacheTTL(vault.vault_type) <= 0:
+        return None
+    return await runCacheCall(getCachedVaultSecret, vault, is_bulk)
+
+
+# @param {vault object} vault — the vault object
+# @param {dict} extracted_secret — extracted secret of the vault object
+async def saveVaultSecretInCacheAsync(vault, extracted_secret):
+    if getSecretCacheTTL(vault.vault_type) > 0:
+        await runCacheCall(saveVaultSecretInCache, vault, extracted_secret)
+
+
+# @param {vault object} vault — the vault object
+# @param {bool} is_bulk — true if this is a bulk request
+#
+# @returns {dict} extracted_secret - secret in python dict format
+# @returns {string} error message if any
+# @returns {number} status code
+#
+# processRequestGetSecretWithCache() for the async server
+async def processRequestGetSecretWithCacheAsync(vault, is_bulk=False):
+    cached_secret = await getCachedVaultSecretAsync(vault, is_bulk)
+    if cached_secret is not None:
+        return cached_secret, None, None
+
+    extracted_secret, error, code = await vault.processRequestGetSecretAsync(is_bulk)
+    if error is not None:
+        return None, error, code
+
+    await saveVaultSecretInCacheAsync(vault, extracted_secret)
+    return extracted_secret, None, None
+
+
+# @param {array} vaults — vault objects of the bulk request, their auth header extracted
+#
+# @returns {string} error message if any
+# @returns {number} status code
+#
+# the auth context is prepared once by the first item and shared by the others, as buildBulkVaults() does for the Flask routes
+async def prepareBulkAuthContextAsync(vaults):
+    if len(vaults) == 0:
+        return None, None
+
+    error, code = await vaults[0].prepareAuthContextAsync()
+    if error is not None:
+        return error, code
+
+    for vault in vaults[1:]:
+        shareAuthContext(vaults[0], vault)
+    return None, None
+
+
+# @param {array} vaults — vault objects of the bulk request reading distinct secrets
+#
+# @returns {array} (secret, error, code) of each vault object, in the same order
+async def fetchBulkSecretsAsync(vaults):
+    if len(vaults) == 1:
+        return [await vaults[0].fetchSecretAsync()]
+    return await vaults[0].fetchSecretBatchAsync(vaults)
+
+
+# @param {array} batch — groups of (index, vault) items of the bulk request, each group requesting one vault secret
+# @param {RequestTimer} timer — timer of the bulk request
+#
+# @returns {array} index and extracted secret or error payload of each item of the batch
+#
+# bulkThreadFunction() for the async server, the batches of a request run as tasks of the event loop
+async def bulkTaskFunction(batch, timer):
+    # the task records its stages in an activation of its own, the other batches run at the same time
+    with activateRequestTimer(timer):
+        leader = batch[0][0][1]
+        logDebug(leader, "bulkTaskFunction()", FILE_NAME, "Task of %d secret(s) starting with vault %s is running", len(batch), leader.secret_urn)
+
+        results = {}
+        try:
+            uncached_groups = await runCacheCall(readCachedBulkItems, batch, results)
+
+            fetched_secrets = []
+            if len(uncached_groups) > 0:
+                with timeStage("fetch_secret"):
+                    fetched_secrets = await fetchBulkSecretsAsync([uncached[0][1] for uncached in uncached_groups])
+
+            await runCacheCall(extractBulkItems, uncached_groups, fetched_secrets, results)
+        except Exception as err:
+            logException(leader, "bulkTaskFunction()", FILE_NAME, str(err))
+
+        logDebug(leader, "bulkTaskFunction()", FILE_NAME, "Task of %d secret(s) starting with vault %s is finished", len(batch), leader.secret_urn)
+        return collectBulkBatchResults(batch, results)
+
+
+# @param {array} vaults — vault objects of the bulk request
+#
+# @yields {int, dict} index and result of each item in completion order
+#
+# at most BULK_MAX_CONCURRENCY_PER_REQUEST batches of the request are read at once, so a single large bulk request
+# cannot flood the vault with requests
+async def iterateBulkResultsAsync(vaults):
+    timer = getRequestTimer()
+    batches = batchBulkVaults(vaults)
+    pending = set()
+    next_batch = 0
+
+    try:
+        while next_batch < len(batches) or pending:
+            while next_batch < len(batches) and len(pending) < utils.BULK_MAX_CONCURRENCY_PER_REQUEST:
+                pending.add(asyncio.ensure_future(bulkTaskFunction(batches[next_batch], timer)))
+                next_batch = next_batch + 1
+
+            with timeStage("bulk_wait"):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for index, result in task.result():
+                    yield index, result
+    finally:
+        # a streamed response closed by the client stops the batches still running
+        for task in pending:
+            task.cancel()
+
+
+# @param {array} vaults — vault objects of the bulk request
+#
+# @returns {array} results of the items in the same order as the request
+async def runBulkRequestAsync(vaults):
+    response_data = [None] * len(vaults)
+    async for index, result in iterateBulkResultsAsync(vaults):
+        response_data[index] = result
+    return response_data
+
+
+# @param {array} vaults — vault objects of the bulk request
+# @param {string} transaction_id — transaction id of the bulk request
+#
+# @yields {string} json line of the result of each item in completion order, followed by a summary line
+async def streamBulkResultsAsync(vaults, transaction_id):
+    succeeded = 0
+    results = iterateBulkResultsAsync(vaults)
+    try:
+        async for _, result in results:
+            if "errors" not in result:
+                succeeded = succeeded + 1
+            yield json.dumps(result) + "\n"
+    finally:
+        await results.aclose()
+
+    summary = {"total": len(vaults), "succeeded": succeeded, "failed": len(vaults) - succeeded, "trace": transaction_id}
+    logFrameworkDebug(transaction_id, "streamBulkResultsAsync()", FILE_NAME, "Streamed %d results of the bulk request %s", len(vaults), transaction_id)
+    yield json.dumps({"summary": summary}) + "\n"
@@ -0,0 +1,417 @@
+import hashlib
+import hmac
+import json
+import logging
+import math
+import os
+import socket
+import ssl
+import threading
+import time
+from abc import ABC, abstractmethod
+from urllib.parse import urlsplit, unquote
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from vault_sdk.framework.circuit_breaker import getCircuitBreaker
+
+# cache shared by the replicas of the vault bridge, behind the token and secret caches of each worker:
+# memory | redis | memcached, unset to keep the token and secret caches local to the workers
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', '')
+# redis://[[user]:password@]host:6379[/db], rediss:// for TLS, or memcached://host:11211
+CACHE_BACKEND_URL = os.environ.get('CACHE_BACKEND_URL', '')
+# Fernet key every cached value is encrypted with, required by every backend, for example the output of
+# python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
+CACHE_ENCRYPTION_KEY = os.environ.get('CACHE_ENCRYPTION_KEY', '')
+# seconds to wait for the cache server, a slow cache is treated as a miss
+CACHE_BACKEND_TIMEOUT = float(os.environ.get('CACHE_BACKEND_TIMEOUT', 0.2))
+# maximum number of idle connections to the cache server kept per process
+CACHE_BACKEND_POOL_SIZE = int(os.environ.get('CACHE_BACKEND_POOL_SIZE', 8))
+# prefix of the cache keys, so several deployments can share one cache server
+CACHE_BACKEND_KEY_PREFIX = os.environ.get('CACHE_BACKEND_KEY_PREFIX', 'vault-bridge')
+
+# memcached reads an expiration time longer than 30 days as a unix timestamp
+MEMCACHED_MAX_RELATIVE_EXPIRATION = 30 * 24 * 3600
+# number of entries of the memory backend above which expired entries are purged on write
+MEMORY_CACHE_PURGE_SIZE = 4096
+
+LOGGER = logging.getLogger("vaults")
+
+
+# raised when the cache server returns an error or an unexpected reply
+class CacheBackendError(Exception):
+    pass
+
+
+# interface of the cache backends, keys are strings and values are encrypted bytes
+class CacheBackend(ABC):
+
+    # @param {string} key — cache key
+    #
+    # @returns {bytes} cached value, None if not found or expired
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    # @param {string} key — cache key
+    # @param {bytes} value — value to cache
+    # @param {float} ttl — seconds the value can be served from the cache
+    @abstractmethod
+    def set(self, key, value, ttl):
+        pass
+
+    # @param {string} key — cache key
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+    # drop the connections inherited from the parent process after a fork
+    def reset(self):
+        pass
+
+
+# backend keeping the values in the current process, mostly useful to try the encrypted cache locally
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self):
+        # key to (value, monotonic expiration)
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                self.entries.pop(key, None)
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.entries) >= MEMORY_CACHE_PURGE_SIZE:
+                for expired_key in [k for k, entry in self.entries.items() if entry[1] <= now]:
+                    self.entries.pop(expired_key, None)
+            self.entries[key] = (value, now + ttl)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def reset(self):
+        self.lock = threading.Lock()
+
+
+# connection to a cache server with a buffered reader for line based replies
+class CacheConnection(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+
+    # @param {bytes} data — bytes to send
+    def send(self, data):
+        self.sock.sendall(data)
+
+    # @returns {bytes} next line of the reply without the trailing CRLF
+    def readLine(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise CacheBackendError("connection closed by the cache server")
+        return line[:-2]
+
+    # @param {int} size — number of bytes to read
+    #
+    # @returns {bytes} the next size bytes of the reply
+    def readExactly(self, size):
+        data = self.reader.read(size)
+        if len(data) != size:
+            raise CacheBackendError("connection closed by the cache server")
+        return data
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except Exception:
+            pass
+
+
+# base of the backends talking to a cache server over TCP, with a pool of idle connections
+class SocketCacheBackend(CacheBackend):
+    def __init__(self, host, port, use_tls):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.idle_connections = []
+        self.lock = threading.Lock()
+
+    # @returns {CacheConnection} new connection to the cache server
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=CACHE_BACKEND_TIMEOUT)
+        if self.use_tls:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        connection = CacheConnection(sock)
+        try:
+            self.initConnection(connection)
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    # @param {CacheConnection} connection — new connection, for example to authenticate it
+    def initConnection(self, connection):
+        pass
+
+    # @param {function} command — function sending a command on a connection and returning its reply
+    #
+    # @returns {any} reply of the command
+    #
+    # the cache server shares the circuit breaker of the outbound hosts, so an unavailable cache is skipped quickly
+    def execute(self, command):
+        breaker = getCircuitBreaker(f"{self.host}:{self.port}")
+        if breaker is not None:
+            breaker.beforeRequest()
+
+        failed = True
+        try:
+            with self.lock:
+                connection = self.idle_connections.pop() if self.idle_connections else None
+            if connection is None:
+                connection = self.connect()
+
+            try:
+                result = command(connection)
+            except Exception:
+                # the state of the connection is unknown after an error, so it is not reused
+                connection.close()
+                raise
+
+            with self.lock:
+                if len(self.idle_connections) < CACHE_BACKEND_POOL_SIZE:
+                    self.idle_connections.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+            failed = False
+            return result
+        finally:
+            if breaker is not None:
+                breaker.recordResult(failed)
+
+    def reset(self):
+        # the sockets are shared with the parent process, closing them in the child only drops its copies
+        for connection in self.idle_connections:
+            connection.close()
+        self.idle_connections = []
+        self.lock = threading.Lock()
+
+
+# @param {tuple} args — command name and arguments
+#
+# @returns {bytes} command encoded in the redis serialization protocol
+def encodeRespCommand(args):
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+# @param {CacheConnection} connection — connection to the redis server
+#
+# @returns {any} reply of the redis server
+def readRespReply(connection):
+    line = connection.readLine()
+    prefix, payload = line[:1], line[1:]
+    if prefix == b"+":
+        return payload
+    if prefix == b"-":
+        raise CacheBackendError(payload.decode("utf-8", "replace"))
+    if prefix == b":":
+        return int(payload)
+    if prefix == b"$":
+        size = int(payload)
+        if size < 0:
+            return None
+        return connection.readExactly(size + 2)[:-2]
+    if prefix == b"*":
+        size = int(payload)
+        if size < 0:
+            return None
+        return [readRespReply(connection) for _ in range(size)]
+    raise CacheBackendError(f"unexpected reply from the redis server: {line[:32]!r}")
+
+
+# backend talking to a redis compatible server
+class RedisCacheBackend(SocketCacheBackend):
+    def __init__(self, host, port, use_tls, username, password, db):
+        super().__init__(host, port, use_tls)
+        self.username = username
+        self.password = password
+        self.db = db
+
+    def initConnection(self, connection):
+        if self.password:
+            args = (b"AUTH", self.username, self.password) if self.username else (b"AUTH", self.password)
+            self.command(connection, *args)
+        if self.db:
+            self.command(connection, b"SELECT", str(self.db))
+
+    # @param {CacheConnection} connection — connection to the redis server
+    # @param {tuple} args — command name and arguments
+    #
+    # @returns {any} reply of the redis server
+    def command(self, connection, *args):
+        connection.send(encodeRespCommand(args))
+        return readRespReply(connection)
+
+    def get(self, key):
+        return self.execute(lambda connection: self.command(connection, b"GET", key))
+
+    def set(self, key, value, ttl):
+        ttl_ms = str(max(int(ttl * 1000), 1))
+        self.execute(lambda connection: self.command(connection, b"SET", key, value, b"PX", ttl_ms))
+
+    def delete(self, key):
+        self.execute(lambda connection: self.command(connection, b"DEL", key))
+
+
+# backend talking to a memcached server with the text protocol
+class MemcachedCacheBackend(SocketCacheBackend):
+
+    def get(self, key):
+        def command(connection):
+            connection.send(b"get %s\r\n" % key.encode("utf-8"))
+            value = None
+            line = connection.readLine()
+            while line != b"END":
+                parts = line.split()
+                if len(parts) < 4 or parts[0] != b"VALUE":
+                    raise CacheBackendError(f"unexpected reply from the memcached server: {line[:32]!r}")
+                value = connection.readExactly(int(parts[3]) + 2)[:-2]
+                line = connection.readLine()
+            return value
+        return self.execute(command)
+
+    def set(self, key, value, ttl):
+        expiration = max(int(math.ceil(ttl)), 1)
+        if expiration > MEMCACHED_MAX_RELATIVE_EXPIRATION:
+            expiration = int(time.time()) + expiration
+
+        def command(connection):
+            connection.send(b"set %s 0 %d %d\r\n%s\r\n" % (key.encode("utf-8"), expiration, len(value), value))
+            reply = connection.readLine()
+            if reply != b"STORED":
+                raise CacheBackendError(f"unexpected reply from the memcached server: {reply[:32]!r}")
+        self.execute(command)
+
+    def delete(self, key):
+        def command(connection):
+            connection.send(b"delete %s\r\n" % key.encode("utf-8"))
+            reply = connection.readLine()
+            if reply not in (b"DELETED", b"NOT_FOUND"):
+                raise CacheBackendError(f"unexpected reply from the memcached server: {reply[:32]!r}")
+        self.execute(command)
+
+
+# cache encrypting every value before it reaches the backend, keys are derived with an HMAC so the cache server
+# never sees the credentials or secret names the token and secret cache keys are built from
+class EncryptedCache(object):
+    def __init__(self, backend, encryption_key):
+        self.backend = backend
+        self.fernet = Fernet(encryption_key)
+        self.key_secret = hashlib.sha256(b"vault-bridge-cache-key:" + encryption_key.encode("utf-8")).digest()
+
+    # @param {string} kind — kind of the cached value, token or secret
+    # @param {any} key — json serializable key of the value in the local cache
+    #
+    # @returns {string} key of the value in the backend
+    def getStorageKey(self, kind, key):
+        digest = hmac.new(self.key_secret, json.dumps([kind, key]).encode("utf-8"), hashlib.sha256).hexdigest()
+        return f"{CACHE_BACKEND_KEY_PREFIX}:{kind}:{digest}"
+
+    # @param {string} kind — kind of the cached value, token or secret
+    # @param {any} key — json serializable key of the value in the local cache
+    #
+    # @returns {any} cached value, None if not found, expired or not encrypted with the local key
+    def get(self, kind, key):
+        storage_key = self.getStorageKey(kind, key)
+        data = self.backend.get(storage_key)
+        if data is None:
+            return None
+        try:
+            payload = json.loads(self.fernet.decrypt(data))
+        except InvalidToken:
+            return None
+        # a value copied under another key by someone with access to the cache server is ignored
+        if payload.get("key") != storage_key:
+            return None
+        return payload["value"]
+
+    # @param {string} kind — kind of the cached value, token or secret
+    # @param {any} key — json serializable key of the value in the local cache
+    # @param {any} value — json serializable value
+    # @param {float} ttl — seconds the value can be served from the cache
+    def set(self, kind, key, value, ttl):
+        storage_key = self.getStorageKey(kind, key)
+        payload = json.dumps({"key": storage_key, "value": value}).encode("utf-8")
+        self.backend.set(storage_key, self.fernet.encrypt(payload), ttl)
+
+
+# @param {string} backend_type — memory | redis | memcached
+# @param {string} url — url of the cache server
+#
+# @returns {CacheBackend} cache backend
+def createCacheBackend(backend_type, url):
+    if backend_type == "memory":
+        return MemoryCacheBackend()
+
+    parts = urlsplit(url)
+    if parts.hostname is None:
+        raise ValueError(f"CACHE_BACKEND_URL is required by the {backend_type} cache backend")
+    if backend_type == "redis":
+        db = int(parts.path.lstrip("/") or 0)
+        username = unquote(parts.username) if parts.username else None
+        password = unquote(parts.password) if parts.password else None
+        return RedisCacheBackend(parts.hostname, parts.port or 6379, parts.scheme == "rediss", username, password, db)
+    if backend_type == "memcached":
+        return MemcachedCacheBackend(parts.hostname, parts.port or 11211, False)
+    raise ValueError(f"unsupported CACHE_BACKEND {backend_type}")
+
+
+DISTRIBUTED_CACHE = None
+DISTRIBUTED_CACHE_LOADED = False
+DISTRIBUTED_CACHE_LOCK = threading.Lock()
+
+# @returns {EncryptedCache} cache shared by the replicas, None if CACHE_BACKEND is unset or misconfigured
+def getDistributedCache():
+    global DISTRIBUTED_CACHE, DISTRIBUTED_CACHE_LOADED
+    if DISTRIBUTED_CACHE_LOADED:
+        return DISTRIBUTED_CACHE
+
+    with DISTRIBUTED_CACHE_LOCK:
+        if not DISTRIBUTED_CACHE_LOADED:
+            if CACHE_BACKEND != '':
+                try:
+                    if CACHE_ENCRYPTION_KEY == '':
+                        raise ValueError("CACHE_ENCRYPTION_KEY is required when CACHE_BACKEND is set")
+                    DISTRIBUTED_CACHE = EncryptedCache(createCacheBackend(CACHE_BACKEND, CACHE_BACKEND_URL), CACHE_ENCRYPTION_KEY)
+                except Exception as err:
+                    # the workers keep their local caches, they never send unencrypted values to the cache server
+                    LOGGER.error("distributed cache disabled: %s", err,
+                                 extra={"transaction_id": None, "secret_urn": None, "func_name": "getDistributedCache()", "file_name": "cache_backends.py"})
+            DISTRIBUTED_CACHE_LOADED = True
+    return DISTRIBUTED_CACHE
+
+
+# connections to the cache server must not be shared between a gunicorn master and its workers
+def resetDistributedCacheAfterFork():
+    global DISTRIBUTED_CACHE_LOCK
+    DISTRIBUTED_CACHE_LOCK = threading.Lock()
+    if DISTRIBUTED_CACHE is not None:
+        DISTRIBUTED_CACHE.backend.reset()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetDistributedCacheAfterFork)
@@ -1,10 +1,16 @@
-# a dict that stores cached token, for example:
+import threading
+from collections import OrderedDict
+
+# a dict that stores cached token, mirrored to SHARED_TOKEN_CACHE_DIR and to the distributed cache of
+# cache_backends.py when they are set, for example:
 #
 # CACHED_TOKEN ={
 #     "<vaults-type-1>": {
 #         "<iam-key-1>": {
 #             "token": "xxxxx",
-#             "expiration": "xxxxxx"
+#             "expiration": "xxxxxx",
+#             "fetched_at": "xxxxxx",
+#             "last_access": "xxxxxx"
 #         },
 #         "<iam-key-2>": {
 #             "token": "xxxxx",
@@ -16,4 +22,63 @@
 #         .....
 #     }
 # }
-CACHED_TOKEN ={}
\ No newline at end of file
+CACHED_TOKEN ={}
+
+# a dict that stores in-flight token fetches, so concurrent requests for the same token wait for one fetch, for example:
+#
+# TOKEN_FLIGHTS = {
+#     ("<vaults-type-1>", "<iam-key-1>"): {
+#         "event": <threading.Event>,
+#         "result": ("<token>", <error>, <code>)
+#     },
+#     .....
+# }
+TOKEN_FLIGHTS = {}
+TOKEN_FLIGHTS_LOCK = threading.Lock()
+
+# a dict that stores the in-flight token fetches of the async server, only used by its event loop thread, for example:
+#
+# ASYNC_TOKEN_FLIGHTS = {
+#     ("<vaults-type-1>", "<iam-key-1>"): <asyncio.Task returning ("<token>", <error>, <code>)>,
+#     .....
+# }
+ASYNC_TOKEN_FLIGHTS = {}
+
+# a dict that stores the functions used to renew recently used tokens in the background, for example:
+#
+# TOKEN_REFRESHERS = {
+#     ("<vaults-type-1>", "<iam-key-1>"): <fetch token function>,
+#     .....
+# }
+TOKEN_REFRESHERS = {}
+
+# an ordered dict that stores cached secret payloads in least recently used order, mirrored to the
+# distributed cache of cache_backends.py when it is set, for example:
+#
+# CACHED_SECRET = OrderedDict({
+#     ("<vault-type>", "<vault-auth-fingerprint>", "<secret-id-or-name>", "<secret-type>"): {
+#         "secret": {...},
+#         "expiration": "xxxxxx",
+#         "size": "xxxxxx"
+#     },
+#     .....
+# })
+CACHED_SECRET = OrderedDict()
+CACHED_SECRET_LOCK = threading.Lock()
+CACHED_SECRET_STATS = {"bytes": 0, "hits": 0, "misses": 0, "evictions": 0}
+
+# functions called with every secret payload evicted from CACHED_SECRET
+SECRET_EVICTION_HOOKS = []
+
+
+# an ordered dict that stores already verified JWT payloads in least recently used order, for example:
+#
+# CACHED_JWT = OrderedDict({
+#     "<sha256-of-jwt>": {
+#         "payload": {...},
+#         "expiration": "xxxxxx"
+#     },
+#     .....
+# })
+CACHED_JWT = OrderedDict()
+CACHED_JWT_LOCK = threading.Lock()
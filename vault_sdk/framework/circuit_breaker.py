@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from vault_sdk.framework import metrics
+
+# set to false to send every request to the vault and IAM hosts, even when most recent requests to the host failed
+CIRCUIT_BREAKER_ENABLED = os.environ.get('CIRCUIT_BREAKER_ENABLED', 'true')
+# seconds of request outcomes the failure rate of a host is computed on
+CIRCUIT_BREAKER_WINDOW = int(os.environ.get('CIRCUIT_BREAKER_WINDOW', 30))
+# minimum number of requests in the window before the circuit of a host can open
+CIRCUIT_BREAKER_MIN_REQUESTS = int(os.environ.get('CIRCUIT_BREAKER_MIN_REQUESTS', 20))
+# fraction of failed requests in the window that opens the circuit of a host
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.environ.get('CIRCUIT_BREAKER_FAILURE_RATE', 0.5))
+# seconds an open circuit rejects requests before it lets probe requests through
+CIRCUIT_BREAKER_COOLDOWN = int(os.environ.get('CIRCUIT_BREAKER_COOLDOWN', 30))
+# number of probe requests sent at once while the circuit is half-open
+CIRCUIT_BREAKER_HALF_OPEN_REQUESTS = int(os.environ.get('CIRCUIT_BREAKER_HALF_OPEN_REQUESTS', 1))
+# maximum number of hosts with a circuit breaker per process, the vault url is sent by the caller so the least
+# recently used breakers are dropped beyond it
+CIRCUIT_BREAKER_MAX_HOSTS = int(os.environ.get('CIRCUIT_BREAKER_MAX_HOSTS', 256))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# value of the vault_bridge_circuit_breaker_state gauge of each state
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+
+# raised instead of sending a request to a host whose circuit is open
+class CircuitOpenError(Exception):
+    def __init__(self, host):
+        super().__init__(f"circuit of {host} is open, the request was not sent")
+        self.host = host
+
+
+class CircuitBreaker(object):
+    def __init__(self, host):
+        self.host = host
+        self.state = CLOSED
+        # (monotonic time, failed) of the requests completed in the window
+        self.outcomes = deque()
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.lock = threading.Lock()
+
+
+    # @raises {CircuitOpenError} if the request must not be sent to the host
+    def beforeRequest(self):
+        with self.lock:
+            rejected = False
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < CIRCUIT_BREAKER_COOLDOWN:
+                    rejected = True
+                else:
+                    self.state = HALF_OPEN
+                    self.probes_in_flight = 0
+
+            if self.state == HALF_OPEN and not rejected:
+                if self.probes_in_flight >= CIRCUIT_BREAKER_HALF_OPEN_REQUESTS:
+                    rejected = True
+                else:
+                    self.probes_in_flight += 1
+
+        if rejected:
+            metrics.incrementCounter("vault_bridge_circuit_breaker_rejections_total", {"host": metrics.getHostLabel(self.host)})
+            raise CircuitOpenError(self.host)
+
+
+    # @param {bool} failed — true if the host failed to answer the request
+    def recordResult(self, failed):
+        now = time.monotonic()
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probes_in_flight = max(self.probes_in_flight - 1, 0)
+                if failed:
+                    self.open(now)
+                else:
+                    # the host answered the probe, start over with an empty window
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                    self.failures = 0
+                return
+
+            if self.state == OPEN:
+                return
+
+            self.outcomes.append((now, failed))
+            if failed:
+                self.failures += 1
+            while self.outcomes and now - self.outcomes[0][0] > CIRCUIT_BREAKER_WINDOW:
+                _, expired_failed = self.outcomes.popleft()
+                if expired_failed:
+                    self.failures -= 1
+
+            if len(self.outcomes) >= CIRCUIT_BREAKER_MIN_REQUESTS and self.failures / len(self.outcomes) >= CIRCUIT_BREAKER_FAILURE_RATE:
+                self.open(now)
+
+
+    # a request cancelled before the host answered frees its probe without a result, so the circuit does not wait for it
+    def abandonRequest(self):
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probes_in_flight = max(self.probes_in_flight - 1, 0)
+
+
+    # open the circuit, the caller must hold the lock
+    def open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.outcomes.clear()
+        self.failures = 0
+        metrics.incrementCounter("vault_bridge_circuit_breaker_opened_total", {"host": metrics.getHostLabel(self.host)})
+
+
+# an ordered dict that stores the circuit breaker of each outbound host in least recently used order, for example:
+#
+# CIRCUIT_BREAKERS = OrderedDict({
+#     "xxxx.us-south.secrets-manager.appdomain.cloud": <CircuitBreaker>,
+#     .....
+# })
+CIRCUIT_BREAKERS = OrderedDict()
+CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+
+# @param {string} host — outbound host
+#
+# @returns {CircuitBreaker} circuit breaker of the host, None if circuit breaking is disabled
+def getCircuitBreaker(host):
+    if CIRCUIT_BREAKER_ENABLED != 'true':
+        return None
+
+    with CIRCUIT_BREAKERS_LOCK:
+        breaker = CIRCUIT_BREAKERS.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host)
+            CIRCUIT_BREAKERS[host] = breaker
+            while len(CIRCUIT_BREAKERS) > CIRCUIT_BREAKER_MAX_HOSTS:
+                CIRCUIT_BREAKERS.popitem(last=False)
+        else:
+            CIRCUIT_BREAKERS.move_to_end(host)
+    return breaker
+
+
+# @returns {array} state of the circuit breaker of each host exported as metrics, the hosts without their own
+# host label report the worst state among them
+def collectCircuitBreakerMetrics():
+    with CIRCUIT_BREAKERS_LOCK:
+        breakers = list(CIRCUIT_BREAKERS.values())
+    states = {}
+    for breaker in breakers:
+        label = metrics.getHostLabel(breaker.host)
+        states[label] = max(states.get(label, 0), STATE_VALUES[breaker.state])
+    return [("vault_bridge_circuit_breaker_state", {"host": label}, state) for label, state in states.items()]
+
+metrics.registerCollector(collectCircuitBreakerMetrics)
+
+
+# circuit breakers and their locks must not be shared between a gunicorn master and its workers
+def resetCircuitBreakersAfterFork():
+    global CIRCUIT_BREAKERS_LOCK
+    CIRCUIT_BREAKERS_LOCK = threading.Lock()
+    CIRCUIT_BREAKERS.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetCircuitBreakersAfterFork)
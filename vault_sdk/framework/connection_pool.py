@@ -0,0 +1,164 @@
+import http.cookiejar
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+# maximum number of distinct (scheme, host, tls verify) sessions kept per process
+VAULT_CONNECTION_POOL_SIZE = int(os.environ.get('VAULT_CONNECTION_POOL_SIZE', 32))
+# maximum number of keep-alive connections kept per session
+VAULT_CONNECTION_POOL_MAXSIZE = int(os.environ.get('VAULT_CONNECTION_POOL_MAXSIZE', 10))
+# seconds a session can stay unused before it is closed and evicted
+VAULT_CONNECTION_POOL_IDLE_TIMEOUT = int(os.environ.get('VAULT_CONNECTION_POOL_IDLE_TIMEOUT', 300))
+# maximum number of connections open at once by the async client of the ASGI server, to all hosts together,
+# further requests wait for a free connection within their timeout
+VAULT_ASYNC_MAX_CONNECTIONS = int(os.environ.get('VAULT_ASYNC_MAX_CONNECTIONS', 1000))
+
+
+# a dict that stores pooled sessions in least recently used order, for example:
+#
+# SESSIONS = {
+#     ("https", "iam.cloud.ibm.com", True): {
+#         "session": <requests.Session>,
+#         "last_used": 1700000000.0
+#     },
+#     .....
+# }
+SESSIONS = OrderedDict()
+SESSIONS_LOCK = threading.Lock()
+
+POOL_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+# @param {string} url - request url
+# @param {bool} verify - whether TLS certificates are verified
+#
+# @returns {tuple} pool key of the url
+def getPoolKey(url, verify):
+    parts = urlsplit(url)
+    return (parts.scheme.lower(), parts.netloc.lower(), verify)
+
+
+# @returns {requests.Session} new session with a keep-alive adapter for http and https
+#
+# a session is shared by the requests of every caller to the same host, so it stores no cookie
+def createSession():
+    session = requests.Session()
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=VAULT_CONNECTION_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# close and forget a pooled session, the caller must hold SESSIONS_LOCK
+def evictSession(key):
+    entry = SESSIONS.pop(key, None)
+    if entry is None:
+        return
+    POOL_STATS["evictions"] += 1
+    try:
+        entry["session"].close()
+    except Exception:
+        pass
+
+
+# evict sessions that have been idle for too long, the caller must hold SESSIONS_LOCK
+def evictIdleSessions(now):
+    for key in list(SESSIONS.keys()):
+        # sessions are kept in least recently used order, so stop at the first active one
+        if now - SESSIONS[key]["last_used"] < VAULT_CONNECTION_POOL_IDLE_TIMEOUT:
+            break
+        evictSession(key)
+
+
+# @param {string} url - request url
+# @param {bool} verify - whether TLS certificates are verified
+#
+# @returns {requests.Session} pooled session for the scheme and host of the url
+def getSession(url, verify):
+    key = getPoolKey(url, verify)
+    now = time.monotonic()
+
+    with SESSIONS_LOCK:
+        evictIdleSessions(now)
+
+        entry = SESSIONS.get(key)
+        if entry is not None:
+            POOL_STATS["hits"] += 1
+            entry["last_used"] = now
+            SESSIONS.move_to_end(key)
+            return entry["session"]
+
+        POOL_STATS["misses"] += 1
+        SESSIONS[key] = {"session": createSession(), "last_used": now}
+        while len(SESSIONS) > VAULT_CONNECTION_POOL_SIZE:
+            evictSession(next(iter(SESSIONS)))
+
+        return SESSIONS[key]["session"]
+
+
+# @returns {dict} pool hit, miss and eviction counters and the current number of sessions
+def getPoolStats():
+    with SESSIONS_LOCK:
+        stats = dict(POOL_STATS)
+        stats["sessions"] = len(SESSIONS)
+    return stats
+
+
+# a dict that stores the async client of each tls verify setting and the event loop it belongs to, for example:
+#
+# ASYNC_CLIENTS = {
+#     True: {
+#         "client": <aiohttp.ClientSession>,
+#         "loop": <asyncio event loop>
+#     },
+#     .....
+# }
+ASYNC_CLIENTS = {}
+
+
+# @param {bool} verify - whether TLS certificates are verified
+#
+# @returns {aiohttp.ClientSession} new client keeping connections alive to every host, it stores no cookie,
+#                                   created on the running event loop
+def createAsyncClient(verify):
+    connector = aiohttp.TCPConnector(limit=VAULT_ASYNC_MAX_CONNECTIONS, limit_per_host=0, ssl=None if verify else False,
+                                     keepalive_timeout=VAULT_CONNECTION_POOL_IDLE_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+
+
+# @param {bool} verify - whether TLS certificates are verified
+# @param {asyncio loop} loop - running event loop
+#
+# @returns {aiohttp.ClientSession} client shared by the requests of the event loop, its connections cannot be used by another loop
+def getAsyncClient(verify, loop):
+    entry = ASYNC_CLIENTS.get(verify)
+    if entry is None or entry["loop"] is not loop:
+        entry = {"client": createAsyncClient(verify), "loop": loop}
+        ASYNC_CLIENTS[verify] = entry
+    return entry["client"]
+
+
+# close the async clients of the event loop, called when the ASGI server shuts down
+async def closeAsyncClients(loop):
+    for verify, entry in list(ASYNC_CLIENTS.items()):
+        if entry["loop"] is loop:
+            ASYNC_CLIENTS.pop(verify, None)
+            await entry["client"].close()
+
+
+# sockets must not be shared between a gunicorn master and its workers, so a forked child starts with an empty pool
+def resetPoolAfterFork():
+    global SESSIONS_LOCK
+    SESSIONS_LOCK = threading.Lock()
+    SESSIONS.clear()
+    ASYNC_CLIENTS.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetPoolAfterFork)
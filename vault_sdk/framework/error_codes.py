@@ -44,12 +44,40 @@ COMPONENT_EXCEPTIONS = {
         "reason" : "Query parameter secret_reference_metadata is missing or empty from the request",
         "action" : "Specify secret metadata in the query parameter secret_reference_metadata"
     },
+    "vaultbridgesdk_e_10504" : {
+        "code" : "vaultbridgesdk_e_10504",
+        "http_status_code" : 400,
+        "message" : "Request body of the bulk request is invalid, send a json array of secret references, optionally gzip encoded.",
+        "reason" : "Request body is not a valid json array, or its Content-Encoding is neither gzip nor identity.",
+        "action" : "Send the secret references as a json array in the request body, with Content-Encoding gzip or without Content-Encoding."
+    },
+    "vaultbridgesdk_e_10505" : {
+        "code" : "vaultbridgesdk_e_10505",
+        "http_status_code" : 413,
+        "message" : "Request body of the bulk request is too large, split the secret references into several bulk requests.",
+        "reason" : "Decompressed request body exceeds BULK_MAX_BODY_BYTES or has more than BULK_MAX_REFERENCES secret references.",
+        "action" : "Split the secret references into several bulk requests, or raise the BULK_MAX_BODY_BYTES and BULK_MAX_REFERENCES settings."
+    },
     "vaultbridgesdk_e_10900" : {
         "code" : "vaultbridgesdk_e_10900",
         "http_status_code" : 500,
         "message" : "Encountered internal exception while processing request, check vault bridge log for further details.",
         "reason" : "Encountered internal exception while processing request",
         "action" : "Check the vault bridge logs for the further error details."
-    }  
+    },
+    "vaultbridgesdk_e_10901" : {
+        "code" : "vaultbridgesdk_e_10901",
+        "http_status_code" : 500,
+        "message" : "Timed out waiting for the vault access token requested by a concurrent request, retry the request.",
+        "reason" : "The concurrent request fetching the vault access token did not complete within the configured wait time.",
+        "action" : "Retry the request. If the error persists, check the availability of the vault IAM endpoint and the TOKEN_FETCH_WAIT_TIMEOUT setting."
+    },
+    "vaultbridgesdk_e_10902" : {
+        "code" : "vaultbridgesdk_e_10902",
+        "http_status_code" : 503,
+        "message" : "The vault or its IAM endpoint is unavailable, the request was not sent. Retry the request later.",
+        "reason" : "Most recent requests to the vault or IAM host failed, so the circuit breaker of the host rejects requests until its cooldown has passed.",
+        "action" : "Check the availability of the vault and its IAM endpoint, then retry the request after the CIRCUIT_BREAKER_COOLDOWN setting."
+    }
 
 }
\ No newline at end of file
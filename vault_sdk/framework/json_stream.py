@@ -0,0 +1,260 @@
+import json
+import os
+import re
+import zlib
+
+# maximum size in bytes of the request body of a bulk POST request after decompression
+BULK_MAX_BODY_BYTES = int(os.environ.get('BULK_MAX_BODY_BYTES', 16 * 1024 * 1024))
+# maximum number of secret references in the request body of a bulk POST request
+BULK_MAX_REFERENCES = int(os.environ.get('BULK_MAX_REFERENCES', 10000))
+
+BODY_READ_SIZE = 64 * 1024
+
+JSON_DECODER = json.JSONDecoder()
+WHITESPACE = " \t\n\r"
+
+# characters changing the nesting of an element outside of its strings, inside of its strings and ending a number or literal
+STRUCTURE_CHARACTERS = re.compile(r'["\[\]{}]')
+STRING_CHARACTERS = re.compile(r'["\\]')
+SCALAR_END_CHARACTERS = re.compile(r'[\s,\]]')
+
+
+# raised when the request body exceeds BULK_MAX_BODY_BYTES or BULK_MAX_REFERENCES
+class RequestBodyTooLargeError(ValueError):
+    pass
+
+
+# raised when the request body cannot be decompressed, decoded or parsed as a json array
+class MalformedRequestBodyError(ValueError):
+    pass
+
+
+# @param {stream} stream — request body stream with a read(size) method
+# @param {string} content_encoding — value of the Content-Encoding header
+#
+# @yields {string} decoded text chunks of the request body
+#
+# gzip request bodies are decompressed as they are read, so the compressed body is never held in memory
+def iterateRequestBody(stream, content_encoding):
+    content_encoding = (content_encoding or "identity").strip().lower()
+    if content_encoding not in ("identity", "gzip"):
+        raise ValueError(f"unsupported Content-Encoding {content_encoding}")
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if content_encoding == "gzip" else None
+    total_bytes = 0
+    pending = b""
+
+    while True:
+        chunk = stream.read(BODY_READ_SIZE)
+        if not chunk:
+            break
+        if decompressor is not None:
+            # bound the output of every step, so a small compressed body cannot expand without limit
+            chunk = decompressor.decompress(chunk, BULK_MAX_BODY_BYTES - total_bytes + 1)
+            if decompressor.unconsumed_tail:
+                raise RequestBodyTooLargeError(f"request body exceeds {BULK_MAX_BODY_BYTES} bytes")
+        total_bytes += len(chunk)
+        if total_bytes > BULK_MAX_BODY_BYTES:
+            raise RequestBodyTooLargeError(f"request body exceeds {BULK_MAX_BODY_BYTES} bytes")
+
+        # a utf-8 character can be split between two chunks
+        pending += chunk
+        text, pending = decodeUtf8Prefix(pending)
+        if text:
+            yield text
+
+    if decompressor is not None:
+        pending += decompressor.flush()
+        if not decompressor.eof:
+            raise ValueError("gzip request body is truncated")
+    if pending:
+        yield pending.decode("utf-8")
+
+
+# @param {bytes} data — utf-8 bytes, possibly ending with an incomplete character
+#
+# @returns {string} text of the complete characters
+# @returns {bytes} bytes of the incomplete character at the end
+def decodeUtf8Prefix(data):
+    for cut in range(len(data), max(len(data) - 4, -1), -1):
+        try:
+            return data[:cut].decode("utf-8"), data[cut:]
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8"), b""
+
+
+# finds the end of a json element read in several chunks, every chunk is scanned once and the element is decoded
+# only once it is complete, so a large element is not parsed again with every chunk
+class JsonElementScanner(object):
+    def __init__(self, first_character):
+        self.scalar = first_character not in '"[{'
+        self.depth = 0
+        self.in_string = False
+        # the previous chunk ended with a backslash in a string
+        self.escaped = False
+
+
+    # @param {string} text — text of the element
+    # @param {int} position — index of the first character of text not scanned yet
+    #
+    # @returns {int} index in text after the end of the element, None if the element continues after text
+    def scan(self, text, position=0):
+        if self.scalar:
+            match = SCALAR_END_CHARACTERS.search(text, position)
+            return match.start() if match is not None else None
+
+        if self.escaped and position < len(text):
+            self.escaped = False
+            position += 1
+
+        while True:
+            if self.in_string:
+                match = STRING_CHARACTERS.search(text, position)
+                if match is None:
+                    return None
+                if match.group() == "\\":
+                    if match.end() >= len(text):
+                        self.escaped = True
+                        return None
+                    position = match.end() + 1
+                    continue
+                self.in_string = False
+                position = match.end()
+                if self.depth == 0:
+                    return position
+                continue
+
+            match = STRUCTURE_CHARACTERS.search(text, position)
+            if match is None:
+                return None
+            position = match.end()
+            character = match.group()
+            if character == '"':
+                self.in_string = True
+            elif character in "[{":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth <= 0:
+                    return position
+
+
+# @param {string} text — text of exactly one json element
+#
+# @returns {any} the element, ValueError is raised if the text is not one json element
+def decodeJsonElement(text):
+    element, end = JSON_DECODER.raw_decode(text)
+    if end != len(text):
+        raise ValueError(f"unexpected data after a json element at position {end}")
+    return element
+
+
+# @param {generator} chunks — text chunks of a json array
+#
+# @yields {any} every element of the array as soon as it has been read
+#
+# only the element being parsed is kept in memory, ValueError is raised if the text is not a json array or
+# anything other than whitespace follows it
+def iterateJsonArray(chunks):
+    buffer = ""
+    position = 0
+    started = False
+    ended = False
+    expect_element = True
+    count = 0
+    # scanner and text read so far of an element continuing in the next chunks, None between elements
+    scanner = None
+    element_parts = None
+
+    for chunk in chunks:
+        if scanner is not None:
+            end = scanner.scan(chunk)
+            if end is None:
+                element_parts.append(chunk)
+                continue
+            element_parts.append(chunk[:end])
+            element = decodeJsonElement("".join(element_parts))
+            scanner, element_parts = None, None
+            count += 1
+            if count > BULK_MAX_REFERENCES:
+                raise RequestBodyTooLargeError(f"request body has more than {BULK_MAX_REFERENCES} elements")
+            expect_element = False
+            yield element
+            buffer, position = chunk[end:], 0
+        else:
+            buffer = buffer[position:] + chunk
+            position = 0
+
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position >= len(buffer):
+                break
+
+            if ended:
+                raise ValueError(f"unexpected data after the end of the json array at position {position}")
+
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("request body is not a json array")
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == "]":
+                if expect_element and count > 0:
+                    raise ValueError("trailing comma in json array")
+                ended = True
+                position += 1
+                continue
+
+            if not expect_element:
+                if buffer[position] != ",":
+                    raise ValueError(f"expected ',' at position {position}")
+                expect_element = True
+                position += 1
+                continue
+
+            try:
+                element, end = JSON_DECODER.raw_decode(buffer, position)
+                # a number or literal is complete once a delimiter follows it, e.g. the -3 of -3e2 may continue in the next chunk
+                complete = isinstance(element, (dict, list, str)) or (end < len(buffer) and buffer[end] in WHITESPACE + ",]")
+            except json.JSONDecodeError:
+                complete = False
+            if not complete:
+                # the element continues in the next chunks, or is malformed, which decodeJsonElement reports once it ends
+                scanner = JsonElementScanner(buffer[position])
+                end = scanner.scan(buffer, position)
+                if end is None:
+                    element_parts = [buffer[position:]]
+                    buffer, position = "", 0
+                    break
+                element = decodeJsonElement(buffer[position:end])
+                scanner = None
+
+            count += 1
+            if count > BULK_MAX_REFERENCES:
+                raise RequestBodyTooLargeError(f"request body has more than {BULK_MAX_REFERENCES} elements")
+            position = end
+            expect_element = False
+            yield element
+
+    if not ended:
+        raise ValueError("request body ends before the end of the json array")
+
+
+# @param {stream} stream — request body stream with a read(size) method
+# @param {string} content_encoding — value of the Content-Encoding header
+#
+# @yields {any} every element of the json array of the request body as soon as it has been read
+#
+# failures to read the body are raised as MalformedRequestBodyError or RequestBodyTooLargeError, so the caller can
+# tell them apart from the errors of its own processing of the elements
+def iterateJsonArrayBody(stream, content_encoding):
+    try:
+        yield from iterateJsonArray(iterateRequestBody(stream, content_encoding))
+    except RequestBodyTooLargeError:
+        raise
+    except (ValueError, zlib.error) as err:
+        raise MalformedRequestBodyError(str(err)) from err
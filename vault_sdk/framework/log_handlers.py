@@ -0,0 +1,222 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# text for the '[time] - LEVEL - message' lines, json for one json object per line
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+# write the log lines from a background thread, so request threads never wait for the output, 'false' to write them inline
+LOG_ASYNC = os.environ.get('LOG_ASYNC', 'true')
+# seconds during which identical warning and error lines are counted instead of written once LOG_REPEAT_BURST of them
+# were written, a summary line reports how many were left out, 0 writes every line
+LOG_REPEAT_WINDOW = int(os.environ.get('LOG_REPEAT_WINDOW', 10))
+LOG_REPEAT_BURST = int(os.environ.get('LOG_REPEAT_BURST', 5))
+
+TEXT_FORMAT = '[%(asctime)s] - %(levelname)s - %(message)s'
+
+# seconds between two checks for windows that ended with left out lines
+REPEAT_FLUSH_INTERVAL = 1
+
+LOG_LISTENER = None
+LOG_QUEUE_HANDLER = None
+
+
+# @param {LogRecord} record — log record
+#
+# @returns {string} message prefixed with the request of the record, as written by the log functions of utils.py
+def buildLogLine(record):
+    if getattr(record, "func_name", None) is None:
+        return record.getMessage()
+
+    section = ""
+    if record.secret_urn is not None:
+        section = f"[TransactionID={record.transaction_id}]  [SecretUrn={record.secret_urn}]"
+    elif record.transaction_id is not None:
+        section = f"[TransactionID={record.transaction_id}]"
+    return f"{section} {record.file_name}:{record.func_name} - {record.getMessage()}"
+
+
+# formatter of the text lines, the request of the record is added to the message here instead of by the request thread
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def formatMessage(self, record):
+        if getattr(record, "func_name", None) is None:
+            return super().formatMessage(record)
+        return super().formatMessage(logging.makeLogRecord(dict(record.__dict__, message=buildLogLine(record))))
+
+
+# formatter of one json object per line, for example:
+#
+# {"timestamp": "2024-05-01T10:00:00.123Z", "level": "ERROR", "logger": "vaults", "message": "...",
+#  "transaction_id": "...", "secret_urn": "...", "function": "getSecret()", "file": "ibm_secrets_manager_bridge.py"}
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for attribute, key in (("transaction_id", "transaction_id"), ("secret_urn", "secret_urn"), ("func_name", "function"), ("file_name", "file"), ("repeated", "repeated")):
+            value = getattr(record, attribute, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+# counts identical warning and error lines, during a vault outage every request logs the same failure, only the
+# first LOG_REPEAT_BURST lines of each LOG_REPEAT_WINDOW are written followed by one summary line
+class RepeatedLogFilter(logging.Filter):
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+        # lines seen in the current window, for example:
+        #
+        # self.windows = {
+        #     (40, "ibm_secrets_manager_bridge.py", "getSecret()", "circuit of ... is open"): {"start": 1714557600.1, "count": 7, "record": <LogRecord>, "message": "circuit of ... is open"},
+        #     .....
+        # }
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.next_flush = 0
+
+    def filter(self, record):
+        if getattr(record, "repeated", None) is not None:
+            return True
+
+        now = time.monotonic()
+        summaries = []
+        with self.lock:
+            if now >= self.next_flush:
+                summaries = self.collectEndedWindows(now)
+                self.next_flush = now + REPEAT_FLUSH_INTERVAL
+
+            write = True
+            if record.levelno >= logging.WARNING:
+                key = self.getKey(record)
+                window = self.windows.get(key)
+                if window is None or now - window["start"] >= LOG_REPEAT_WINDOW:
+                    if window is not None and window["count"] > LOG_REPEAT_BURST:
+                        summaries.append(self.buildSummary(window))
+                    window = {"start": now, "count": 0, "record": record, "message": record.getMessage()}
+                    self.windows[key] = window
+                window["count"] = window["count"] + 1
+                write = window["count"] <= LOG_REPEAT_BURST
+
+        for summary in summaries:
+            self.handler.handle(summary)
+        return write
+
+    # @param {LogRecord} record — warning or error record
+    #
+    # @returns {tuple} key of the identical lines of the record, the transaction id of the request is left out
+    def getKey(self, record):
+        message = record.getMessage()
+        transaction_id = getattr(record, "transaction_id", None)
+        if transaction_id:
+            message = message.replace(transaction_id, "")
+        return (record.levelno, getattr(record, "file_name", record.pathname), getattr(record, "func_name", record.funcName), message)
+
+    # @param {float} now — current monotonic time
+    #
+    # @returns {array} summary records of the windows that ended with left out lines, the ended windows are removed
+    def collectEndedWindows(self, now):
+        summaries = []
+        for key, window in list(self.windows.items()):
+            if now - window["start"] >= LOG_REPEAT_WINDOW:
+                if window["count"] > LOG_REPEAT_BURST:
+                    summaries.append(self.buildSummary(window))
+                del self.windows[key]
+        return summaries
+
+    # @param {dict} window — window with left out lines
+    #
+    # @returns {LogRecord} line reporting the number of left out lines
+    def buildSummary(self, window):
+        record = window["record"]
+        repeated = window["count"] - LOG_REPEAT_BURST
+        summary = logging.makeLogRecord(dict(record.__dict__, args=None, exc_info=None, exc_text=None, created=time.time(), repeated=repeated,
+                                             msg=f"{window['message']} (repeated {repeated} more times in {LOG_REPEAT_WINDOW}s)"))
+        summary.msecs = (summary.created - int(summary.created)) * 1000
+        summary.transaction_id = None
+        summary.secret_urn = None
+        return summary
+
+
+# queue handler passing the records to the listener thread without formatting them, only their message is
+# resolved, as its arguments may change once the request thread moves on
+class LazyQueueHandler(QueueHandler):
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # the traceback holds the frames of the request thread
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# @returns {logging.Formatter} formatter of LOG_FORMAT
+def createFormatter():
+    if LOG_FORMAT == 'json':
+        return JsonFormatter()
+    return TextFormatter()
+
+
+# @param {logging.Logger} logger — logger of the vault bridge
+# @param {string} level — log level
+#
+# the lines are written to stderr by a background thread, unless LOG_ASYNC is false
+def configureLogging(logger, level):
+    global LOG_LISTENER, LOG_QUEUE_HANDLER
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(createFormatter())
+
+    handler = stream_handler
+    if LOG_ASYNC == 'true':
+        LOG_QUEUE_HANDLER = LazyQueueHandler(queue.SimpleQueue())
+        LOG_LISTENER = QueueListener(LOG_QUEUE_HANDLER.queue, stream_handler)
+        LOG_LISTENER.start()
+        handler = LOG_QUEUE_HANDLER
+    if LOG_REPEAT_WINDOW > 0:
+        handler.addFilter(RepeatedLogFilter(handler))
+
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+# write the lines still in the queue before the process exits
+def stopLogListener():
+    if LOG_LISTENER is not None and LOG_LISTENER._thread is not None:
+        LOG_LISTENER.stop()
+
+atexit.register(stopLogListener)
+
+
+# the listener thread does not survive a fork, so a forked gunicorn worker starts its own with an empty queue
+def restartLogListenerAfterFork():
+    global LOG_LISTENER
+    if LOG_LISTENER is None:
+        return
+    log_queue = queue.SimpleQueue()
+    LOG_QUEUE_HANDLER.queue = log_queue
+    LOG_LISTENER = QueueListener(log_queue, *LOG_LISTENER.handlers)
+    LOG_LISTENER.start()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=restartLogListenerAfterFork)
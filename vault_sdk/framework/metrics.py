@@ -0,0 +1,331 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+# directory shared by all gunicorn workers of a server, every worker writes its metrics to a file in it so
+# /v2/metrics reports the whole server no matter which worker serves the scrape, unset to report the current process only
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+# seconds between two writes of the metrics of a worker to METRICS_DIR
+METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+# maximum number of outbound hosts reported with their own host label per process, the vault url is sent by the
+# caller so further hosts are reported together as OTHER_HOST
+METRICS_MAX_HOSTS = int(os.environ.get('METRICS_MAX_HOSTS', 20))
+
+OTHER_HOST = "other"
+# file of the counters and histograms of the exited processes, kept so the totals of the server never decrease
+ARCHIVE_FILE_NAME = "metrics_archive.json"
+LOCK_FILE_NAME = ".metrics.lock"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# name, type and help text of every exported metric
+METRIC_DEFINITIONS = {
+    "vault_bridge_requests_total": (COUNTER, "Requests served by the vault bridge by route, vault type and status code."),
+    "vault_bridge_request_duration_seconds": (HISTOGRAM, "Latency of requests served by the vault bridge by route and vault type."),
+    "vault_bridge_outbound_request_duration_seconds": (HISTOGRAM, "Latency of each request attempt sent to a vault or IAM host."),
+    "vault_bridge_outbound_retries_total": (COUNTER, "Retries of requests sent to a vault or IAM host."),
+    "vault_bridge_token_cache_requests_total": (COUNTER, "Token cache lookups by vault type and result."),
+    "vault_bridge_errors_total": (COUNTER, "Error payloads built by the vault bridge by error code."),
+    "vault_bridge_connection_pool_requests_total": (COUNTER, "Pooled HTTP session lookups by result."),
+    "vault_bridge_secret_cache_requests_total": (COUNTER, "Secret cache lookups by result."),
+    "vault_bridge_distributed_cache_requests_total": (COUNTER, "Distributed cache lookups and failed writes by kind and result."),
+    "vault_bridge_circuit_breaker_state": (GAUGE, "State of the circuit breaker of each outbound host, 0 closed, 1 open, 2 half-open."),
+    "vault_bridge_circuit_breaker_opened_total": (COUNTER, "Times the circuit breaker of an outbound host opened."),
+    "vault_bridge_circuit_breaker_rejections_total": (COUNTER, "Requests not sent to an outbound host because its circuit was open."),
+}
+
+# metrics of the current process, for example:
+#
+# METRICS = {
+#     ("vault_bridge_requests_total", (("route", "..."), ("status", "200"), ("vault_type", "..."))): 12,
+#     ("vault_bridge_request_duration_seconds", (("route", "..."), ("vault_type", "..."))): {
+#         "buckets": [0, 3, ...],
+#         "sum": 0.42,
+#         "count": 12
+#     },
+#     .....
+# }
+METRICS = {}
+METRICS_LOCK = threading.Lock()
+
+# functions returning (name, labels, value) tuples of counters that are maintained outside of this module
+COLLECTORS = []
+
+# hosts reported with their own host label, at most METRICS_MAX_HOSTS
+HOST_LABELS = set()
+HOST_LABELS_LOCK = threading.Lock()
+
+
+# @param {dict} labels — metric labels
+#
+# @returns {tuple} hashable and sorted labels
+def labelsKey(labels):
+    return tuple(sorted((str(name), str(value)) for name, value in labels.items()))
+
+
+# @param {string} host — outbound host
+#
+# @returns {string} value of the host label of the host, OTHER_HOST once METRICS_MAX_HOSTS hosts have their own label
+def getHostLabel(host):
+    if host in HOST_LABELS:
+        return host
+    with HOST_LABELS_LOCK:
+        if len(HOST_LABELS) < METRICS_MAX_HOSTS:
+            HOST_LABELS.add(host)
+            return host
+    return OTHER_HOST
+
+
+# @param {string} name — metric name
+# @param {dict} labels — metric labels
+# @param {number} value — increment
+def incrementCounter(name, labels, value=1):
+    key = (name, labelsKey(labels))
+    with METRICS_LOCK:
+        METRICS[key] = METRICS.get(key, 0) + value
+
+
+# @param {string} name — metric name
+# @param {dict} labels — metric labels
+# @param {number} value — current value
+def setGauge(name, labels, value):
+    key = (name, labelsKey(labels))
+    with METRICS_LOCK:
+        METRICS[key] = value
+
+
+# @param {string} name — metric name
+# @param {dict} labels — metric labels
+# @param {float} value — observed value in seconds
+def observeHistogram(name, labels, value):
+    key = (name, labelsKey(labels))
+    with METRICS_LOCK:
+        histogram = METRICS.get(key)
+        if histogram is None:
+            histogram = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            METRICS[key] = histogram
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+# @param {function} collector — function returning (name, labels, value) tuples
+def registerCollector(collector):
+    COLLECTORS.append(collector)
+
+
+# @returns {dict} copy of the metrics of the current process including the collected metrics
+def snapshotMetrics():
+    with METRICS_LOCK:
+        snapshot = {key: (dict(value, buckets=list(value["buckets"])) if isinstance(value, dict) else value) for key, value in METRICS.items()}
+
+    for collector in COLLECTORS:
+        try:
+            for name, labels, value in collector():
+                snapshot[(name, labelsKey(labels))] = value
+        except Exception:
+            pass
+    return snapshot
+
+
+# @param {dict} snapshot — metrics snapshot
+#
+# @returns {list} metrics in a json serializable format
+def serializeSnapshot(snapshot):
+    return [[name, list(map(list, labels)), value] for (name, labels), value in snapshot.items()]
+
+
+# @param {list} serialized — metrics in a json serializable format
+#
+# @returns {dict} metrics snapshot
+def deserializeSnapshot(serialized):
+    return {(name, tuple(map(tuple, labels))): value for name, labels, value in serialized}
+
+
+# @returns {string} path of the metrics file of the current process
+def getMetricsFilePath():
+    return os.path.join(METRICS_DIR, f"metrics_{os.getpid()}.json")
+
+
+# write the metrics of the current process to METRICS_DIR, the file is replaced atomically
+def flushMetrics():
+    if METRICS_DIR == "":
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = getMetricsFilePath()
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(serializeSnapshot(snapshotMetrics()), f)
+    os.replace(temp_path, path)
+
+
+FLUSH_THREAD = None
+FLUSH_THREAD_LOCK = threading.Lock()
+
+# start the background thread that writes the metrics of the current process to METRICS_DIR, once per process
+def startMetricsFlushThread():
+    global FLUSH_THREAD
+    if METRICS_DIR == "" or FLUSH_THREAD is not None:
+        return
+    with FLUSH_THREAD_LOCK:
+        if FLUSH_THREAD is None:
+            FLUSH_THREAD = threading.Thread(target=metricsFlushLoop, name="metrics-flush", daemon=True)
+            FLUSH_THREAD.start()
+
+
+def metricsFlushLoop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flushMetrics()
+        except Exception:
+            pass
+
+
+# a forked gunicorn worker starts with empty metrics and its own flush thread
+def resetMetricsAfterFork():
+    global METRICS_LOCK, FLUSH_THREAD, FLUSH_THREAD_LOCK, HOST_LABELS_LOCK
+    METRICS.clear()
+    METRICS_LOCK = threading.Lock()
+    HOST_LABELS.clear()
+    HOST_LABELS_LOCK = threading.Lock()
+    FLUSH_THREAD = None
+    FLUSH_THREAD_LOCK = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetMetricsAfterFork)
+
+
+# @param {dict} merged — merged metrics
+# @param {dict} snapshot — metrics snapshot of one process
+# @param {string} pid — process id of the snapshot
+def mergeSnapshot(merged, snapshot, pid):
+    for key, value in snapshot.items():
+        name, labels = key
+        metric_type = METRIC_DEFINITIONS.get(name, (GAUGE, ""))[0]
+        if metric_type == GAUGE:
+            # gauges describe the state of one process, so they are reported per process
+            merged[(name, labels + (("pid", pid),))] = value
+        elif metric_type == HISTOGRAM:
+            histogram = merged.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+            histogram["buckets"] = [a + b for a, b in zip(histogram["buckets"], value["buckets"])]
+            histogram["sum"] += value["sum"]
+            histogram["count"] += value["count"]
+        else:
+            merged[key] = merged.get(key, 0) + value
+
+
+# @param {string} pid — process id of a metrics file
+#
+# @returns {bool} true if the process no longer exists
+def isProcessDead(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (ValueError, PermissionError):
+        return False
+    return False
+
+
+# @param {string} path — metrics file of an exited process
+#
+# the counters and histograms of the file are added to the archive file and the file is removed, so the gauges of the
+# process are no longer reported, the caller must hold the exclusive lock of METRICS_DIR
+def retireMetricsFile(path):
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE_NAME)
+    archive = {}
+    if os.path.exists(archive_path):
+        with open(archive_path) as f:
+            archive = deserializeSnapshot(json.load(f))
+    with open(path) as f:
+        snapshot = deserializeSnapshot(json.load(f))
+
+    dead = {key: value for key, value in snapshot.items() if METRIC_DEFINITIONS.get(key[0], (GAUGE, ""))[0] != GAUGE}
+    mergeSnapshot(archive, dead, "")
+    temp_path = archive_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(serializeSnapshot(archive), f)
+    os.replace(temp_path, archive_path)
+    os.remove(path)
+
+
+# @returns {dict} metrics of every process of the server
+def collectAllMetrics():
+    merged = {}
+    if METRICS_DIR == "":
+        mergeSnapshot(merged, snapshotMetrics(), str(os.getpid()))
+        return merged
+
+    flushMetrics()
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE_NAME)
+    # the workers of the server collect one at a time, so a file being retired is counted either in the archive or in its own file
+    with open(os.path.join(METRICS_DIR, LOCK_FILE_NAME), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        for path in glob.glob(os.path.join(METRICS_DIR, "metrics_*.json")):
+            if path == archive_path:
+                continue
+            pid = os.path.basename(path)[len("metrics_"):-len(".json")]
+            try:
+                if isProcessDead(pid):
+                    retireMetricsFile(path)
+                    continue
+                with open(path) as f:
+                    mergeSnapshot(merged, deserializeSnapshot(json.load(f)), pid)
+            except Exception:
+                continue
+        if os.path.exists(archive_path):
+            try:
+                with open(archive_path) as f:
+                    mergeSnapshot(merged, deserializeSnapshot(json.load(f)), "")
+            except Exception:
+                pass
+    return merged
+
+
+# @param {tuple} labels — sorted labels
+#
+# @returns {string} labels in Prometheus text format
+def formatLabels(labels):
+    if len(labels) == 0:
+        return ""
+    escaped = []
+    for name, value in labels:
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+# @returns {string} metrics of the server in Prometheus text format
+def renderMetrics():
+    merged = collectAllMetrics()
+
+    lines = []
+    for name in sorted(set(key[0] for key in merged)):
+        metric_type, help_text = METRIC_DEFINITIONS.get(name, (GAUGE, name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for (metric_name, labels), value in sorted(merged.items()):
+            if metric_name != name:
+                continue
+            if metric_type != HISTOGRAM:
+                lines.append(f"{name}{formatLabels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, value["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{formatLabels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{formatLabels(labels + (('le', '+Inf'),))} {value['count']}")
+            lines.append(f"{name}_sum{formatLabels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{formatLabels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,259 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from vault_sdk.framework.tracing import startSpan, endRequestSpan, getSpanContext, getTraceId, attachSpan, detachSpan, attachSpanContext
+
+# add a Server-Timing header with the duration of each stage to the responses, 'false' to leave it out
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'true')
+# requests taking at least this many milliseconds are logged with the duration of each stage, 0 to log none
+SLOW_REQUEST_THRESHOLD_MS = int(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 1000))
+
+LOGGER = logging.getLogger("vaults")
+
+# timer of the request served by the current thread or asyncio task and the stages it is in, a context variable
+# so the tasks of the async server sharing one thread each record their own stages
+CURRENT = contextvars.ContextVar("request_timing", default=None)
+
+
+# timer and open stages of the current thread or task, a task started by another copies its context,
+# so it records its stages in an activation of its own, see activateRequestTimer()
+class TimerActivation(object):
+    def __init__(self, timer):
+        self.timer = timer
+        # [name, seconds spent in nested stages] of each open stage, innermost last
+        self.stages = []
+        self.span_token = None
+
+
+# durations of the stages of one request, stages of a bulk request are recorded by several threads at once
+class RequestTimer(object):
+    def __init__(self, transaction_id=None, span=None):
+        self.transaction_id = transaction_id
+        self.start = time.perf_counter()
+        self.end = None
+        # time spent in each stage excluding the nested stages, for example:
+        #
+        # self.stages = {
+        #     "authenticate": {"duration": 0.0021, "count": 1, "retries": 0},
+        #     "fetch_secret": {"duration": 0.1843, "count": 12, "retries": 2},
+        #     .....
+        # }
+        self.stages = {}
+        self.lock = threading.Lock()
+        # span of the request, its context and the id of its trace, None if the request is not traced
+        self.span = span
+        self.span_context = getSpanContext(span)
+        self.trace_id = getTraceId(span)
+
+    # @param {string} stage — stage name
+    # @param {float} duration — seconds spent in the stage
+    def record(self, stage, duration):
+        with self.lock:
+            entry = self.stages.setdefault(stage, {"duration": 0.0, "count": 0, "retries": 0})
+            entry["duration"] = entry["duration"] + duration
+            entry["count"] = entry["count"] + 1
+
+    # @param {string} stage — stage name
+    def recordRetry(self, stage):
+        with self.lock:
+            entry = self.stages.setdefault(stage, {"duration": 0.0, "count": 0, "retries": 0})
+            entry["retries"] = entry["retries"] + 1
+
+    # stop the clock of the request, the end of a streamed response is later than the end of its handler
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    # @returns {float} seconds since the start of the request, until finish() if it was called
+    def getTotal(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    # @returns {dict} copy of the stages
+    def snapshot(self):
+        with self.lock:
+            return {stage: dict(entry) for stage, entry in self.stages.items()}
+
+
+# @param {string} transaction_id — transaction id of the request
+# @param {Span} span — span of the request, None if the request is not traced
+#
+# @returns {RequestTimer} timer of a new request, set as the timer of the current thread until clearRequestTimer()
+def startRequestTimer(transaction_id=None, span=None):
+    timer = RequestTimer(transaction_id, span)
+    setRequestTimer(timer)
+    CURRENT.get().span_token = attachSpan(timer.span_context)
+    return timer
+
+
+# the current thread is done with the request of startRequestTimer()
+def clearRequestTimer():
+    activation = CURRENT.get()
+    if activation is not None:
+        detachSpan(activation.span_token)
+    setRequestTimer(None)
+
+
+# @param {RequestTimer} timer — timer of the request served by the current thread, None when it is done
+def setRequestTimer(timer):
+    CURRENT.set(TimerActivation(timer) if timer is not None else None)
+
+
+# @returns {RequestTimer} timer of the request served by the current thread, None outside of a request
+def getRequestTimer():
+    activation = CURRENT.get()
+    return activation.timer if activation is not None else None
+
+
+# @param {RequestTimer} timer — timer to record the stages of the current thread in
+#
+# used by threads and asyncio tasks doing part of the work of a request, the previous timer is restored on exit,
+# the spans they start are children of the span of the request
+@contextmanager
+def activateRequestTimer(timer):
+    previous = CURRENT.get()
+    setRequestTimer(timer)
+    try:
+        with attachSpanContext(timer.span_context if timer is not None else None):
+            yield timer
+    finally:
+        CURRENT.set(previous)
+
+
+# @param {function} func — function run by another thread on behalf of the current request
+# @param {RequestTimer} timer — timer of the request, the timer of the current thread if not set
+#
+# @returns {function} the function, recording its stages in the timer of the request
+def bindRequestTimer(func, timer=None):
+    if timer is None:
+        timer = getRequestTimer()
+    if timer is None:
+        return func
+
+    def run(*args, **kwargs):
+        with activateRequestTimer(timer):
+            return func(*args, **kwargs)
+    return run
+
+
+# @param {string} name — stage name
+#
+# the time spent in nested stages is recorded in those stages only, so the stages of a thread or task add up to its wall time,
+# each stage is a span of the trace of the request as well
+@contextmanager
+def timeStage(name):
+    activation = CURRENT.get()
+    if activation is None:
+        yield
+        return
+
+    # [name, seconds spent in nested stages]
+    frame = [name, 0.0]
+    stages = activation.stages
+    stages.append(frame)
+    start = time.perf_counter()
+    try:
+        with startSpan(name):
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stages.pop()
+        if stages:
+            stages[-1][1] = stages[-1][1] + elapsed
+        activation.timer.record(name, elapsed - frame[1])
+
+
+# count a retry of an outbound request in the stage the current thread is in
+def recordStageRetry():
+    activation = CURRENT.get()
+    if activation is not None and activation.stages:
+        activation.timer.recordRetry(activation.stages[-1][0])
+
+
+# @param {RequestTimer} timer — timer of the request
+#
+# @returns {string} value of the Server-Timing header, None if the header is disabled
+#
+# exp: validate_params;dur=0.04, authenticate;dur=1.92, token;dur=0.01, fetch_secret;dur=184.31;desc="12 calls, 2 retries", total;dur=190.2
+def buildServerTimingHeader(timer):
+    if SERVER_TIMING_ENABLED != 'true':
+        return None
+
+    metrics = []
+    for stage, entry in timer.snapshot().items():
+        details = []
+        if entry["count"] > 1:
+            details.append(f"{entry['count']} calls")
+        if entry["retries"] > 0:
+            details.append(f"{entry['retries']} retries")
+        desc = f';desc="{", ".join(details)}"' if details else ""
+        metrics.append(f"{stage};dur={entry['duration'] * 1000:.2f}{desc}")
+    metrics.append(f"total;dur={timer.getTotal() * 1000:.2f}")
+    return ", ".join(metrics)
+
+
+# @param {RequestTimer} timer — timer of the finished request
+# @param {string} method — http method
+# @param {string} route — route rule of the request
+# @param {string} vault_type — vault type in the request path
+# @param {int} status_code — http status code of the response
+#
+# one log line with the duration of each stage for requests slower than SLOW_REQUEST_THRESHOLD_MS
+def logSlowRequest(timer, method, route, vault_type, status_code):
+    total_ms = timer.getTotal() * 1000
+    if SLOW_REQUEST_THRESHOLD_MS <= 0 or total_ms < SLOW_REQUEST_THRESHOLD_MS or not LOGGER.isEnabledFor(logging.WARNING):
+        return
+
+    stages = {stage: {"duration_ms": round(entry["duration"] * 1000, 2), "count": entry["count"], "retries": entry["retries"]}
+              for stage, entry in timer.snapshot().items()}
+    details = {
+        "transaction_id": timer.transaction_id,
+        "trace_id": timer.trace_id,
+        "method": method,
+        "route": route,
+        "vault_type": vault_type,
+        "status": status_code,
+        "duration_ms": round(total_ms, 2),
+        "stages": stages,
+    }
+    LOGGER.warning("slow request %s", json.dumps(details),
+                   extra={"transaction_id": timer.transaction_id, "secret_urn": None, "func_name": "logSlowRequest()", "file_name": "request_timing.py"})
+
+
+# @param {RequestTimer} timer — timer of the request
+# @param {string} method — http method
+# @param {string} route — route rule of the request
+# @param {string} vault_type — vault type in the request path
+# @param {int} status_code — http status code of the response
+#
+# stop the clock of the request, log it if it was slow and end its span
+def finishRequestTimer(timer, method, route, vault_type, status_code):
+    timer.finish()
+    logSlowRequest(timer, method, route, vault_type, status_code)
+    if timer.span is not None:
+        endRequestSpan(timer.span, status_code)
+
+
+# @param {RequestTimer} timer — timer of the request
+# @param {iterable} chunks — body chunks of a streamed response
+# @param {function} on_finish — called once the stream is exhausted or closed
+#
+# @yields {any} the chunks, produced with the timer of the request active
+def iterateWithRequestTimer(timer, chunks, on_finish):
+    iterator = iter(chunks)
+    end = object()
+    try:
+        while True:
+            with activateRequestTimer(timer):
+                chunk = next(iterator, end)
+            if chunk is end:
+                break
+            yield chunk
+    finally:
+        if hasattr(iterator, "close"):
+            iterator.close()
+        on_finish()
@@ -0,0 +1,141 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from vault_sdk.bridges_common.constants import RETRY_ERROR_CODE_LIST
+
+# every setting can be overridden per vault type, for example VAULT_REQUEST_TOTAL_TIMEOUT_AZURE_KEY_VAULT=10
+
+# maximum number of attempts of a request, including the first one
+VAULT_REQUEST_RETRY_COUNT = int(os.environ.get('VAULT_REQUEST_RETRY_COUNT', 5))
+# seconds multiplied by 2 ** attempt to get the upper bound of the random delay before a retry
+VAULT_REQUEST_RETRY_BACKOFF_FACTOR = float(os.environ.get('VAULT_REQUEST_RETRY_BACKOFF_FACTOR', 0.5))
+# maximum seconds of the random delay before a retry, a longer Retry-After sent by the vault is still honored
+VAULT_REQUEST_RETRY_MAX_DELAY = float(os.environ.get('VAULT_REQUEST_RETRY_MAX_DELAY', 8))
+# seconds to wait for the connection to the vault or IAM host
+VAULT_REQUEST_CONNECT_TIMEOUT = float(os.environ.get('VAULT_REQUEST_CONNECT_TIMEOUT', 5))
+# seconds to wait for the response once connected
+VAULT_REQUEST_TIMEOUT = float(os.environ.get('VAULT_REQUEST_TIMEOUT', 20))
+# seconds all attempts and delays of a request may take, 0 disables the budget
+VAULT_REQUEST_TOTAL_TIMEOUT = float(os.environ.get('VAULT_REQUEST_TOTAL_TIMEOUT', 30))
+
+
+class RetryPolicy(object):
+    def __init__(self, max_attempts, backoff_factor, max_delay, connect_timeout, read_timeout, total_timeout):
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.max_delay = max_delay
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.retry_status_codes = RETRY_ERROR_CODE_LIST
+
+
+    # @returns {float} monotonic time after which a request using the policy is no longer retried
+    def getDeadline(self):
+        if self.total_timeout <= 0:
+            return float("inf")
+        return time.monotonic() + self.total_timeout
+
+
+    # @param {float} deadline — deadline of the request
+    #
+    # @returns {tuple} connect and read timeouts of the next attempt, never beyond the deadline
+    def getTimeout(self, deadline):
+        remaining = max(deadline - time.monotonic(), 0.001)
+        return (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+
+
+    # @param {int} attempt — number of attempts made so far
+    # @param {python response object} response — response of the last attempt, None if it failed to connect or timed out
+    # @param {float} deadline — deadline of the request
+    #
+    # @returns {float} seconds to wait before the next attempt, None if the request must not be retried
+    def getRetryDelay(self, attempt, response, deadline):
+        if attempt >= self.max_attempts:
+            return None
+        if response is not None and response.status_code not in self.retry_status_codes:
+            return None
+
+        # full jitter spreads the retries of concurrent requests instead of retrying them in lockstep
+        delay = random.uniform(0, min(self.max_delay, self.backoff_factor * (2 ** attempt)))
+        retry_after = parseRetryAfter(response)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        # a retry that cannot start before the deadline is not worth sleeping for
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+
+# @param {python response object} response — response of the last attempt
+#
+# @returns {float} seconds requested by the Retry-After header, None if there is no valid header
+def parseRetryAfter(response):
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+# @param {string} name — name of the setting
+# @param {string} vault_type — vault type, None for the default policy
+# @param {float} default — value of the setting for all vault types
+#
+# @returns {float} value of the setting for the vault type
+def getRetryPolicySetting(name, vault_type, default):
+    if vault_type is None:
+        return default
+    env_name = name + "_" + vault_type.upper().replace("-", "_")
+    try:
+        return float(os.environ.get(env_name, default))
+    except ValueError:
+        return default
+
+
+# a dict that stores the retry policy of each vault type, for example:
+#
+# RETRY_POLICIES = {
+#     None: <RetryPolicy>,
+#     "azure-key-vault": <RetryPolicy>,
+#     .....
+# }
+RETRY_POLICIES = {}
+RETRY_POLICIES_LOCK = threading.Lock()
+
+
+# @param {string} vault_type — vault type, None for the default policy
+#
+# @returns {RetryPolicy} retry policy of the requests sent for the vault type
+def getRetryPolicy(vault_type=None):
+    policy = RETRY_POLICIES.get(vault_type)
+    if policy is not None:
+        return policy
+
+    with RETRY_POLICIES_LOCK:
+        if vault_type not in RETRY_POLICIES:
+            RETRY_POLICIES[vault_type] = RetryPolicy(
+                int(getRetryPolicySetting("VAULT_REQUEST_RETRY_COUNT", vault_type, VAULT_REQUEST_RETRY_COUNT)),
+                getRetryPolicySetting("VAULT_REQUEST_RETRY_BACKOFF_FACTOR", vault_type, VAULT_REQUEST_RETRY_BACKOFF_FACTOR),
+                getRetryPolicySetting("VAULT_REQUEST_RETRY_MAX_DELAY", vault_type, VAULT_REQUEST_RETRY_MAX_DELAY),
+                getRetryPolicySetting("VAULT_REQUEST_CONNECT_TIMEOUT", vault_type, VAULT_REQUEST_CONNECT_TIMEOUT),
+                getRetryPolicySetting("VAULT_REQUEST_TIMEOUT", vault_type, VAULT_REQUEST_TIMEOUT),
+                getRetryPolicySetting("VAULT_REQUEST_TOTAL_TIMEOUT", vault_type, VAULT_REQUEST_TOTAL_TIMEOUT),
+            )
+        return RETRY_POLICIES[vault_type]
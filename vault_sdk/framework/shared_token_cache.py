@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# node-local directory shared by all gunicorn workers of a pod, tokens fetched by one worker are stored in it and
+# read by the others, and only one worker at a time renews a given token, unset to cache tokens per worker,
+# a tmpfs such as /dev/shm/vault-bridge-tokens keeps the tokens off the disk
+SHARED_TOKEN_CACHE_DIR = os.environ.get('SHARED_TOKEN_CACHE_DIR', '')
+
+# seconds between two attempts to take the renewal lock of a token held by another worker
+SHARED_TOKEN_LOCK_POLL_INTERVAL = 0.05
+
+LOGGER = logging.getLogger("vaults")
+
+
+# @returns {bool} true if tokens are shared between the workers of the node
+def isSharedTokenCacheEnabled():
+    return SHARED_TOKEN_CACHE_DIR != '' and fcntl is not None
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+#
+# @returns {string} path of the token file without extension, the key holds credentials so only its digest is used
+def getSharedTokenPath(vault_type, key):
+    digest = hashlib.sha256(f"{vault_type}\0{key}".encode('utf-8')).hexdigest()
+    return os.path.join(SHARED_TOKEN_CACHE_DIR, digest)
+
+
+# create the cache directory readable by the current user only
+def ensureSharedTokenCacheDir():
+    os.makedirs(SHARED_TOKEN_CACHE_DIR, mode=0o700, exist_ok=True)
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+#
+# @returns {dict} token stored by any worker of the node - {"token": "xxxxx", "expiration": "xxxxxx", "fetched_at": "xxxxxx"}, None if there is none
+def readSharedToken(vault_type, key):
+    if not isSharedTokenCacheEnabled():
+        return None
+    try:
+        with open(getSharedTokenPath(vault_type, key) + ".json") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {dict} token — {"token": "xxxxx", "expiration": "xxxxxx", "fetched_at": "xxxxxx"}
+#
+# the file is replaced atomically, so readers never see a partially written token
+def writeSharedToken(vault_type, key, token):
+    if not isSharedTokenCacheEnabled():
+        return
+    ensureSharedTokenCacheDir()
+    path = getSharedTokenPath(vault_type, key) + ".json"
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"token": token["token"], "expiration": token["expiration"], "fetched_at": token["fetched_at"]}, f)
+    os.replace(temp_path, path)
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+#
+# @returns {int} descriptor of the lock file of the token, None if the cache is not shared or cannot be used
+def openSharedTokenLock(vault_type, key):
+    if not isSharedTokenCacheEnabled():
+        return None
+    try:
+        ensureSharedTokenCacheDir()
+        return os.open(getSharedTokenPath(vault_type, key) + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+    except OSError as err:
+        # the worker still fetches its own token when the shared directory cannot be used
+        LOGGER.error("%s", err, extra={"transaction_id": None, "secret_urn": None, "func_name": "openSharedTokenLock()", "file_name": "shared_token_cache.py"})
+        return None
+
+
+# @param {int} fd — descriptor of the lock file
+#
+# @returns {bool} true if the lock was taken, false if another worker holds it
+def tryLockSharedToken(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {float} timeout — seconds to wait for a renewal of the token by another worker
+#
+# @yields {bool} true if the lock was taken, false if the cache is not shared or the wait timed out
+#
+# held by the worker renewing a token, so the other workers wait for its token instead of fetching their own
+@contextmanager
+def sharedTokenLock(vault_type, key, timeout):
+    fd = openSharedTokenLock(vault_type, key)
+    if fd is None:
+        yield False
+        return
+
+    try:
+        deadline = time.monotonic() + timeout
+        locked = tryLockSharedToken(fd)
+        while not locked and time.monotonic() < deadline:
+            time.sleep(SHARED_TOKEN_LOCK_POLL_INTERVAL)
+            locked = tryLockSharedToken(fd)
+        try:
+            yield locked
+        finally:
+            if locked:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {float} timeout — seconds to wait for a renewal of the token by another worker
+#
+# @yields {bool} true if the lock was taken, false if the cache is not shared or the wait timed out
+#
+# sharedTokenLock() for the async server, the event loop keeps serving other requests while the lock is polled
+@asynccontextmanager
+async def sharedTokenLockAsync(vault_type, key, timeout):
+    fd = openSharedTokenLock(vault_type, key)
+    if fd is None:
+        yield False
+        return
+
+    try:
+        deadline = time.monotonic() + timeout
+        locked = tryLockSharedToken(fd)
+        while not locked and time.monotonic() < deadline:
+            await asyncio.sleep(SHARED_TOKEN_LOCK_POLL_INTERVAL)
+            locked = tryLockSharedToken(fd)
+        try:
+            yield locked
+        finally:
+            if locked:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
@@ -0,0 +1,168 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+
+# OpenTelemetry tracing of the routes, request stages, bulk items and outbound vault requests, exported with OTLP
+# over http to the collector of OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318), requires the
+# opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http packages, 'false' to create no span at all
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false')
+# fraction of the traces started by the vault bridge that are sampled, requests of a sampled trace of the caller
+# are always sampled and requests of a trace the caller did not sample never are
+TRACING_SAMPLE_RATIO = float(os.environ.get('TRACING_SAMPLE_RATIO', 1.0))
+TRACING_SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME', 'vault-bridge')
+
+# attribute of the spans linking them to the transaction id sent by the caller
+TRANSACTION_ID_ATTRIBUTE = "ibm_cpd.transaction_id"
+
+try:
+    from opentelemetry import context, propagate, trace
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+except ImportError:
+    trace = None
+
+LOGGER = logging.getLogger("vaults")
+
+TRACER = None
+TRACER_LOCK = threading.Lock()
+# true once the tracer of the process was created, or could not be
+TRACER_INITIALIZED = False
+
+
+# @returns {Tracer} tracer of the process, None if tracing is disabled or the OpenTelemetry packages are missing
+#
+# the provider and its export thread are created on first use, so every gunicorn worker exports its own spans
+def getTracer():
+    global TRACER, TRACER_INITIALIZED
+    if TRACER_INITIALIZED:
+        return TRACER
+    if TRACING_ENABLED != 'true':
+        TRACER_INITIALIZED = True
+        return None
+
+    with TRACER_LOCK:
+        if not TRACER_INITIALIZED:
+            if trace is None:
+                LOGGER.error("TRACING_ENABLED is true but the opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http packages are not installed, no span is exported",
+                             extra={"transaction_id": None, "secret_urn": None, "func_name": "getTracer()", "file_name": "tracing.py"})
+            else:
+                provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+                                          sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)))
+                provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+                TRACER = provider.get_tracer("vault_sdk")
+            TRACER_INITIALIZED = True
+    return TRACER
+
+
+# the export thread does not survive a fork, so a forked gunicorn worker creates its own tracer
+def resetTracerAfterFork():
+    global TRACER, TRACER_LOCK, TRACER_INITIALIZED
+    TRACER = None
+    TRACER_LOCK = threading.Lock()
+    TRACER_INITIALIZED = False
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetTracerAfterFork)
+
+
+# @param {string} name — span name, the route rule of the request
+# @param {string} method — http method
+# @param {dict} headers — request headers, the traceparent header of the caller makes the span part of its trace
+# @param {string} transaction_id — transaction id of the request
+#
+# @returns {Span} server span of the request, None if tracing is disabled
+def startRequestSpan(name, method, headers, transaction_id):
+    tracer = getTracer()
+    if tracer is None:
+        return None
+
+    parent = propagate.extract({key.lower(): value for key, value in headers.items()})
+    span = tracer.start_span(f"{method} {name}", context=parent, kind=trace.SpanKind.SERVER)
+    if span.is_recording():
+        span.set_attribute("http.request.method", method)
+        span.set_attribute("http.route", name)
+        if transaction_id is not None:
+            span.set_attribute(TRANSACTION_ID_ATTRIBUTE, transaction_id)
+    return span
+
+
+# @param {Span} span — server span of the request
+# @param {int} status_code — http status code of the response
+def endRequestSpan(span, status_code):
+    if span.is_recording():
+        span.set_attribute("http.response.status_code", status_code)
+        if status_code >= 500:
+            span.set_status(trace.StatusCode.ERROR)
+    span.end()
+
+
+# @param {Span} span — span of the request
+#
+# @returns {Context} context with the span as current span, None if there is no span
+def getSpanContext(span):
+    if span is None:
+        return None
+    return trace.set_span_in_context(span)
+
+
+# @param {Context} span_context — context returned by getSpanContext()
+#
+# spans started by the current thread inside the block are children of the span of the context
+@contextmanager
+def attachSpanContext(span_context):
+    token = attachSpan(span_context)
+    try:
+        yield
+    finally:
+        detachSpan(token)
+
+
+# @param {Context} span_context — context returned by getSpanContext()
+#
+# @returns {object} token to pass to detachSpan(), None if there is no context
+def attachSpan(span_context):
+    if span_context is None:
+        return None
+    return context.attach(span_context)
+
+
+# @param {object} token — token returned by attachSpan()
+def detachSpan(token):
+    if token is not None:
+        context.detach(token)
+
+
+# @param {string} name — span name
+# @param {dict} attributes — span attributes
+# @param {bool} client — true for a request sent to another service
+#
+# @returns {context manager} yields the span as current span, or None if tracing is disabled
+def startSpan(name, attributes=None, client=False):
+    tracer = getTracer()
+    if tracer is None:
+        return nullcontext()
+    kind = trace.SpanKind.CLIENT if client else trace.SpanKind.INTERNAL
+    return tracer.start_as_current_span(name, kind=kind, attributes=attributes)
+
+
+# @param {Span} span — span yielded by startSpan(), None if tracing is disabled
+# @param {dict} attributes — attributes to add to the span
+def setSpanAttributes(span, attributes):
+    if span is not None and span.is_recording():
+        span.set_attributes(attributes)
+
+
+# @param {Span} span — span of the request
+#
+# @returns {string} hex id of the trace of the span, None if there is no span or it is not sampled
+def getTraceId(span):
+    if span is None:
+        return None
+    span_context = span.get_span_context()
+    if not span_context.is_valid or not span_context.trace_flags.sampled:
+        return None
+    return format(span_context.trace_id, "032x")
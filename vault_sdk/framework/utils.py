@@ -1,4 +1,3 @@
-
 import requests
 from datetime import datetime, timedelta
 import cryptography.hazmat.backends
@@ -9,6 +8,10 @@ import json
 import sys
 import jwt
 import logging
+import threading
+import hashlib
+import copy
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from jwt import InvalidTokenError
 from pathlib import Path
 
@@ -20,12 +23,48 @@ sys.path.append(parent)
 from vault_sdk.framework.error_codes import COMPONENT_EXCEPTIONS as framework_error_code
 from vault_sdk.bridges_common.constants import *
 from vault_sdk.framework import caches
+from vault_sdk.framework.connection_pool import getSession, getPoolStats
+from vault_sdk.framework import metrics
+from vault_sdk.framework.retry_policy import getRetryPolicy
+from vault_sdk.framework.circuit_breaker import getCircuitBreaker
+from vault_sdk.framework.shared_token_cache import readSharedToken, writeSharedToken, sharedTokenLock
+from vault_sdk.framework.cache_backends import getDistributedCache
+from vault_sdk.framework.request_timing import timeStage, recordStageRetry, bindRequestTimer
+from vault_sdk.framework.tracing import startSpan, setSpanAttributes, TRANSACTION_ID_ATTRIBUTE
+from urllib.parse import urlsplit
 
 SKIP_TLS_VERIFY = os.environ.get('SKIP_TLS_VERIFY', 'false')
-VAULT_REQUEST_TIMEOUT = int(os.environ.get('VAULT_REQUEST_TIMEOUT', 20))
 
-VAULT_REQUEST_RETRY_COUNT = int(os.environ.get('VAULT_REQUEST_RETRY_COUNT', 5))
-VAULT_REQUEST_RETRY_BACKOFF_FACTOR = 0.5
+# maximum seconds a verified JWT is served from the cache without signature verification, 0 disables the cache
+JWT_CACHE_MAX_TTL = int(os.environ.get('JWT_CACHE_MAX_TTL', 300))
+# maximum number of verified JWTs kept per process
+JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', 1024))
+
+# seconds a request waits for a token fetched by a concurrent request
+TOKEN_FETCH_WAIT_TIMEOUT = int(os.environ.get('TOKEN_FETCH_WAIT_TIMEOUT', 30))
+
+# renew recently used tokens in the background before they expire
+TOKEN_REFRESH_AHEAD = os.environ.get('TOKEN_REFRESH_AHEAD', 'false')
+# fraction of the token lifetime after which a recently used token is renewed
+TOKEN_REFRESH_AHEAD_FRACTION = float(os.environ.get('TOKEN_REFRESH_AHEAD_FRACTION', 0.75))
+# seconds since the last use after which a token is no longer renewed and is allowed to lapse
+TOKEN_REFRESH_IDLE_TIMEOUT = int(os.environ.get('TOKEN_REFRESH_IDLE_TIMEOUT', 300))
+# seconds between two scans of the token cache by the refresh thread
+TOKEN_REFRESH_INTERVAL = int(os.environ.get('TOKEN_REFRESH_INTERVAL', 10))
+
+# seconds a secret payload is served from the cache, 0 disables the cache
+# can be overridden per vault type, for example SECRET_CACHE_TTL_AZURE_KEY_VAULT=30
+SECRET_CACHE_TTL = int(os.environ.get('SECRET_CACHE_TTL', 0))
+# upper bound of the serialized size of all cached secret payloads
+SECRET_CACHE_MAX_BYTES = int(os.environ.get('SECRET_CACHE_MAX_BYTES', 4 * 1024 * 1024))
+
+# maximum number of bulk items fetched concurrently by one process
+BULK_MAX_WORKERS = int(os.environ.get('BULK_MAX_WORKERS', 32))
+# maximum number of items of a single bulk request that are in flight at once
+BULK_MAX_CONCURRENCY_PER_REQUEST = int(os.environ.get('BULK_MAX_CONCURRENCY_PER_REQUEST', 8))
+
+# ports left out of the outbound host of a url
+DEFAULT_PORTS = {"http": 80, "https": 443}
 
 GIT_REPO_URL = os.environ.get('GIT_REPO_URL', "https://github.com/IBM/zen-secrets-vaults")
 ERROR_DOC_PATH = os.environ.get('ERROR_DOC_PATH', "/blob/main/docs/apidoc/error_codes.md")
@@ -96,6 +135,61 @@ def validateJWT(token, public_key, transaction_id):
 
 
 
+# @param {dict} payload — decoded JWT payload
+#
+# @returns {bool} true if the payload is not expired and is issued for the vault bridge
+def isJWTPayloadValid(payload):
+    exp = payload.get("exp")
+    if exp is not None and float(exp) <= time.time():
+        return False
+
+    audience = payload.get("aud")
+    if isinstance(audience, str):
+        audience = [audience]
+    return audience is not None and ZEN_VAULT_BRIDGE in audience
+
+
+# @param {string} token — bearer token
+# @param {any} public_key — public key used to verify the token
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {string} Payload
+# @returns {string} error message if any
+# @returns {number} status code
+#
+# tokens that passed validateJWT are cached by their hash until they expire, at most JWT_CACHE_MAX_TTL seconds,
+# cached tokens skip the signature verification but expiry and audience are still checked
+def validateJWTWithCache(token, public_key, transaction_id):
+    if JWT_CACHE_MAX_TTL <= 0:
+        return validateJWT(token, public_key, transaction_id)
+
+    key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    now = time.time()
+    with caches.CACHED_JWT_LOCK:
+        entry = caches.CACHED_JWT.get(key)
+        if entry is not None:
+            if entry["expiration"] > now and isJWTPayloadValid(entry["payload"]):
+                caches.CACHED_JWT.move_to_end(key)
+                return entry["payload"], None, None
+            caches.CACHED_JWT.pop(key, None)
+
+    payload, error, code = validateJWT(token, public_key, transaction_id)
+    if error is not None:
+        return None, error, code
+
+    expiration = now + JWT_CACHE_MAX_TTL
+    if payload.get("exp") is not None:
+        expiration = min(expiration, float(payload["exp"]))
+
+    with caches.CACHED_JWT_LOCK:
+        caches.CACHED_JWT[key] = {"payload": payload, "expiration": expiration}
+        caches.CACHED_JWT.move_to_end(key)
+        while len(caches.CACHED_JWT) > JWT_CACHE_SIZE:
+            caches.CACHED_JWT.popitem(last=False)
+
+    return payload, None, None
+
+
 # @param {any} HttpHeader
 #
 # @returns {string} token
@@ -110,7 +204,7 @@ def authenticate(HttpHeader):
     
     public_key = JWT_PUBLIC_KEY_VALUE
      
-    token, error, code = validateJWT(token, public_key, transaction_id)
+    token, error, code = validateJWTWithCache(token, public_key, transaction_id)
     if error is not None:
         return None, error, code
     return  token, None, None 
@@ -183,6 +277,32 @@ def validateParamsForBulkRequest(request):
         return None, None, None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10900", transaction_id), HTTP_INTERNAL_SERVER_ERROR_CODE
 
 
+# @param {flask.request} request — incoming bulk POST request, the secret references are read from its body
+#
+# @returns {string} vault auth header
+# @returns {string} transaction id
+# @returns {string} error message if any
+# @returns {number} status code
+def validateHeadersForBulkPostRequest(request):
+    try:
+        vault_auth = request.headers.get(VAULT_AUTH_HEADER, "")
+        transaction_id = request.headers.get(TRANSACTION_ID_HEADER, "No transaction ID")
+        authorization_header = request.headers.get(AUTHORIZATION_HEADER, "")
+
+        if vault_auth == "":
+            target = {"name": VAULT_AUTH_HEADER, "type": "header"}
+            return None, transaction_id, buildFrameworkExceptionPayload("vaultbridgesdk_e_10501", transaction_id, target), HTTP_BAD_REQUEST_CODE
+
+        if authorization_header == "":
+            target = {"name": AUTHORIZATION_HEADER, "type": "header"}
+            return None, transaction_id, buildFrameworkExceptionPayload("vaultbridgesdk_e_10501", transaction_id, target), HTTP_BAD_REQUEST_CODE
+
+        return vault_auth, transaction_id, None, None
+    except Exception as err: 
+        logFrameworkException(transaction_id, "validateHeadersForBulkPostRequest()", FILE_NAME, str(err))
+        return None, None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10900", transaction_id), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+
 # @param {string} vault_type — vault type
 # @param {string} key — key of vault token
 # @param {string} transaction_id — transaction id of current request
@@ -190,18 +310,33 @@ def validateParamsForBulkRequest(request):
 # @returns {string} access token
 def getCachedToken(vault_type, key, transaction_id):
     try:
-        if vault_type not in caches.CACHED_TOKEN:
-            return ""
-
-        if key not in caches.CACHED_TOKEN[vault_type]:
+        cached_token = caches.CACHED_TOKEN.get(vault_type, {}).get(key)
+        if cached_token is None or not isTokenUsable(cached_token):
+            # another worker of the node may have fetched the token already
+            shared_token = adoptSharedToken(vault_type, key, 0, transaction_id)
+            if shared_token is not None:
+                metrics.incrementCounter("vault_bridge_token_cache_requests_total", {"vault_type": vault_type, "result": "shared_hit"})
+                logFrameworkDebug(transaction_id, "getCachedToken()", FILE_NAME, "Token fetched by another worker found in the shared cache")
+                return shared_token["token"]
+
+            # or another replica
+            distributed_token = adoptDistributedToken(vault_type, key, transaction_id)
+            if distributed_token is not None:
+                metrics.incrementCounter("vault_bridge_token_cache_requests_total", {"vault_type": vault_type, "result": "distributed_hit"})
+                logFrameworkDebug(transaction_id, "getCachedToken()", FILE_NAME, "Token fetched by another replica found in the distributed cache")
+                return distributed_token["token"]
+
+        if cached_token is None:
+            metrics.incrementCounter("vault_bridge_token_cache_requests_total", {"vault_type": vault_type, "result": "miss"})
             return ""
 
-        cached_token = caches.CACHED_TOKEN[vault_type][key]
-
-        if datetime.fromtimestamp(cached_token["expiration"]) - timedelta(0,60) > datetime.now():
+        if isTokenUsable(cached_token):
+            cached_token["last_access"] = time.time()
+            metrics.incrementCounter("vault_bridge_token_cache_requests_total", {"vault_type": vault_type, "result": "hit"})
             logFrameworkDebug(transaction_id, "getCachedToken()", FILE_NAME, "Cached token found and not expired")
             return cached_token["token"]
 
+        metrics.incrementCounter("vault_bridge_token_cache_requests_total", {"vault_type": vault_type, "result": "miss"})
         logFrameworkDebug(transaction_id, "getCachedToken()", FILE_NAME, "Cached token has expired")
         return ""
     except Exception as err: 
@@ -209,6 +344,67 @@ def getCachedToken(vault_type, key, transaction_id):
         return ""
 
 
+# @param {dict} cached_token — {"token": "xxxxx", "expiration": "xxxxxx"}
+#
+# @returns {bool} true if the token does not expire within the next minute
+def isTokenUsable(cached_token):
+    return datetime.fromtimestamp(cached_token["expiration"]) - timedelta(0,60) > datetime.now()
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {float} newer_than — only adopt a token fetched after this timestamp
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {dict} token read from the shared cache and stored in the cache of the current worker, None if there is no usable token
+def adoptSharedToken(vault_type, key, newer_than, transaction_id):
+    try:
+        shared_token = readSharedToken(vault_type, key)
+        if shared_token is None or shared_token["fetched_at"] <= newer_than or not isTokenUsable(shared_token):
+            return None
+
+        shared_token["last_access"] = time.time()
+        caches.CACHED_TOKEN.setdefault(vault_type, {})[key] = shared_token
+        return shared_token
+    except Exception as err:
+        logFrameworkException(transaction_id, "adoptSharedToken()", FILE_NAME, str(err))
+        return None
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {dict} token read from the distributed cache and stored in the caches of the node, None if there is no usable token
+def adoptDistributedToken(vault_type, key, transaction_id):
+    distributed_token = getDistributedCacheValue("token", [vault_type, key], transaction_id)
+    if distributed_token is None or not isTokenUsable(distributed_token):
+        return None
+
+    distributed_token["last_access"] = time.time()
+    caches.CACHED_TOKEN.setdefault(vault_type, {})[key] = distributed_token
+    try:
+        writeSharedToken(vault_type, key, distributed_token)
+    except Exception as err:
+        logFrameworkException(transaction_id, "adoptDistributedToken()", FILE_NAME, str(err))
+    return distributed_token
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {dict} usable token of the current worker or of the shared cache, None if there is none
+#
+# checked again before a fetch, so it records no cache metric and does not query the distributed cache a second time
+def getStoredToken(vault_type, key, transaction_id):
+    cached_token = caches.CACHED_TOKEN.get(vault_type, {}).get(key)
+    if cached_token is not None and isTokenUsable(cached_token):
+        cached_token["last_access"] = time.time()
+        return cached_token
+    return adoptSharedToken(vault_type, key, 0, transaction_id)
+
+
 # @param {string} vault_type — vault type
 # @param {string} key — key of vault token
 # @param {string} transaction_id — transaction id of current request
@@ -218,14 +414,399 @@ def saveTokenInCache(vault_type, key, token, transaction_id):
     try:
         if vault_type not in caches.CACHED_TOKEN:
             caches.CACHED_TOKEN[vault_type] = {}
+        now = time.time()
+        token = dict(token, fetched_at=now, last_access=now)
         caches.CACHED_TOKEN[vault_type][key] = token
 
+        writeSharedToken(vault_type, key, token)
+        distributed_token = {"token": token["token"], "expiration": token["expiration"], "fetched_at": now}
+        saveDistributedCacheValue("token", [vault_type, key], distributed_token, token["expiration"] - now - 60, transaction_id)
         return
     except Exception as err: 
         logFrameworkException(transaction_id, "saveTokenInCache()", FILE_NAME, str(err))
         return
 
 
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {function} fetch_token — function that requests a new token from the vault IAM,
+#                                 returns {"token": "xxxxx", "expiration": "xxxxxx"}, error message if any, status code
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {any} access token
+# @returns {string} error message if any
+# @returns {number} status code
+#
+# only one caller fetches a missing or expired token for a given vault type and key,
+# concurrent callers wait up to TOKEN_FETCH_WAIT_TIMEOUT seconds and receive the same token or error
+def getOrFetchToken(vault_type, key, fetch_token, transaction_id):
+    with timeStage("token"):
+        cached_token = getCachedToken(vault_type, key, transaction_id)
+        if cached_token != "":
+            return cached_token, None, None
+
+        if TOKEN_REFRESH_AHEAD == 'true':
+            startTokenRefreshThread()
+
+        return joinTokenFlight(vault_type, key, fetch_token, transaction_id, False)
+
+
+# @param {string} vault_type — vault type
+# @param {string} key — key of vault token
+# @param {function} fetch_token — function that requests a new token from the vault IAM
+# @param {string} transaction_id — transaction id of current request
+# @param {bool} force_refresh — true to fetch a new token even if the cached token is still valid
+#
+# @returns {any} access token
+# @returns {string} error message if any
+# @returns {number} status code
+def joinTokenFlight(vault_type, key, fetch_token, transaction_id, force_refresh):
+    flight_key = (vault_type, key)
+    with caches.TOKEN_FLIGHTS_LOCK:
+        flight = caches.TOKEN_FLIGHTS.get(flight_key)
+        is_leader = flight is None
+        if is_leader:
+            flight = {"event": threading.Event(), "result": None}
+            caches.TOKEN_FLIGHTS[flight_key] = flight
+
+    if is_leader:
+        result = None
+        try:
+            result = fetchTokenForFlight(vault_type, key, fetch_token, transaction_id, force_refresh)
+        except Exception as err:
+            logFrameworkException(transaction_id, "joinTokenFlight()", FILE_NAME, str(err))
+            result = (None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10900", transaction_id), HTTP_INTERNAL_SERVER_ERROR_CODE)
+        finally:
+            flight["result"] = result
+            with caches.TOKEN_FLIGHTS_LOCK:
+                caches.TOKEN_FLIGHTS.pop(flight_key, None)
+            flight["event"].set()
+        return result
+
+    logFrameworkDebug(transaction_id, "joinTokenFlight()", FILE_NAME, "Waiting for token fetched by a concurrent request")
+    if not flight["event"].wait(TOKEN_FETCH_WAIT_TIMEOUT) or flight["result"] is None:
+        logFrameworkException(transaction_id, "joinTokenFlight()", FILE_NAME, f"Timed out after {TOKEN_FETCH_WAIT_TIMEOUT} seconds waiting for token fetched by a concurrent request")
+        return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10901", transaction_id), HTTP_INTERNAL_SERVER_ERROR_CODE
+
+    token, error, code = flight["result"]
+    if error is not None:
+        # the error was built for the request that fetched the token, report it with the trace of this request
+        error = copy.deepcopy(error)
+        error["trace"] = transaction_id
+    return token, error, code
+
+
+# @returns {any} access token
+# @returns {string} error message if any
+# @returns {number} status code
+def fetchTokenForFlight(vault_type, key, fetch_token, transaction_id, force_refresh):
+    # only one worker of the node fetches the token, the others wait for the lock and find its token in the shared cache
+    with sharedTokenLock(vault_type, key, TOKEN_FETCH_WAIT_TIMEOUT) as locked:
+        # a previous flight may have stored the token after this caller checked the cache
+        if not force_refresh:
+            stored_token = getStoredToken(vault_type, key, transaction_id)
+            if stored_token is not None:
+                return stored_token["token"], None, None
+        elif locked:
+            # another worker may have renewed the token while this one waited for the lock
+            local_token = caches.CACHED_TOKEN.get(vault_type, {}).get(key)
+            renewed_token = adoptSharedToken(vault_type, key, local_token["fetched_at"] if local_token else 0, transaction_id)
+            if renewed_token is not None:
+                return renewed_token["token"], None, None
+
+        token, error, code = fetch_token()
+        if error is not None:
+            return None, error, code
+
+        saveTokenInCache(vault_type, key, token, transaction_id)
+    if TOKEN_REFRESH_AHEAD == 'true':
+        caches.TOKEN_REFRESHERS[(vault_type, key)] = fetch_token
+    return token["token"], None, None
+
+
+TOKEN_REFRESH_THREAD = None
+TOKEN_REFRESH_THREAD_LOCK = threading.Lock()
+
+# start the background thread that renews recently used tokens, once per process
+def startTokenRefreshThread():
+    global TOKEN_REFRESH_THREAD
+    if TOKEN_REFRESH_THREAD is not None:
+        return
+    with TOKEN_REFRESH_THREAD_LOCK:
+        if TOKEN_REFRESH_THREAD is None:
+            TOKEN_REFRESH_THREAD = threading.Thread(target=tokenRefreshLoop, name="token-refresh", daemon=True)
+            TOKEN_REFRESH_THREAD.start()
+
+
+# threads do not survive a fork, so a forked gunicorn worker starts its own refresh thread
+def resetTokenRefreshThreadAfterFork():
+    global TOKEN_REFRESH_THREAD, TOKEN_REFRESH_THREAD_LOCK
+    TOKEN_REFRESH_THREAD = None
+    TOKEN_REFRESH_THREAD_LOCK = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetTokenRefreshThreadAfterFork)
+
+
+def tokenRefreshLoop():
+    while True:
+        time.sleep(TOKEN_REFRESH_INTERVAL)
+        try:
+            refreshCachedTokens(time.time())
+        except Exception as err:
+            logFrameworkException(None, "tokenRefreshLoop()", FILE_NAME, str(err))
+
+
+# @param {float} now — current timestamp
+#
+# renew tokens used within TOKEN_REFRESH_IDLE_TIMEOUT seconds once TOKEN_REFRESH_AHEAD_FRACTION of their lifetime has passed,
+# and forget idle tokens once they have expired
+def refreshCachedTokens(now):
+    for flight_key, fetch_token in list(caches.TOKEN_REFRESHERS.items()):
+        vault_type, key = flight_key
+        cached_token = caches.CACHED_TOKEN.get(vault_type, {}).get(key)
+        if cached_token is None:
+            caches.TOKEN_REFRESHERS.pop(flight_key, None)
+            continue
+
+        if now - cached_token.get("last_access", 0) > TOKEN_REFRESH_IDLE_TIMEOUT:
+            if cached_token["expiration"] <= now:
+                caches.CACHED_TOKEN[vault_type].pop(key, None)
+                caches.TOKEN_REFRESHERS.pop(flight_key, None)
+            continue
+
+        fetched_at = cached_token.get("fetched_at", now)
+        refresh_at = fetched_at + (cached_token["expiration"] - fetched_at) * TOKEN_REFRESH_AHEAD_FRACTION
+        if now < refresh_at:
+            continue
+
+        logFrameworkDebug(None, "refreshCachedTokens()", FILE_NAME, "Renewing token of vault type %s ahead of expiration", vault_type)
+        _, error, _ = joinTokenFlight(vault_type, key, fetch_token, None, True)
+        if error is not None:
+            # keep serving the current token until it expires, the next scan retries the renewal
+            logFrameworkException(None, "refreshCachedTokens()", FILE_NAME, f"Failed to renew token of vault type {vault_type} ahead of expiration")
+
+
+# @param {string} vault_type — vault type
+#
+# @returns {int} seconds a secret of the vault type can be served from the cache
+def getSecretCacheTTL(vault_type):
+    env_name = "SECRET_CACHE_TTL_" + vault_type.upper().replace("-", "_")
+    try:
+        return int(os.environ.get(env_name, SECRET_CACHE_TTL))
+    except ValueError:
+        return SECRET_CACHE_TTL
+
+
+# @param {vault object} vault — the vault object
+#
+# @returns {tuple} cache key of the secret requested by the vault object
+#
+# the Vault-Auth header is only kept as a fingerprint, so cached entries never hold the credentials
+def getSecretCacheKey(vault):
+    auth_fingerprint = hashlib.sha256(vault.auth_string.encode('utf-8')).hexdigest()
+    secret_identifier = getattr(vault, "secret_id", None) or getattr(vault, "secret_name", "")
+    return (vault.vault_type, auth_fingerprint, secret_identifier, vault.secret_type)
+
+
+# @param {function} hook — function called with every secret payload evicted from the cache
+def registerSecretEvictionHook(hook):
+    caches.SECRET_EVICTION_HOOKS.append(hook)
+
+
+# @param {any} value — evicted secret payload
+#
+# empty the containers of the evicted payload so the cache drops its references to the secret values, python strings
+# are immutable so the values themselves stay in memory until they are garbage collected, this erases nothing
+def clearSecretReferences(value):
+    if isinstance(value, dict):
+        for item in value.values():
+            clearSecretReferences(item)
+        value.clear()
+    elif isinstance(value, list):
+        for item in value:
+            clearSecretReferences(item)
+        value.clear()
+
+registerSecretEvictionHook(clearSecretReferences)
+
+
+# remove a secret from the cache, the caller must hold caches.CACHED_SECRET_LOCK
+def evictCachedSecret(key, transaction_id):
+    entry = caches.CACHED_SECRET.pop(key, None)
+    if entry is None:
+        return
+    caches.CACHED_SECRET_STATS["bytes"] -= entry["size"]
+    caches.CACHED_SECRET_STATS["evictions"] += 1
+    for hook in caches.SECRET_EVICTION_HOOKS:
+        try:
+            hook(entry["secret"])
+        except Exception as err:
+            logFrameworkException(transaction_id, "evictCachedSecret()", FILE_NAME, str(err))
+
+
+# @param {tuple} key — cache key of the secret
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {dict} copy of the cached secret, None if not found or expired
+def getCachedSecret(key, transaction_id):
+    try:
+        with caches.CACHED_SECRET_LOCK:
+            entry = caches.CACHED_SECRET.get(key)
+            if entry is None:
+                caches.CACHED_SECRET_STATS["misses"] += 1
+                return None
+
+            if entry["expiration"] <= time.monotonic():
+                evictCachedSecret(key, transaction_id)
+                caches.CACHED_SECRET_STATS["misses"] += 1
+                logFrameworkDebug(transaction_id, "getCachedSecret()", FILE_NAME, "Cached secret has expired")
+                return None
+
+            caches.CACHED_SECRET.move_to_end(key)
+            caches.CACHED_SECRET_STATS["hits"] += 1
+            secret = copy.deepcopy(entry["secret"])
+
+        logFrameworkDebug(transaction_id, "getCachedSecret()", FILE_NAME, "Cached secret found and not expired")
+        return secret
+    except Exception as err:
+        logFrameworkException(transaction_id, "getCachedSecret()", FILE_NAME, str(err))
+        return None
+
+
+# @param {tuple} key — cache key of the secret
+# @param {dict} secret — extracted secret
+# @param {int} ttl — seconds the secret can be served from the cache
+# @param {string} transaction_id — transaction id of current request
+#
+# store a copy of the secret in the cache and evict least recently used secrets beyond SECRET_CACHE_MAX_BYTES
+def saveSecretInCache(key, secret, ttl, transaction_id):
+    try:
+        secret = copy.deepcopy(secret)
+        secret.pop(SECRET_URN, None)
+        size = len(json.dumps(secret))
+        if size > SECRET_CACHE_MAX_BYTES:
+            return
+
+        with caches.CACHED_SECRET_LOCK:
+            evictCachedSecret(key, transaction_id)
+            caches.CACHED_SECRET[key] = {"secret": secret, "expiration": time.monotonic() + ttl, "size": size}
+            caches.CACHED_SECRET_STATS["bytes"] += size
+
+            while caches.CACHED_SECRET_STATS["bytes"] > SECRET_CACHE_MAX_BYTES:
+                evictCachedSecret(next(iter(caches.CACHED_SECRET)), transaction_id)
+        return
+    except Exception as err:
+        logFrameworkException(transaction_id, "saveSecretInCache()", FILE_NAME, str(err))
+        return
+
+
+# @param {vault object} vault — the vault object
+# @param {bool} is_bulk — true if this is a bulk request
+#
+# @returns {dict} extracted_secret - secret in python dict format
+# @returns {string} error message if any
+# @returns {number} status code
+#
+# serve the secret from the secret cache when it is enabled for the vault type, otherwise get it from the vault
+def processRequestGetSecretWithCache(vault, is_bulk=False):
+    cached_secret = getCachedVaultSecret(vault, is_bulk)
+    if cached_secret is not None:
+        return cached_secret, None, None
+
+    extracted_secret, error, code = vault.processRequestGetSecret(is_bulk)
+    if error is not None:
+        return None, error, code
+
+    saveVaultSecretInCache(vault, extracted_secret)
+    return extracted_secret, None, None
+
+
+# @param {vault object} vault — the vault object
+# @param {bool} is_bulk — true if this is a bulk request
+#
+# @returns {dict} cached extracted secret of the vault object, None if the cache is disabled or has no entry
+def getCachedVaultSecret(vault, is_bulk=False):
+    if getSecretCacheTTL(vault.vault_type) <= 0:
+        return None
+
+    key = getSecretCacheKey(vault)
+    with timeStage("secret_cache"):
+        cached_secret = getCachedSecret(key, vault.transaction_id)
+        if cached_secret is None:
+            cached_secret = adoptDistributedSecret(key, vault.transaction_id)
+    if cached_secret is not None and is_bulk:
+        cached_secret[SECRET_URN] = vault.secret_urn
+    return cached_secret
+
+
+# @param {vault object} vault — the vault object
+# @param {dict} extracted_secret — extracted secret of the vault object
+def saveVaultSecretInCache(vault, extracted_secret):
+    ttl = getSecretCacheTTL(vault.vault_type)
+    if ttl > 0:
+        key = getSecretCacheKey(vault)
+        with timeStage("secret_cache"):
+            saveSecretInCache(key, extracted_secret, ttl, vault.transaction_id)
+
+            secret = dict(extracted_secret)
+            secret.pop(SECRET_URN, None)
+            saveDistributedCacheValue("secret", key, {"secret": secret, "expires_at": time.time() + ttl}, ttl, vault.transaction_id)
+
+
+# @param {tuple} key — cache key of the secret
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {dict} secret read from the distributed cache and stored in the cache of the worker, None if not found or expired
+def adoptDistributedSecret(key, transaction_id):
+    entry = getDistributedCacheValue("secret", key, transaction_id)
+    if entry is None:
+        return None
+
+    # the secret is served no longer than the ttl it was first cached with
+    ttl = entry["expires_at"] - time.time()
+    if ttl <= 0:
+        return None
+    saveSecretInCache(key, entry["secret"], ttl, transaction_id)
+    return entry["secret"]
+
+
+# @param {string} kind — kind of the cached value, token or secret
+# @param {any} key — json serializable key of the value
+# @param {string} transaction_id — transaction id of current request
+#
+# @returns {any} value cached by any replica, None if not found or the distributed cache is disabled or unavailable
+def getDistributedCacheValue(kind, key, transaction_id):
+    cache = getDistributedCache()
+    if cache is None:
+        return None
+    try:
+        value = cache.get(kind, key)
+    except Exception as err:
+        metrics.incrementCounter("vault_bridge_distributed_cache_requests_total", {"kind": kind, "result": "error"})
+        logFrameworkException(transaction_id, "getDistributedCacheValue()", FILE_NAME, str(err))
+        return None
+
+    metrics.incrementCounter("vault_bridge_distributed_cache_requests_total", {"kind": kind, "result": "hit" if value is not None else "miss"})
+    return value
+
+
+# @param {string} kind — kind of the cached value, token or secret
+# @param {any} key — json serializable key of the value
+# @param {any} value — json serializable value
+# @param {float} ttl — seconds the value can be served from the cache
+# @param {string} transaction_id — transaction id of current request
+def saveDistributedCacheValue(kind, key, value, ttl, transaction_id):
+    cache = getDistributedCache()
+    if cache is None or ttl <= 0:
+        return
+    try:
+        cache.set(kind, key, value, ttl)
+    except Exception as err:
+        metrics.incrementCounter("vault_bridge_distributed_cache_requests_total", {"kind": kind, "result": "error"})
+        logFrameworkException(transaction_id, "saveDistributedCacheValue()", FILE_NAME, str(err))
+
+
 # @param {Flask.app} app 
 # @param {string} message — error message
 # @param {int} code — error code
@@ -246,6 +827,7 @@ def buildExceptionResponse(app, message, code):
 #
 # @returns {dict} - error dict
 def buildExceptionPayload(error_code, reqObj, target=None):
+    metrics.incrementCounter("vault_bridge_errors_total", {"code": error_code})
     trace = ""
     if reqObj != None:
         trace = reqObj.transaction_id
@@ -268,6 +850,7 @@ def buildExceptionPayload(error_code, reqObj, target=None):
 #
 # @returns {dict} - error dict
 def buildFrameworkExceptionPayload(error_code, trace, target=None):
+    metrics.incrementCounter("vault_bridge_errors_total", {"code": error_code})
     return {
         "errors": [
             {
@@ -282,102 +865,401 @@ def buildFrameworkExceptionPayload(error_code, trace, target=None):
     }
 
 
-# @param {int} index - thread index
-# @param {vault object} vault — the vault object
-# @param {array} response_data — response_data data array
+BULK_EXECUTOR = None
+BULK_EXECUTOR_LOCK = threading.Lock()
+
+# @returns {ThreadPoolExecutor} process wide executor shared by all bulk requests
+def getBulkExecutor():
+    global BULK_EXECUTOR
+    if BULK_EXECUTOR is None:
+        with BULK_EXECUTOR_LOCK:
+            if BULK_EXECUTOR is None:
+                BULK_EXECUTOR = ThreadPoolExecutor(max_workers=BULK_MAX_WORKERS, thread_name_prefix="bulk")
+    return BULK_EXECUTOR
+
+
+# worker threads do not survive a fork, so a forked gunicorn worker creates its own executor
+def resetBulkExecutorAfterFork():
+    global BULK_EXECUTOR, BULK_EXECUTOR_LOCK
+    BULK_EXECUTOR = None
+    BULK_EXECUTOR_LOCK = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetBulkExecutorAfterFork)
+
+
+# @param {vault object} source — vault object whose auth header has been extracted and auth context prepared
+# @param {vault object} target — vault object of an item of the same bulk request
 #
-# @returns None
-def bulkThreadFunction(index, vault, response_data):
-    logDebug(vault, "bulkThreadFunction()", FILE_NAME, f"Thread - {index} of vault {vault.secret_urn} is running")
+# the shared values are only read by the items, so they can be used by several threads at once
+def shareAuthContext(source, target):
+    for attribute in source.AUTH_CONTEXT_ATTRIBUTES:
+        setattr(target, attribute, getattr(source, attribute))
+
+
+# @param {array} vaults — vault objects of the bulk request
+#
+# @returns {array} groups of (index, vault) items requesting the same vault secret, in order of first appearance
+#
+# items differing only in secret urn or secret type read the same secret from the vault, so it is fetched once per group
+def groupBulkVaults(vaults):
+    groups = {}
+    for index, vault in enumerate(vaults):
+        secret_identifier = getattr(vault, "secret_id", None) or getattr(vault, "secret_name", "")
+        groups.setdefault(secret_identifier, []).append((index, vault))
+    return list(groups.values())
+
+
+# @param {dict} error — error payload
+# @param {vault object} vault — the vault object of the item
+#
+# @returns {dict} copy of the error payload for the item
+def buildBulkItemError(error, vault):
+    item_error = copy.deepcopy(error)
+    item_error[SECRET_URN] = vault.secret_urn
+    return item_error
+
+
+# @param {array} vaults — vault objects of the bulk request reading distinct secrets
+#
+# @returns {array} (secret, error, code) of each vault object, in the same order
+#
+# bridges defining fetchSecretBatch() read several secrets with one request to the vault
+def fetchBulkSecrets(vaults):
+    if len(vaults) == 1:
+        return [vaults[0].fetchSecret()]
+    return vaults[0].fetchSecretBatch(vaults)
 
-    error, _ = vault.extractFromVaultAuthHeader()
-    if error is not None:
-        error[SECRET_URN] = vault.secret_urn
-        response_data.append(error)
-        return
 
-    extracted_secret, error, _ = vault.processRequestGetSecret(True)
+# @param {array} batch — groups of (index, vault) items of the bulk request, each group requesting one vault secret
+#
+# @returns {array} index and extracted secret or error payload of each item of the batch
+def bulkThreadFunction(batch):
+    leader = batch[0][0][1]
+    logDebug(leader, "bulkThreadFunction()", FILE_NAME, "Thread of %d secret(s) starting with vault %s is running", len(batch), leader.secret_urn)
+
+    results = {}
+    try:
+        uncached_groups = readCachedBulkItems(batch, results)
+
+        fetched_secrets = []
+        if len(uncached_groups) > 0:
+            with timeStage("fetch_secret"):
+                fetched_secrets = fetchBulkSecrets([uncached[0][1] for uncached in uncached_groups])
+
+        extractBulkItems(uncached_groups, fetched_secrets, results)
+    except Exception as err:
+        logException(leader, "bulkThreadFunction()", FILE_NAME, str(err))
+
+    logDebug(leader, "bulkThreadFunction()", FILE_NAME, "Thread of %d secret(s) starting with vault %s is finished", len(batch), leader.secret_urn)
+    return collectBulkBatchResults(batch, results)
+
+
+# @param {array} batch — groups of (index, vault) items of the bulk request, each group requesting one vault secret
+# @param {dict} results — index to result of the items, filled with the cached secrets
+#
+# @returns {array} groups of (index, vault) items whose secret is not cached
+def readCachedBulkItems(batch, results):
+    uncached_groups = []
+    for group in batch:
+        uncached = []
+        for index, vault in group:
+            cached_secret = getCachedVaultSecret(vault, True)
+            if cached_secret is not None:
+                with startSpan("bulk_item", dict(getBulkItemSpanAttributes(index, vault), **{"vault_bridge.cache_hit": True})):
+                    results[index] = cached_secret
+            else:
+                uncached.append((index, vault))
+        if len(uncached) > 0:
+            uncached_groups.append(uncached)
+    return uncached_groups
+
+
+# @param {array} uncached_groups — groups of (index, vault) items whose secret was read from the vault
+# @param {array} fetched_secrets — (secret, error, code) read for each group, in the same order
+# @param {dict} results — index to result of the items, filled with the extracted secrets or error payloads
+def extractBulkItems(uncached_groups, fetched_secrets, results):
+    if len(fetched_secrets) != len(uncached_groups):
+        leader = uncached_groups[0][0][1]
+        logException(leader, "extractBulkItems()", FILE_NAME, "Got %d results for %d secrets, the secrets without a result are failed", len(fetched_secrets), len(uncached_groups))
+
+    for uncached, (secret, error, _) in zip(uncached_groups, fetched_secrets):
+        for index, vault in uncached:
+            with startSpan("bulk_item", getBulkItemSpanAttributes(index, vault)) as span:
+                results[index] = extractBulkItem(vault, secret, error)
+                if "errors" in results[index]:
+                    setSpanAttributes(span, {"error.type": results[index]["errors"][0].get("code", "")})
+
+
+# @param {array} batch — groups of (index, vault) items of the bulk request
+# @param {dict} results — index to result of the items read so far
+#
+# @returns {array} index and result of each item of the batch
+#
+# items left without a result by an exception or a short batch response fail on their own
+def collectBulkBatchResults(batch, results):
+    error = None
+    for group in batch:
+        for index, vault in group:
+            if index not in results:
+                if error is None:
+                    error = buildFrameworkExceptionPayload("vaultbridgesdk_e_10900", batch[0][0][1].transaction_id)
+                results[index] = buildBulkItemError(error, vault)
+    return [(index, results[index]) for group in batch for index, _ in group]
+
+
+# @param {int} index — index of the item in the bulk request
+# @param {vault object} vault — the vault object of the item
+#
+# @returns {dict} attributes of the span of a bulk item
+def getBulkItemSpanAttributes(index, vault):
+    return {"vault_bridge.item_index": index, "vault_bridge.secret_urn": vault.secret_urn or "", TRANSACTION_ID_ATTRIBUTE: vault.transaction_id or ""}
+
+
+# @param {vault object} vault — the vault object of the item
+# @param {string} secret — raw secret read from the vault for the group of the item
+# @param {dict} error — error payload of the read, None if the secret was read
+#
+# @returns {dict} extracted secret or error payload of the item
+def extractBulkItem(vault, secret, error):
     if error is not None:
-        error[SECRET_URN] = vault.secret_urn
-        response_data.append(error)
-        return
-    
-    response_data.append(extracted_secret)
-    logDebug(vault, "bulkThreadFunction()", FILE_NAME, f"Thread - {index} of vault {vault.secret_urn} is finished")
+        return buildBulkItemError(error, vault)
+
+    with timeStage("extract_secret"):
+        extracted_secret, item_error, _ = vault.extractSecret(secret, True)
+    if item_error is not None:
+        return buildBulkItemError(item_error, vault)
+
+    saveVaultSecretInCache(vault, extracted_secret)
+    return extracted_secret
+
+
+# @param {array} vaults — vault objects of the bulk request
+#
+# @returns {array} batches of groups, each batch is read from the vault by one thread
+#
+# bridges reading several secrets with one request define SECRET_BATCH_SIZE, the other bridges read one secret per thread
+def batchBulkVaults(vaults):
+    groups = groupBulkVaults(vaults)
+    batch_size = max(1, getattr(vaults[0], "SECRET_BATCH_SIZE", 1)) if len(vaults) > 0 else 1
+    return [groups[start:start + batch_size] for start in range(0, len(groups), batch_size)]
+
+
+# @param {array} vaults — vault objects of the bulk request
+#
+# @yields {int, dict} index and result of each item in completion order
+#
+# at most BULK_MAX_CONCURRENCY_PER_REQUEST batches of the request are read through the shared executor at once,
+# so a single large bulk request cannot occupy every worker
+def iterateBulkResults(vaults):
+    executor = getBulkExecutor()
+    batches = batchBulkVaults(vaults)
+    pending = set()
+    next_batch = 0
+
+    try:
+        while next_batch < len(batches) or pending:
+            while next_batch < len(batches) and len(pending) < BULK_MAX_CONCURRENCY_PER_REQUEST:
+                # the batches record their stages in the timer of the request
+                pending.add(executor.submit(bindRequestTimer(bulkThreadFunction), batches[next_batch]))
+                next_batch = next_batch + 1
+
+            with timeStage("bulk_wait"):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for index, result in future.result():
+                    yield index, result
+    finally:
+        # a streamed response closed by the client stops the batches that have not started yet
+        for future in pending:
+            future.cancel()
+
+
+# @param {array} vaults — vault objects of the bulk request
+#
+# @returns {array} results of the items in the same order as the request
+def runBulkRequest(vaults):
+    response_data = [None] * len(vaults)
+    for index, result in iterateBulkResults(vaults):
+        response_data[index] = result
+    return response_data
+
+
+# @param {array} vaults — vault objects of the bulk request
+# @param {string} transaction_id — transaction id of the bulk request
+#
+# @yields {string} json line of the result of each item in completion order, followed by a summary line
+def streamBulkResults(vaults, transaction_id):
+    succeeded = 0
+    for _, result in iterateBulkResults(vaults):
+        if "errors" not in result:
+            succeeded = succeeded + 1
+        yield json.dumps(result) + "\n"
 
+    summary = {"total": len(vaults), "succeeded": succeeded, "failed": len(vaults) - succeeded, "trace": transaction_id}
+    logFrameworkDebug(transaction_id, "streamBulkResults()", FILE_NAME, "Streamed %d results of the bulk request %s", len(vaults), transaction_id)
+    yield json.dumps({"summary": summary}) + "\n"
+
+
+# @param {string} url - request url
+#
+# @returns {string} host of the url and its port unless it is the default port of the scheme, credentials are left out
+def getUrlHost(url):
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if ":" in host:
+        host = f"[{host}]"
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{port}"
+    return host
 
 
 # @param {string} url - request url
 # @param {dict} headers — request header
 # @param {dict} data — request data
+# @param {RetryPolicy} retry_policy — retry policy of the request, the default policy if not set
 #
 # @returns {python response object} response
-def sendGetRequest(url, headers, data):
-    retry = 1
-
-    while retry <= VAULT_REQUEST_RETRY_COUNT:
-        response = requests.get(url, headers=headers, data=data, verify=SKIP_TLS_VERIFY=='false', timeout=VAULT_REQUEST_TIMEOUT)
-        logFrameworkDebug(None, "sendGetRequest()", FILE_NAME, f"send_get_request to {url}, and get response: {response}")
-
-        # retry the request if response status code in RETRY_ERROR_CODE_LIST
-        if response.status_code in RETRY_ERROR_CODE_LIST:
-            retry_delay = VAULT_REQUEST_RETRY_BACKOFF_FACTOR * (2 ** (retry))
-            if retry >= VAULT_REQUEST_RETRY_COUNT:
-                break
-            logFrameworkDebug(None, "sendGetRequest()", FILE_NAME, f"receive {response.status_code}, and tried {retry} times, and retry delay is {retry_delay}")
-            retry = retry + 1
-            time.sleep(retry_delay)
-        else:
-            break
-    return response
-
-
-def sendPostRequest(url, headers, data):
-    retry = 1
-
-    while retry <= VAULT_REQUEST_RETRY_COUNT:
-        response = requests.post(url, headers=headers, data=data, verify=SKIP_TLS_VERIFY=='false', timeout=VAULT_REQUEST_TIMEOUT)
-        logFrameworkDebug(None, "sendPostRequest()", FILE_NAME, f"send_get_request to {url}, and get response: {response}")
-        
-        # retry the request if response status code in RETRY_ERROR_CODE_LIST
-        if response.status_code in RETRY_ERROR_CODE_LIST:
-            if retry >= VAULT_REQUEST_RETRY_COUNT:
-                break
-            retry_delay = VAULT_REQUEST_RETRY_BACKOFF_FACTOR * (2 ** (retry))
-            logFrameworkDebug(None, "sendPostRequest()", FILE_NAME, f"receive {response.status_code}, and tried {retry} times, and retry delay is {retry_delay}")
-            retry = retry + 1
-            time.sleep(retry_delay)
-        else:
-            break
-    return response
-
-
-def extractReqObj(reqObj):
-    if reqObj == None:
-        return ""
-    return f"[TransactionID={reqObj.transaction_id}]  [SecretUrn={reqObj.secret_urn}]"
+def sendGetRequest(url, headers, data, retry_policy=None):
+    return sendRequest("GET", url, headers, data, retry_policy)
+
+
+# @param {string} url - request url
+# @param {dict} headers — request header
+# @param {dict} data — request data
+# @param {RetryPolicy} retry_policy — retry policy of the request, the default policy if not set
+#
+# @returns {python response object} response
+def sendPostRequest(url, headers, data, retry_policy=None):
+    return sendRequest("POST", url, headers, data, retry_policy)
+
+
+# @param {string} method - http method
+# @param {string} url - request url
+# @param {dict} headers — request header
+# @param {dict} data — request data
+# @param {RetryPolicy} retry_policy — retry policy of the request, the default policy if not set
+#
+# @returns {python response object} response
+#
+# responses with a status code in RETRY_ERROR_CODE_LIST, connection errors and timeouts are retried as long as the
+# retry policy allows, the connection error or timeout of the last attempt is raised to the caller
+#
+# CircuitOpenError is raised without sending the request while the circuit breaker of the host is open
+def sendRequest(method, url, headers, data, retry_policy=None):
+    if retry_policy is None:
+        retry_policy = getRetryPolicy()
+    host = getUrlHost(url)
+    breaker = getCircuitBreaker(host)
+    verify = SKIP_TLS_VERIFY == 'false'
+    deadline = retry_policy.getDeadline()
+    attempt = 1
+
+    while True:
+        if breaker is not None:
+            breaker.beforeRequest()
+
+        start = time.perf_counter()
+        response = None
+        request_error = None
+        failed = True
+        # one span per attempt, the query string is left out of the url
+        span_attributes = {"http.request.method": method, "server.address": host, "url.full": url.split("?", 1)[0], "vault_bridge.attempt": attempt}
+        with startSpan(method, span_attributes, client=True) as span:
+            try:
+                response = getSession(url, verify).request(method, url, headers=headers, data=data, verify=verify, timeout=retry_policy.getTimeout(deadline))
+                logFrameworkDebug(None, "sendRequest()", FILE_NAME, "send %s request to %s, and get response: %s", method, url, response)
+                failed = response.status_code >= HTTP_INTERNAL_SERVER_ERROR_CODE
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                request_error = err
+            finally:
+                if breaker is not None:
+                    breaker.recordResult(failed)
+            if response is not None:
+                setSpanAttributes(span, {"http.response.status_code": response.status_code})
+            if failed:
+                setSpanAttributes(span, {"error.type": str(response.status_code) if response is not None else type(request_error).__name__})
+        metrics.observeHistogram("vault_bridge_outbound_request_duration_seconds", {"host": metrics.getHostLabel(host), "method": method}, time.perf_counter() - start)
+
+        retry_delay = retry_policy.getRetryDelay(attempt, response, deadline)
+        if retry_delay is None:
+            if request_error is not None:
+                raise request_error
+            return response
+
+        reason = response.status_code if response is not None else type(request_error).__name__
+        logFrameworkDebug(None, "sendRequest()", FILE_NAME, "receive %s, and tried %d times, and retry delay is %s", reason, attempt, retry_delay)
+        metrics.incrementCounter("vault_bridge_outbound_retries_total", {"host": metrics.getHostLabel(host), "method": method})
+        recordStageRetry()
+        attempt = attempt + 1
+        time.sleep(retry_delay)
+
+
+# @returns {array} counters of the connection pool and the secret cache exported as metrics
+def collectCacheMetrics():
+    pool_stats = getPoolStats()
+    return [
+        ("vault_bridge_connection_pool_requests_total", {"result": "hit"}, pool_stats["hits"]),
+        ("vault_bridge_connection_pool_requests_total", {"result": "miss"}, pool_stats["misses"]),
+        ("vault_bridge_secret_cache_requests_total", {"result": "hit"}, caches.CACHED_SECRET_STATS["hits"]),
+        ("vault_bridge_secret_cache_requests_total", {"result": "miss"}, caches.CACHED_SECRET_STATS["misses"]),
+    ]
+
+metrics.registerCollector(collectCacheMetrics)
+
+
+# @param {string} route — route rule of the request
+# @param {string} vault_type — vault type in the request path
+# @param {int} status_code — http status code of the response
+# @param {float} duration — seconds spent serving the request
+def recordRequestMetrics(route, vault_type, status_code, duration):
+    # unsupported vault types are reported together, so request paths cannot grow the number of series
+    if vault_type not in VAULT_TYPES:
+        vault_type = ""
+    metrics.startMetricsFlushThread()
+    metrics.incrementCounter("vault_bridge_requests_total", {"route": route, "vault_type": vault_type, "status": status_code})
+    metrics.observeHistogram("vault_bridge_request_duration_seconds", {"route": route, "vault_type": vault_type}, duration)
+
+
+# @param {int} level — log level
+# @param {object} reqObj — vault object of the request, None if there is none
+# @param {string} func_name — name of the logging function
+# @param {string} file_name — name of the logging file
+# @param {string} message — message, formatted with args by the log handler when args are given
+# @param {tuple} args — arguments of the message
+#
+# the request of the line is passed as record attributes and only added to the message by the log formatter
+def logWithReqObj(level, reqObj, func_name, file_name, message, args):
+    transaction_id, secret_urn = (None, None) if reqObj is None else (reqObj.transaction_id, reqObj.secret_urn)
+    LOGGER.log(level, message, *args, extra={"transaction_id": transaction_id, "secret_urn": secret_urn, "func_name": func_name, "file_name": file_name})
+
 
-def logException(reqObj, func_name, file_name, message):
-    LOGGER.error(f"{extractReqObj(reqObj)} {file_name}:{func_name} - {message}")
+# the log functions return before anything is formatted when the level is disabled, pass the values of a
+# debug message as args, e.g. logDebug(self, "getSecret()", FILE_NAME, "got %s", response), to format it only when written
+def logException(reqObj, func_name, file_name, message, *args):
+    if LOGGER.isEnabledFor(logging.ERROR):
+        logWithReqObj(logging.ERROR, reqObj, func_name, file_name, message, args)
 
 
-def logInfo(reqObj, func_name, file_name, message):
-    LOGGER.info(f"{extractReqObj(reqObj)} {file_name}:{func_name} - {message}")
+def logInfo(reqObj, func_name, file_name, message, *args):
+    if LOGGER.isEnabledFor(logging.INFO):
+        logWithReqObj(logging.INFO, reqObj, func_name, file_name, message, args)
 
 
-def logDebug(reqObj, func_name, file_name, message):
-    LOGGER.debug(f"{extractReqObj(reqObj)} {file_name}:{func_name} - {message}")
+def logDebug(reqObj, func_name, file_name, message, *args):
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        logWithReqObj(logging.DEBUG, reqObj, func_name, file_name, message, args)
 
 
-def logFrameworkException(transaction_id, func_name, file_name, message):
-    trans_section = ""
-    if transaction_id != None:
-        trans_section = f"[TransactionID={transaction_id}]"
-    LOGGER.error(f"{trans_section} {file_name}:{func_name} - {message}")
+def logFrameworkException(transaction_id, func_name, file_name, message, *args):
+    if LOGGER.isEnabledFor(logging.ERROR):
+        LOGGER.error(message, *args, extra={"transaction_id": transaction_id, "secret_urn": None, "func_name": func_name, "file_name": file_name})
 
 
-def logFrameworkDebug(transaction_id, func_name, file_name, message):
-    trans_section = ""
-    if transaction_id != None:
-        trans_section = f"[TransactionID={transaction_id}]"
-    LOGGER.debug(f"{trans_section} {file_name}:{func_name} - {message}")
\ No newline at end of file
+def logFrameworkDebug(transaction_id, func_name, file_name, message, *args):
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug(message, *args, extra={"transaction_id": transaction_id, "secret_urn": None, "func_name": func_name, "file_name": file_name})
@@ -1,12 +1,16 @@
-from flask import Flask, request, json
-import logging
-from .framework.utils import authenticate, validateParams, validateParamsForBulkRequest, buildExceptionResponse, buildFrameworkExceptionPayload, \
-                            bulkThreadFunction, logFrameworkDebug, logFrameworkException, getCurrentFilename
+from flask import Flask, request, json, g
+import time
+from .framework.utils import recordRequestMetrics, authenticate, validateParams, validateParamsForBulkRequest, buildExceptionResponse, buildFrameworkExceptionPayload, \
+                            runBulkRequest, streamBulkResults, shareAuthContext, validateHeadersForBulkPostRequest, processRequestGetSecretWithCache, logFrameworkDebug, logFrameworkException, getCurrentFilename
 from .bridges_common.constants import *
 from .bridges_common.bridge_lookup import CLASS_LOOKUP
+from .framework.metrics import renderMetrics
+from .framework.json_stream import iterateJsonArrayBody, RequestBodyTooLargeError, MalformedRequestBodyError
+from .framework.request_timing import startRequestTimer, clearRequestTimer, finishRequestTimer, timeStage, buildServerTimingHeader, iterateWithRequestTimer
+from .framework.tracing import startRequestSpan
+from .framework.log_handlers import configureLogging
 import os
 import base64
-import threading
 import sys
 
 LOGGING_LEVEL = os.environ.get('LOGGING_LEVEL', 'INFO')
@@ -14,20 +18,68 @@ if LOGGING_LEVEL not in LOGGING_LEVEL_LIST:
     LOGGING_LEVEL = 'INFO'
 
 app = Flask('vaults')
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter('[%(asctime)s] - %(levelname)s - %(message)s'))
-app.logger.handlers.clear()
-app.logger.addHandler(handler)
-app.logger.setLevel(LOGGING_LEVEL)
+configureLogging(app.logger, LOGGING_LEVEL)
 
 FILE_NAME = getCurrentFilename(__file__)
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    transaction_id = request.headers.get(TRANSACTION_ID_HEADER)
+    span = None
+    # health checks and metric scrapes are not traced
+    if request.url_rule is not None and VAULT_TYPE in (request.view_args or {}):
+        span = startRequestSpan(request.url_rule.rule, request.method, request.headers, transaction_id)
+    g.request_timer = startRequestTimer(transaction_id, span)
+
+
+@app.after_request
+def record_request_metrics(response):
+    if request.url_rule is not None and "request_start" in g:
+        vault_type = (request.view_args or {}).get(VAULT_TYPE, "")
+        recordRequestMetrics(request.url_rule.rule, vault_type, response.status_code, time.perf_counter() - g.request_start)
+    return response
+
+
+@app.after_request
+def record_request_timing(response):
+    if "request_timer" not in g:
+        return response
+
+    timer = g.request_timer
+    server_timing = buildServerTimingHeader(timer)
+    if server_timing is not None:
+        response.headers[SERVER_TIMING_HEADER] = server_timing
+
+    if request.url_rule is None:
+        return response
+    finish_args = (timer, request.method, request.url_rule.rule, (request.view_args or {}).get(VAULT_TYPE, ""), response.status_code)
+    if response.is_streamed:
+        # the results of a streamed bulk request are read while the body is sent, after the handler has returned
+        response.response = iterateWithRequestTimer(timer, response.response, lambda: finishRequestTimer(*finish_args))
+    else:
+        finishRequestTimer(*finish_args)
+    return response
+
+
+@app.teardown_request
+def clear_request_timer(exc):
+    clearRequestTimer()
+
+
 # GET /health
 # RESPONSE "OK" HTTP_SUCCESS_CODE
 @app.route("/v2/health", methods=["GET"])
 def health():
     return json.dumps({"status": "OK"})
 
+
+# GET /v2/metrics
+# RESPONSE metrics of all workers in Prometheus text format HTTP_SUCCESS_CODE
+@app.route("/v2/metrics", methods=["GET"])
+def get_metrics():
+    return app.response_class(response=renderMetrics(), status=HTTP_SUCCESS_CODE, mimetype='text/plain; version=0.0.4')
+
 # GET /v2/vault-bridges/<vault_type>/secrets/<secret_urn>
 # @url_param {string} vault_type - value from {ibm-secret-manager|aws-secrets-manager|azure-kv-vault}
 # @url_param {string} secret_urn Uniform Resource Name
@@ -48,42 +100,78 @@ def health():
 @app.route("/v2/vault-bridges/<vault_type>/secrets/<secret_urn>", methods=["GET"])
 def get_secret(vault_type, secret_urn):
 
-    secret_reference_metadata, secret_type, auth_string, transaction_id, error, code = validateParams(request)
+    extracted_secret, error, code = processGetSecret(request, vault_type, secret_urn)
     if error is not None:
         return buildExceptionResponse(app, error, code)
+
+    return json.dumps(extracted_secret)
+
+
+# @param {flask.request} req — incoming request, or any object with the same args and headers
+# @param {string} vault_type — vault type
+# @param {string} secret_urn — secret urn
+#
+# @returns {dict} extracted secret
+# @returns {string} error message if any
+# @returns {number} status code
+def processGetSecret(req, vault_type, secret_urn):
+
+    vault, error, code = prepareGetSecret(req, vault_type, secret_urn)
+    if error is not None:
+        return None, error, code
+
+    # get the secret
+    extracted_secret, error, code = processRequestGetSecretWithCache(vault)
+    if error is not None:
+        return None, error, code
+
+    logFrameworkDebug(vault.transaction_id, "processGetSecret()", FILE_NAME, "Sending response for transaction %s and secret %s with vault type %s", vault.transaction_id, secret_urn, vault_type)
+    return extracted_secret, None, None
+
+
+# @param {flask.request} req — incoming request, or any object with the same args and headers
+# @param {string} vault_type — vault type
+# @param {string} secret_urn — secret urn
+#
+# @returns {vault object} vault object of the request, its auth header and reference metadata extracted
+# @returns {string} error message if any
+# @returns {number} status code
+def prepareGetSecret(req, vault_type, secret_urn):
+
+    with timeStage("validate_params"):
+        secret_reference_metadata, secret_type, auth_string, transaction_id, error, code = validateParams(req)
+    if error is not None:
+        return None, error, code
     
-    logFrameworkDebug(transaction_id, "get_secret()", FILE_NAME, f"Receiving request for secret {secret_urn} with vault type {vault_type}") 
+    logFrameworkDebug(transaction_id, "prepareGetSecret()", FILE_NAME, "Receiving request for secret %s with vault type %s", secret_urn, vault_type) 
     
-    HttpHeader = request.headers
-    _, error, code = authenticate(HttpHeader)
+    HttpHeader = req.headers
+    with timeStage("authenticate"):
+        _, error, code = authenticate(HttpHeader)
     if error is not None:
-        return buildExceptionResponse(app, error, code)  
+        return None, error, code
 
     if vault_type not in VAULT_TYPES:
         target = {"name": VAULT_TYPE, "type": "parameter"}
-        return buildExceptionResponse(app, buildFrameworkExceptionPayload("vaultsdkbridge_e_10002", transaction_id, target), HTTP_BAD_REQUEST_CODE)
+        return None, buildFrameworkExceptionPayload("vaultsdkbridge_e_10002", transaction_id, target), HTTP_BAD_REQUEST_CODE
     
     if secret_type not in SECRET_TYPES[vault_type]:
         target = {"name": SECRET_REFERENCE_METADATA, "type": "query-param"}
-        return buildExceptionResponse(app, buildFrameworkExceptionPayload("vaultbridgesdk_e_10003", transaction_id, target), HTTP_BAD_REQUEST_CODE)
+        return None, buildFrameworkExceptionPayload("vaultbridgesdk_e_10003", transaction_id, target), HTTP_BAD_REQUEST_CODE
 
     vault = CLASS_LOOKUP[vault_type](secret_reference_metadata, secret_type, secret_urn, auth_string, transaction_id)
-    error, code = vault.extractFromVaultAuthHeader()
+    with timeStage("extract_auth_header"):
+        error, code = vault.extractFromVaultAuthHeader()
     if error is not None:
-        return buildExceptionResponse(app, error, code)
+        return None, error, code
     
     # get secret_id
-    error, code = vault.extractSecretReferenceMetadata()
-    if error is not None:
-        return buildExceptionResponse(app, error, code)
-
-    # get the secret
-    extracted_secret, error, code = vault.processRequestGetSecret()
+    with timeStage("extract_reference_metadata"):
+        error, code = vault.extractSecretReferenceMetadata()
     if error is not None:
-        return buildExceptionResponse(app, error, code)
+        return None, error, code
 
-    logFrameworkDebug(transaction_id, "get_secret()", FILE_NAME, f"Sending response for transaction {transaction_id} and secret {secret_urn} with vault type {vault_type}")
-    return json.dumps(extracted_secret)
+    return vault, None, None
 
 
 # GET /v2/vault-bridges/<vault_type>/secrets/bulk
@@ -93,49 +181,203 @@ def get_secret(vault_type, secret_urn):
 #
 # @header {string} Vault-Auth - <VAULT_URL=;API_KEY=;> Note: value need to be separated by semicolon
 # @header {string} IBM-CPD-Transaction-ID - transaction id
+# @header {string} Accept - application/x-ndjson to stream one json line per secret as soon as it is read, followed by a summary line
 # 
 # SUCCESS RESPONSE {SECRET_JSON_STRING} 200
 @app.route("/v2/vault-bridges/<vault_type>/secrets/bulk", methods=["GET"])
 def get_bulk_secret(vault_type):
+    return respondBulkSecret(request, vault_type, prepareBulkRequest)
+
+
+# POST /v2/vault-bridges/<vault_type>/secrets/bulk
+# @url_param {string} vault_type - value from {ibm-secret-manager|aws-secrets-manager|azure-kv-vault}
+#
+# @body {array} json array of secret references, the decoded form of the secret_reference_metadata query param of the GET request
+#
+# @header {string} Vault-Auth - <VAULT_URL=;API_KEY=;> Note: value need to be separated by semicolon
+# @header {string} IBM-CPD-Transaction-ID - transaction id
+# @header {string} Content-Encoding - gzip for a gzip compressed body
+# @header {string} Accept - application/x-ndjson to stream one json line per secret as soon as it is read, followed by a summary line
+# 
+# SUCCESS RESPONSE {SECRET_JSON_STRING} 200
+@app.route("/v2/vault-bridges/<vault_type>/secrets/bulk", methods=["POST"])
+def post_bulk_secret(vault_type):
+    return respondBulkSecret(request, vault_type, prepareBulkPostRequest)
+
+
+# @param {flask.request} req — incoming request
+# @param {string} vault_type — vault type
+# @param {function} prepare — function returning the vault objects of the bulk request
+#
+# @returns {Flask.app.response_class} flask response
+def respondBulkSecret(req, vault_type, prepare):
+
+    if acceptsNdjson(req):
+        lines, error, code = processGetBulkSecretStream(req, vault_type, prepare)
+        if error is not None:
+            return buildExceptionResponse(app, error, code)
+        return app.response_class(response=lines, status=HTTP_SUCCESS_CODE, mimetype=NDJSON_MIMETYPE)
 
-    secret_reference_metadata, auth_string, transaction_id, error, code = validateParamsForBulkRequest(request)
+    response_data, error, code = processGetBulkSecret(req, vault_type, prepare)
     if error is not None:
         return buildExceptionResponse(app, error, code)
+
+    return json.dumps(response_data)
+
+
+# @param {flask.request} req — incoming request, or any object with the same headers
+#
+# @returns {bool} true if the client asked for the results of a bulk request as a stream of json lines
+def acceptsNdjson(req):
+    return NDJSON_MIMETYPE in req.headers.get(ACCEPT_HEADER, "")
+
+
+# @param {flask.request} req — incoming request, or any object with the same args and headers
+# @param {string} vault_type — vault type
+# @param {function} prepare — function returning the vault objects of the bulk request
+#
+# @returns {generator} json lines of the results of the items as soon as they complete, followed by a summary line
+# @returns {string} error message if any
+# @returns {number} status code
+def processGetBulkSecretStream(req, vault_type, prepare=None):
+
+    vaults, transaction_id, error, code = (prepare or prepareBulkRequest)(req, vault_type)
+    if error is not None:
+        return None, error, code
+
+    logFrameworkDebug(transaction_id, "processGetBulkSecretStream()", FILE_NAME, "Streaming response for the bulk request with secret %s with vault type %s", transaction_id, vault_type)
+    return streamBulkResults(vaults, transaction_id), None, None
+
+
+# @param {flask.request} req — incoming request, or any object with the same args and headers
+# @param {string} vault_type — vault type
+# @param {function} prepare — function returning the vault objects of the bulk request
+#
+# @returns {array} results of the items in the same order as the request
+# @returns {string} error message if any
+# @returns {number} status code
+def processGetBulkSecret(req, vault_type, prepare=None):
+
+    vaults, transaction_id, error, code = (prepare or prepareBulkRequest)(req, vault_type)
+    if error is not None:
+        return None, error, code
+
+    # fetch the secrets on the shared bulk executor, results keep the order of the request
+    response_data = runBulkRequest(vaults)
+
+    logFrameworkDebug(transaction_id, "processGetBulkSecret()", FILE_NAME, "Sending response for the bulk request with secret %s with vault type %s", transaction_id, vault_type)
+    return response_data, None, None
+
+
+# @param {flask.request} req — incoming request, or any object with the same args and headers
+# @param {string} vault_type — vault type
+# @param {bool} prepare_auth_context — false to leave the auth context to the caller, see buildBulkVaults()
+#
+# @returns {array} vault objects of the items in the request
+# @returns {string} transaction id
+# @returns {string} error message if any
+# @returns {number} status code
+def prepareBulkRequest(req, vault_type, prepare_auth_context=True):
+
+    with timeStage("validate_params"):
+        secret_reference_metadata, auth_string, transaction_id, error, code = validateParamsForBulkRequest(req)
+    if error is not None:
+        return None, transaction_id, error, code
     
-    HttpHeader = request.headers
-    _, error, code = authenticate(HttpHeader)
+    HttpHeader = req.headers
+    with timeStage("authenticate"):
+        _, error, code = authenticate(HttpHeader)
     if error is not None:
-        return buildExceptionResponse(app, error, code)  
+        return None, transaction_id, error, code
     
     if vault_type not in VAULT_TYPES:
         target = {"name": VAULT_TYPE, "type": "parameter"}
-        return buildExceptionResponse(app, buildFrameworkExceptionPayload("vaultsdkbridge_e_10002", transaction_id, target), HTTP_BAD_REQUEST_CODE)
+        return None, transaction_id, buildFrameworkExceptionPayload("vaultsdkbridge_e_10002", transaction_id, target), HTTP_BAD_REQUEST_CODE
     try:
-        secret_reference_metadata_list = json.loads(base64.b64decode(secret_reference_metadata).decode('utf-8'))
+        with timeStage("read_references"):
+            secret_reference_metadata_list = json.loads(base64.b64decode(secret_reference_metadata).decode('utf-8'))
     except Exception as err: 
-        logFrameworkException(transaction_id, "get_bulk_secret()", FILE_NAME, f"{transaction_id}: get_bulk_secret() Got error: {str(err)}")
-        return buildExceptionResponse(app, buildFrameworkExceptionPayload("vaultbridgesdk_e_10503", transaction_id), HTTP_BAD_REQUEST_CODE)
+        logFrameworkException(transaction_id, "prepareBulkRequest()", FILE_NAME, f"{transaction_id}: prepareBulkRequest() Got error: {str(err)}")
+        return None, transaction_id, buildFrameworkExceptionPayload("vaultbridgesdk_e_10503", transaction_id), HTTP_BAD_REQUEST_CODE
     
-    response_data = []
-    index = 0
-    threads = list()
-    while index < len(secret_reference_metadata_list):
-        vault = CLASS_LOOKUP[vault_type](secret_reference_metadata_list[index], "", "", auth_string, transaction_id)
-        error, code = vault.extractSecretReferenceMetadataBulk()
-        if error is not None:
-            return buildExceptionResponse(app, error, code)
+    return buildBulkVaults(secret_reference_metadata_list, vault_type, auth_string, transaction_id, prepare_auth_context)
 
-        # have separate thread to handle the request
-        t = threading.Thread(target=bulkThreadFunction, args=(index, vault, response_data))
-        threads.append(t)
-        t.start()
-        index=index+1
-    
-    # waiting for thread to be finished
-    for index, thread in enumerate(threads):
-        logFrameworkDebug(transaction_id, "get_bulk_secret()", FILE_NAME, f"Main: before joining thread {index}")
-        thread.join()
-        logFrameworkDebug(transaction_id, "get_bulk_secret()", FILE_NAME, f"Main: thread {index} done")
 
-    logFrameworkDebug(transaction_id, "get_bulk_secret()", FILE_NAME, f"Sending response for the bulk request with secret {transaction_id} with vault type {vault_type}")
-    return json.dumps(response_data)
+# @param {flask.request} req — incoming request, or any object with the same headers and a body stream
+# @param {string} vault_type — vault type
+# @param {bool} prepare_auth_context — false to leave the auth context to the caller, see buildBulkVaults()
+#
+# @returns {array} vault objects of the items in the request
+# @returns {string} transaction id
+# @returns {string} error message if any
+# @returns {number} status code
+def prepareBulkPostRequest(req, vault_type, prepare_auth_context=True):
+
+    with timeStage("validate_params"):
+        auth_string, transaction_id, error, code = validateHeadersForBulkPostRequest(req)
+    if error is not None:
+        return None, transaction_id, error, code
+
+    with timeStage("authenticate"):
+        _, error, code = authenticate(req.headers)
+    if error is not None:
+        return None, transaction_id, error, code
+
+    if vault_type not in VAULT_TYPES:
+        target = {"name": VAULT_TYPE, "type": "parameter"}
+        return None, transaction_id, buildFrameworkExceptionPayload("vaultsdkbridge_e_10002", transaction_id, target), HTTP_BAD_REQUEST_CODE
+
+    # the references are validated one by one while the body is read, so a large body is never held in memory
+    secret_references = iterateJsonArrayBody(req.stream, req.headers.get(CONTENT_ENCODING_HEADER))
+    try:
+        return buildBulkVaults(secret_references, vault_type, auth_string, transaction_id, prepare_auth_context)
+    except RequestBodyTooLargeError as err:
+        logFrameworkException(transaction_id, "prepareBulkPostRequest()", FILE_NAME, str(err))
+        return None, transaction_id, buildFrameworkExceptionPayload("vaultbridgesdk_e_10505", transaction_id), HTTP_REQUEST_ENTITY_TOO_LARGE_CODE
+    except MalformedRequestBodyError as err:
+        logFrameworkException(transaction_id, "prepareBulkPostRequest()", FILE_NAME, str(err))
+        target = {"name": "body", "type": "body"}
+        return None, transaction_id, buildFrameworkExceptionPayload("vaultbridgesdk_e_10504", transaction_id, target), HTTP_BAD_REQUEST_CODE
+
+
+# @param {iterable} secret_references — secret references of the bulk request
+# @param {string} vault_type — vault type
+# @param {string} auth_string — vault auth header
+# @param {string} transaction_id — transaction id
+# @param {bool} prepare_auth_context — false to only extract the auth header, the async server prepares the auth context
+#                                      of the first item itself and shares it with the others
+#
+# @returns {array} vault objects of the items in the request
+# @returns {string} transaction id
+# @returns {string} error message if any
+# @returns {number} status code
+def buildBulkVaults(secret_references, vault_type, auth_string, transaction_id, prepare_auth_context=True):
+
+    vaults = []
+    # the references of a POST request are parsed from the body while it is read
+    with timeStage("read_references"):
+        for secret_reference in secret_references:
+            vault = CLASS_LOOKUP[vault_type](secret_reference, "", "", auth_string, transaction_id)
+            with timeStage("extract_reference_metadata"):
+                error, code = vault.extractSecretReferenceMetadataBulk()
+            if error is not None:
+                return None, transaction_id, error, code
+            vaults.append(vault)
+
+    # nothing to fetch, so no token is requested for an empty list
+    if len(vaults) == 0:
+        return vaults, transaction_id, None, None
+
+    # all items share the same vault auth header, so it is parsed and exchanged for a token once per request
+    auth_vault = CLASS_LOOKUP[vault_type]({}, "", "", auth_string, transaction_id)
+    with timeStage("extract_auth_header"):
+        error, code = auth_vault.extractFromVaultAuthHeader()
+    if error is None and prepare_auth_context:
+        error, code = auth_vault.prepareAuthContext()
+    if error is not None:
+        return None, transaction_id, error, code
+
+    for vault in vaults:
+        shareAuthContext(auth_vault, vault)
+
+    return vaults, transaction_id, None, None